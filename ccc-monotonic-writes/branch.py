@@ -7,10 +7,21 @@ tfilewic
 Branch server logic and RPC handlers.
 """
 
+import functools
+import grpc
+import random
+import struct
+import threading
 import banks_pb2
 import banks_pb2_grpc
-from utilities import create_channel
-from time import sleep
+from outbox import PeerOutbox, ReplicationStream
+from ledger import Ledger
+from writeset import WriteSet
+from utilities import create_channel, await_acks, Tickets, make_write_id, split_write_id, STATE_CHUNK, PROPAGATION_ACKS, PROPAGATION_BATCHING, PROPAGATION_STREAMING, SYNC_TIMEOUT, WAIT_TIMEOUT, ANTI_ENTROPY_INTERVAL, RECOVERY_RETRY, QUERY
+from time import monotonic
+from array import array
+
+STATE = struct.Struct("<qqq")   #snapshot fields after the ledger and write set: write sequence, pruned origin count and retained history write count
 
 
 class Branch(banks_pb2_grpc.RPCServicer):
@@ -18,19 +29,55 @@ class Branch(banks_pb2_grpc.RPCServicer):
     Represents a branch server.
     Handles local balance updates and propagates changes to peer branches.
     """
-    def __init__(self, id, balance, branches):
+    def __init__(self, id, balance, branches, acks=PROPAGATION_ACKS, batched=PROPAGATION_BATCHING, streamed=PROPAGATION_STREAMING, wal=None):
         # unique ID of the Branch
         self.id = id
-        # replica of the Branch's balance
-        self.balance = balance
+        # replica of the Branch's account balances
+        self.accounts = Ledger(balance)
         # the list of process IDs of the branches
         self.branches = branches
         # the list of Client stubs to communicate with the branches
         self.stubList = list()
-        # write ids this branch has performed
-        self.writeset = set()
-        # next write_id to assign for client writes
-        self.next_write_id = self.id * 1000
+        # write ids this branch has applied
+        self.writeset = WriteSet()
+        # applied writes per origin branch as {sequence: (position, amount, account_id)}, kept to serve catch-up requests until every peer has applied them
+        self.history = {}
+        # highest contiguous write sequence per origin branch each peer reported in its last catch-up request, keyed by peer id
+        self.acknowledged = {}
+        # sequence up to which each origin branch's history has been dropped
+        self.pruned = {}
+        # number of writes applied; a write's position orders the history the way this branch applied it
+        self.position = 0
+        # highest contiguous write sequence applied per origin branch, maintained by the write set
+        self.versions = self.writeset.versions
+        # sequence number of the last client write this branch performed
+        self.sequence = 0
+        # set once the sequence is past every write id this branch issued before a restart; customer writes wait for it
+        self.recovered = threading.Event()
+        # number of peer acks a propagated write waits for (None for all peers)
+        self.acks = acks
+        # guards check-then-act updates to the branch state; reads of balance are lock-free
+        self.lock = threading.Lock()
+        # tickets of the propagation calls in send order; its length is the number still waiting on a peer reply
+        self.calls = Tickets()
+        # notified when the oldest in-flight propagation call completes
+        self.propagated = threading.Condition()
+        # notified under the lock whenever a write is applied
+        self.applied = threading.Condition(self.lock)
+        # number of requests currently blocked waiting for dependent writes
+        self.blocked_waiters = 0
+        # acked propagations waiting for a dependency as (park ticket, write) pairs, keyed by the write id that must be applied next
+        self.parked = {}
+        # parked (park ticket, write) pairs whose awaited write has been applied, to be delivered again
+        self.unparked = []
+        # tickets of the parked propagations, issued when first parked and finished once applied
+        self.parks = Tickets()
+        # write-ahead log of applied writes (None keeps the state in memory only)
+        self.wal = wal
+        # set when the branch stops, ending the anti-entropy loop
+        self.stopping = threading.Event()
+        # thread running the anti-entropy loop (None until started)
+        self.repairer = None
 
         # add all branch stubs to stub list 
         for branch in branches:
@@ -38,34 +85,446 @@ class Branch(banks_pb2_grpc.RPCServicer):
                 channel =  create_channel(branch)
                 self.stubList.append(banks_pb2_grpc.RPCStub(channel))
 
+        # per-peer replication streams or batching queues, in the same order as stubList (empty for unary calls)
+        self.outboxes = []
+        for stub in self.stubList:
+            if streamed:
+                self.outboxes.append(ReplicationStream(stub))
+            elif batched:
+                self.outboxes.append(PeerOutbox(stub))
+
+
+    def restore(self):
+        """
+        Rebuilds the balances and applied writes from the latest snapshot and the WAL tail,
+        then opens the WAL for appends.
+        """
+        if self.wal is None:
+            return
+
+        with self.lock:
+            snapshot = self.wal.load_snapshot()
+            if snapshot is not None:
+                self.load_state(snapshot)
+            for record in self.wal.replay():    #reapply writes logged after the snapshot
+                write = banks_pb2.PropagationRequest.FromString(record)
+                self.apply_write(write.write_id, write.amount, write.account_id)
+        self.wal.open()
+        self.recovered.set()    #the WAL holds every write this branch issued before acking it
+
+    def journal(self, amount, write_id, account_id) -> int:
+        """
+        Appends an applied write to the WAL. Must be called with the lock held.
+
+        Args:
+            amount (int): The amount applied.
+            write_id (int): The unique ID of the write.
+            account_id (int): The account the write applied to.
 
-    def propagate(self, amount, write_id, writeset):
+        Returns:
+            int: The record's WAL sequence number, or 0 without a WAL.
+        """
+        if self.wal is None:
+            return 0
+        record = banks_pb2.PropagationRequest(amount=amount, write_id=write_id, account_id=account_id)
+        return self.wal.append(record.SerializeToString())
+
+    def commit(self, sequence):
+        """
+        Waits until a journaled write is on disk, then takes a snapshot if one is due.
+
+        Args:
+            sequence (int): WAL sequence number returned by journal().
+        """
+        if not sequence:
+            return
+        self.wal.sync(sequence) #group commit with concurrent writers
+        if self.wal.due():
+            self.checkpoint()
+
+    def checkpoint(self):
+        """
+        Snapshots the balances and applied writes and truncates the WAL behind them.
+        """
+        with self.lock: #capture the state and rotate the log at the same point
+            segment = self.wal.rotate()
+            if segment is None:
+                return
+            state = self.dump_state()
+        self.wal.write_snapshot(segment, state)
+
+
+    def stop(self):
+        """
+        Stops the anti-entropy loop and the per-peer outboxes, then closes the WAL.
+        Called once the server has stopped and before the peer channels close.
+        """
+        self.stopping.set()
+        if self.repairer is not None:
+            self.repairer.join()
+        for outbox in self.outboxes:
+            outbox.close()
+        if self.wal is not None:
+            self.wal.close()
+
+    def dump_state(self) -> bytes:
+        """
+        Encodes the ledger, write set, write sequence, pruned sequences and retained write history
+        for a snapshot or a full-state transfer. Must be called with the lock held.
+
+        Returns:
+            bytes: The encoded state.
+        """
+        writes = sorted(
+            (position, make_write_id(origin, sequence), amount, account_id)
+            for origin, applied in self.history.items()
+            for sequence, (position, amount, account_id) in applied.items()
+        )
+        columns = [array("q", self.pruned), array("q", self.pruned.values())]    #pruned origins and sequences
+        columns += [array("q", (write[field] for write in writes)) for field in (1, 2, 3)]  #write ids, amounts, accounts in apply order
+        return self.accounts.dump() + self.writeset.dump() + STATE.pack(self.sequence, len(self.pruned), len(writes)) + b"".join(column.tobytes() for column in columns)
+
+    def load_state(self, data):
+        """
+        Restores the state from a snapshot or full-state transfer written by dump_state().
+        Must be called with the lock held.
+
+        Args:
+            data (bytes): The encoded state.
+        """
+        self.accounts, offset = Ledger.load(data)
+        self.writeset, offset = WriteSet.load(data, offset)
+        self.versions = self.writeset.versions
+        self.sequence, origins, count = STATE.unpack_from(data, offset)
+        offset += STATE.size
+
+        columns = []
+        for length in (origins, origins, count, count, count):
+            column = array("q")
+            column.frombytes(data[offset:offset + 8 * length])
+            offset += 8 * length
+            columns.append(column)
+
+        self.pruned = dict(zip(columns[0], columns[1]))
+        self.history = {}
+        for write_id, amount, account_id in zip(*columns[2:]):  #rebuild the retained history in apply order
+            origin, sequence = split_write_id(write_id)
+            self.position += 1
+            self.history.setdefault(origin, {})[sequence] = (self.position, amount, account_id)
+
+
+    def track(self, calls):
+        """
+        Issues each propagation call a ticket, held until its peer replies.
+
+        Args:
+            calls (list): Call futures returned by the peer stubs.
+        """
+        with self.propagated:
+            tickets = [self.calls.issue() for _ in calls]
+        for call, ticket in zip(calls, tickets):
+            call.add_done_callback(functools.partial(self.untrack, ticket))
+
+    def untrack(self, ticket, call):
+        """
+        Done callback that marks a propagation call as complete and releases the Sync
+        waiters whose earlier calls have all completed.
+
+        Args:
+            ticket (int): The call's ticket.
+            call: The completed call future.
+        """
+        with self.propagated:
+            if self.calls.finish(ticket):
+                self.propagated.notify_all()
+
+    def propagate(self, amount, write_id, versions, account_id):
         """
         Propagates a deposit or withdrawal request to all other branches.
 
+        Sends to every peer at once and waits for the configured number of acks.
+
         Args:
             amount (int): The amount to apply.
             write_id (int): The unique ID of the write operation.
-            writeset (list[int]): IDs of all prior client writes this write depends on.
+            versions (dict[int, int]): Session version vector of prior client writes this write depends on.
+            account_id (int): The account the write applies to.
         """
-        propagation_request = banks_pb2.PropagationRequest(amount=amount, write_id=write_id, writeset=writeset)
+        propagation_request = banks_pb2.PropagationRequest(amount=amount, write_id=write_id, versions=versions, account_id=account_id)
 
-        for branchStub in self.stubList:
-            if (propagation_request.amount > 0):
-                branchStub.Propagate_Deposit(propagation_request)
+        calls = []
+        for peer, branchStub in enumerate(self.stubList):
+            if (propagation_request.amount != 0 and self.outboxes):  #send through the peer's stream or batch queue
+                calls.append(self.outboxes[peer].send(propagation_request))
+            elif (propagation_request.amount > 0):
+                calls.append(branchStub.Propagate_Deposit.future(propagation_request))
             elif (propagation_request.amount < 0):
-                branchStub.Propagate_Withdraw(propagation_request)
+                calls.append(branchStub.Propagate_Withdraw.future(propagation_request))
+
+        self.track(calls)   #count calls for Sync barriers
+        await_acks(calls, self.acks)    #wait for peer acks
+
+    def record_write(self, write_id, amount, account_id):
+        """
+        Marks a write as applied, adds it to the history and advances its origin's contiguous version.
+        Must be called with the lock held.
+
+        Args:
+            write_id (int): The unique ID of the applied write.
+            amount (int): The amount the write applied.
+            account_id (int): The account the write applied to.
+        """
+        origin, applied = split_write_id(write_id)
+        previous = self.versions.get(origin, 0)
+        self.writeset.add(write_id) #also advances the origin's contiguous version
+        sequence = self.versions[origin]
+
+        self.position += 1
+        if (applied > self.pruned.get(origin, 0)):  #every peer already has writes at or below the pruned sequence
+            self.history.setdefault(origin, {})[applied] = (self.position, amount, account_id)
+
+        if self.parked:
+            for covered in range(previous + 1, sequence + 1):   #release propagations parked on the newly covered writes
+                self.unparked.extend(self.parked.pop(make_write_id(origin, covered), ()))
+
+        self.applied.notify_all()   #wake dependency waiters
+
+    def apply_write(self, write_id, amount, account_id) -> bool:
+        """
+        Applies a write received from a peer, the WAL or a catch-up stream unless it is already applied.
+        Must be called with the lock held.
+
+        Args:
+            write_id (int): The unique ID of the write.
+            amount (int): The amount to apply.
+            account_id (int): The account the write applies to.
+
+        Returns:
+            bool: True if the write was applied, False if it was a duplicate.
+        """
+        if write_id in self.writeset:
+            return False
+
+        self.accounts.adjust(account_id, amount)
+        self.record_write(write_id, amount, account_id)
+
+        origin, sequence = split_write_id(write_id)
+        if (origin == self.id): #resume this branch's write ids after the last one issued
+            self.sequence = max(self.sequence, sequence)
+        return True
+
+    def missing_dependency(self, client_versions):
+        """
+        Finds a write this branch still needs before it covers a session version vector.
+        Must be called with the lock held.
+
+        Args:
+            client_versions (dict[int, int]): Highest write sequence depended on per origin branch.
+
+        Returns:
+            int: Write id of the next write needed from the first origin that is behind, or None if covered.
+        """
+        for origin, sequence in client_versions.items():
+            applied = self.versions.get(origin, 0)
+            if (applied < sequence):
+                return make_write_id(origin, applied + 1)
+        return None
 
-    def wait_for_writes(self, client_writeset):
+    def deliver(self, write, ticket=None) -> int:
         """
-        Blocks until this branch has applied all writes in the client's writeset.
+        Applies a propagated write if the writes it depends on are applied, and otherwise
+        parks it under the next write it needs. Parked writes released by this one are
+        delivered in turn. Must be called with the lock held.
 
         Args:
-            client_writeset (iterable): The set of write IDs the client has already completed.
+            write (banks_pb2.PropagationRequest): The propagated write.
+            ticket (int): The write's park ticket if it was parked before, or None.
+
+        Returns:
+            int: WAL sequence number of the last write journaled, or 0 if none was.
+        """
+        sequence = 0
+        ready = [(ticket, write)]
+        while ready:
+            ticket, write = ready.pop()
+            needed = self.missing_dependency(write.versions)
+            if needed is not None:
+                if ticket is None:
+                    ticket = self.parks.issue()
+                self.parked.setdefault(needed, []).append((ticket, write))
+                continue
+
+            if self.apply_write(write.write_id, write.amount, write.account_id):  #idempotently update branch balance
+                sequence = self.journal(write.amount, write.write_id, write.account_id)
+            if ticket is not None and self.parks.finish(ticket):
+                self.applied.notify_all()   #release Sync waiters
+            ready.extend(self.unparked)
+            self.unparked.clear()
+        return sequence
+
+    def catch_up(self, peer) -> int:
         """
-        client_writes = set(client_writeset)
-        while not client_writes.issubset(self.writeset):
-            sleep(0.01)
+        Pulls the writes a peer has applied that this branch is missing and applies them
+        in the order the peer applied them, so their dependencies arrive first. If the peer
+        has already pruned some of them from its history, its whole state is transferred instead.
+
+        Args:
+            peer (int): Index of the peer in stubList.
+
+        Returns:
+            int: Number of writes applied, including parked writes the pulled writes released.
+
+        Raises:
+            grpc.RpcError: If the peer cannot be reached.
+        """
+        with self.lock:
+            summary = banks_pb2.CatchUpRequest(versions=self.versions, id=self.id)
+            applied = len(self.writeset)
+
+        sequence = 0
+        try:
+            for write in self.stubList[peer].Catch_Up(summary):
+                with self.lock:
+                    sequence = self.deliver(write) or sequence  #also releases writes parked on it
+        except grpc.RpcError as error:
+            if (error.code() != grpc.StatusCode.OUT_OF_RANGE):  #the peer no longer holds the writes this branch is missing
+                raise
+            self.transfer_state(peer, summary)
+        self.commit(sequence)
+
+        with self.lock:
+            return len(self.writeset) - applied
+
+    def transfer_state(self, peer, summary):
+        """
+        Replaces the balances and applied writes with a peer's, then reapplies the writes
+        this branch holds that the peer has not applied yet and releases the parked writes
+        the transferred ones cover.
+
+        Args:
+            peer (int): Index of the peer in stubList.
+            summary (banks_pb2.CatchUpRequest): This branch's catch-up request.
+
+        Raises:
+            grpc.RpcError: If the peer cannot be reached.
+        """
+        state = b"".join(chunk.data for chunk in self.stubList[peer].Transfer_State(summary))
+        with self.lock:
+            history, issued = self.history, self.sequence
+            self.load_state(state)
+            self.sequence = max(issued, self.writeset.highest(self.id)) #keep issuing this branch's write ids after its last one
+
+            writes = sorted(
+                (position, make_write_id(origin, sequence), amount, account_id)
+                for origin, applied in history.items()
+                for sequence, (position, amount, account_id) in applied.items()
+            )
+            for _, write_id, amount, account_id in writes:  #writes the peer is missing, in the order this branch applied them
+                self.apply_write(write_id, amount, account_id)
+
+            for needed in [needed for needed in self.parked if needed in self.writeset]:
+                self.unparked.extend(self.parked.pop(needed))
+            released, self.unparked = self.unparked, []
+            for ticket, write in released:
+                self.deliver(write, ticket)
+            self.applied.notify_all()   #wake dependency waiters
+
+        if self.wal is not None:    #the log holds none of the transferred writes
+            self.checkpoint()
+
+    def acknowledge(self, peer, versions):
+        """
+        Records the version vector a peer reported in a catch-up request and drops the
+        history every peer has applied, since no catch-up request can ask for it again.
+        Must be called with the lock held.
+
+        Args:
+            peer (int): ID of the requesting peer branch.
+            versions (dict[int, int]): Highest contiguous write sequence the peer applied per origin branch.
+        """
+        self.acknowledged[peer] = dict(versions)
+        if (len(self.acknowledged) < len(self.branches) - 1):  #some peer has not reported yet
+            return
+
+        for origin, applied in self.history.items():
+            floor = min(reported.get(origin, 0) for reported in self.acknowledged.values())
+            for sequence in range(self.pruned.get(origin, 0) + 1, floor + 1):
+                applied.pop(sequence, None)
+            self.pruned[origin] = max(self.pruned.get(origin, 0), floor)
+
+    def anti_entropy(self, interval):
+        """
+        Background loop that repairs missed propagations: catches up from every peer, retrying
+        unreachable ones every RECOVERY_RETRY seconds until all have answered, then from one
+        random peer per interval. Once every peer has answered, the writes this branch issued
+        before a restart have been pulled back, so customer writes are served.
+
+        Args:
+            interval (float): Seconds between catch-up rounds.
+        """
+        pending = list(range(len(self.stubList)))   #peers not caught up from since the branch started
+        peers = pending
+        while not self.stopping.is_set():
+            unreached = []
+            for peer in peers:
+                try:
+                    self.catch_up(peer)
+                except grpc.RpcError:   #peer unreachable; retried in a later round
+                    unreached.append(peer)
+            pending = [peer for peer in pending if peer in unreached]
+            if not pending:
+                self.recovered.set()
+
+            if self.stopping.wait(RECOVERY_RETRY if pending else interval):
+                return
+            peers = pending or random.sample(range(len(self.stubList)), min(1, len(self.stubList)))
+
+    def start_anti_entropy(self, interval=ANTI_ENTROPY_INTERVAL):
+        """
+        Starts the anti-entropy loop in a daemon thread unless the interval is None. Without
+        anti-entropy a restarted branch cannot recover its write sequence, so customer writes
+        are served at once.
+
+        Args:
+            interval (float): Seconds between catch-up rounds, or None to disable anti-entropy.
+        """
+        if interval is None:
+            self.recovered.set()
+            return
+        self.repairer = threading.Thread(target=self.anti_entropy, args=(interval,), daemon=True)
+        self.repairer.start()
+
+    def wait_for_writes(self, client_versions, timeout=WAIT_TIMEOUT) -> bool:
+        """
+        Blocks until this branch covers the client's session version vector.
+
+        Waiters sleep on the applied condition and only re-check the origins still behind
+        each time a write lands.
+
+        Args:
+            client_versions (dict[int, int]): Highest write sequence the client depends on per origin branch.
+            timeout (float): Maximum number of seconds to wait.
+
+        Returns:
+            bool: True once all writes are applied, False if the timeout expired first.
+        """
+        with self.applied:
+            missing = {origin: sequence for origin, sequence in client_versions.items() if self.versions.get(origin, 0) < sequence}
+            if not missing:
+                return True
+
+            self.blocked_waiters += 1
+            try:
+                deadline = monotonic() + timeout
+                while missing:
+                    remaining = deadline - monotonic()
+                    if (remaining <= 0):
+                        return False
+                    self.applied.wait(remaining)   #woken by the apply path
+                    missing = {origin: sequence for origin, sequence in missing.items() if self.versions.get(origin, 0) < sequence}
+                return True
+            finally:
+                self.blocked_waiters -= 1
 
     """
     Since the assignment spec requires a central handler, all RPC interface methods delegate to MsgDelivery.
@@ -85,6 +544,103 @@ class Branch(banks_pb2_grpc.RPCServicer):
     def Propagate_Withdraw(self, request, context):
         return self.MsgDelivery(request, context)
 
+    def Replicate(self, request_iterator, context):
+        """
+        Applies a peer's replication stream in order, delegating each propagation to MsgDelivery
+        and acking cumulatively.
+        """
+        for message in request_iterator:
+            self.MsgDelivery(message.request, context)
+            yield banks_pb2.ReplicationAck(sequence=message.sequence)
+
+    def Propagate_Batch(self, request, context):
+        """
+        Applies a batch of propagations in order, delegating each one to MsgDelivery.
+        """
+        response = banks_pb2.PropagationBatchResponse()
+        for entry in request.requests:
+            response.responses.append(self.MsgDelivery(entry, context))
+        return response
+
+    def Catch_Up(self, request, context):
+        """
+        Anti-entropy: streams the writes this branch has applied beyond the requester's version vector,
+        in the order this branch applied them. Only the missing sequence ranges are visited. The
+        requester's version vector also acknowledges the writes it has applied, so history every
+        peer has applied is dropped. Fails with OUT_OF_RANGE if the requester is missing pruned
+        writes, which it must then fetch with Transfer_State.
+        """
+        with self.lock:
+            if (request.id in self.branches and request.id != self.id):
+                self.acknowledge(request.id, request.versions)
+            if any(request.versions.get(origin, 0) < pruned for origin, pruned in self.pruned.items()):
+                context.abort(grpc.StatusCode.OUT_OF_RANGE, "missing writes were pruned from the history")
+            missing = []
+            for origin, applied in self.history.items():
+                for sequence in range(request.versions.get(origin, 0) + 1, self.writeset.highest(origin) + 1):
+                    write = applied.get(sequence)
+                    if write is not None:
+                        missing.append((write, make_write_id(origin, sequence)))
+        missing.sort()
+
+        for (_, amount, account_id), write_id in missing:
+            yield banks_pb2.PropagationRequest(amount=amount, write_id=write_id, account_id=account_id)
+
+    def Transfer_State(self, request, context):
+        """
+        Streams this branch's encoded state in STATE_CHUNK pieces, for a requester missing
+        writes pruned from the history.
+        """
+        with self.lock:
+            state = self.dump_state()
+        for offset in range(0, len(state), STATE_CHUNK):
+            yield banks_pb2.StateChunk(data=state[offset:offset + STATE_CHUNK])
+
+    def Execute_Batch(self, request, context):
+        """
+        Executes a customer's operations in order, delegating each one to MsgDelivery,
+        and returns their results in the same order. Each write carries the batch's
+        session token extended with the batch's earlier writes, as the customer would
+        have sent it.
+        """
+        session = dict(request.versions)
+        response = banks_pb2.OperationBatchResponse()
+        for operation in request.operations:
+            interface = operation.WhichOneof("operation")
+            message = getattr(operation, interface)
+            if (interface == QUERY):
+                response.results.add(query=self.MsgDelivery(message, context))
+                continue
+
+            message.versions.update(session)    #stamp the session token
+            result = self.MsgDelivery(message, context)
+            if (result.write_id != 0):  #extend the session with the write
+                origin, sequence = split_write_id(result.write_id)
+                session[origin] = max(session.get(origin, 0), sequence)
+            response.results.add(transaction=result)
+        return response
+
+    def Sync(self, request, context):
+        """
+        Barrier that returns once every propagation this branch sent before the call has been
+        acknowledged and every propagation parked here by then has been applied and made durable.
+        Later propagations do not hold it up, so it cannot starve under load. Parked writes are
+        acked before they apply, so the acks alone do not cover them.
+        """
+        deadline = monotonic() + SYNC_TIMEOUT
+        with self.propagated:
+            sent = self.calls.issued
+            settled = self.propagated.wait_for(lambda: self.calls.covers(sent), SYNC_TIMEOUT)
+        with self.applied:  #notified as released writes apply
+            parked = self.parks.issued
+            settled = settled and self.applied.wait_for(lambda: self.parks.covers(parked), max(deadline - monotonic(), 0))
+        if not settled:
+            context.abort(grpc.StatusCode.DEADLINE_EXCEEDED, "timed out waiting for propagations")
+
+        if self.wal is not None:    #released writes are journaled by the handler that released them
+            self.wal.sync(self.wal.appended)
+        return banks_pb2.SyncResponse()
+
 
     def MsgDelivery(self, request, context):
         """
@@ -101,34 +657,40 @@ class Branch(banks_pb2_grpc.RPCServicer):
             The appropriate response message containing result or balance.
         """
         if isinstance(request, banks_pb2.TransactionRequest):   #handle customer deposit or withdraw
-            self.wait_for_writes(request.writeset) #enforce monotonic-writes
+            if not self.recovered.wait(WAIT_TIMEOUT):   #a restarted branch could reissue write ids its peers already applied
+                context.abort(grpc.StatusCode.UNAVAILABLE, "catching up after a restart")
+            if not self.wait_for_writes(request.versions):   #enforce monotonic-writes
+                context.abort(grpc.StatusCode.DEADLINE_EXCEEDED, "timed out waiting for session writes")
 
             response = banks_pb2.TransactionResponse()
-            if (request.amount + self.balance < 0): #return fail on insufficient funds
-                response.write_id = 0
-            else:
-                self.balance += request.amount  #update local balance
+            sequence = 0
+            with self.lock: #check funds, apply, assign the write id and journal atomically
+                if not self.accounts.apply(request.account_id, request.amount): #apply unless funds are insufficient
+                    write_id = 0
+                else:
+                    self.sequence += 1  #generate write id
+                    write_id = make_write_id(self.id, self.sequence)
+                    self.record_write(write_id, request.amount, request.account_id)
+                    sequence = self.journal(request.amount, write_id, request.account_id)
+            self.commit(sequence)   #make the write durable before acking or propagating it
 
-                write_id = self.next_write_id   #generate write id
-                self.next_write_id += 1
-                self.writeset.add(write_id)
-                self.propagate(request.amount, write_id, request.writeset)   #progate writes
+            if (write_id != 0):
+                self.propagate(request.amount, write_id, request.versions, request.account_id)   #propagate writes outside the lock
 
-                response.write_id = write_id
+            response.write_id = write_id
 
         elif isinstance(request, banks_pb2.PropagationRequest):   #handle propagation
-            self.wait_for_writes(request.writeset) #enforce monotonic-writes
             response = banks_pb2.TransactionResponse()
 
-            if request.write_id not in self.writeset:  #idempotently update branch balance
-                self.balance += request.amount
-                self.writeset.add(request.write_id)
+            with self.lock: #enforce monotonic-writes without blocking: apply now or park until the dependencies arrive
+                sequence = self.deliver(request)
+            self.commit(sequence)   #make the applied writes durable before acking
 
             response.write_id = request.write_id    
 
         elif isinstance(request, banks_pb2.BalanceRequest): #handle balance request
             response = banks_pb2.BalanceResponse()
-            response.balance = self.balance        
+            response.balance = self.accounts.balance(request.account_id) #lock-free read
         
         return response
 
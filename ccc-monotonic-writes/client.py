@@ -7,57 +7,80 @@ tfilewic
 Runs Customer events from input and writes output.
 """
 
-import json
+import functools
 import grpc
-from utilities import import_file, OUTPUT_FILE
+import itertools
+from utilities import close_channels, export_items, get_option, load_items, map_ordered, wait_for_branches, READY_TIMEOUT, METRICS_FILE, EVENT_BATCH, SESSION_WINDOW
 from customer import Customer
+import metrics
 
-PROPAGATION_DELAY = 0.1
+CONCURRENCY = 1 #number of customers run at once (override with --concurrency=N)
 
-def process_customers() -> list[dict]:
+def run_customer(item: dict, batch: int = EVENT_BATCH, window: int = SESSION_WINDOW) -> list[dict]:
     """
-    Executes all customer event sequences from the input file.
+    Executes one customer's events and waits for its writes to propagate.
 
-    Reads customer entries from the input JSON, runs each customer's
-    defined events sequentially, and collects all responses for export.
+    Args:
+        item (dict): The customer entry from the input file.
+        batch (int): Events sent per Execute_Batch call.
+        window (int): Events in flight at once.
 
     Returns:
-        list[dict]: A list of processed customer response dictionaries.
+        list[dict]: The customer's response entries.
     """
-    
-    data = import_file()    #load input data from JSON file
-    output = [] #initialize list to store results
+    id = item.get("id")
+    events = item.get("events")
+    customer = Customer(id, events, batch, window)
+    responses = customer.executeEvents()
+    customer.awaitPropagation() #barrier on branch propagation
+    return responses
 
-    #process all customer entries
-    for item in data:
-        if item.get("type") == "customer":
-            id = item.get("id")
-            events = item.get("events")
-            customer = Customer(id, events)
-            responses = customer.executeEvents()
-            output.extend(responses)
 
-    return output
+def process_customers():
+    """
+    Executes all customer event sequences from the input file.
 
+    Streams customer entries from the input file and runs up to the configured
+    number of customers at once. Responses are produced in input order as
+    customers finish, so at most the configured number of customers are held
+    in memory.
 
-def export(data: list[dict]):
+    Returns:
+        iterator[dict]: The customer response entries.
     """
-    Writes the processed customer responses to the output JSON file.
+    branches = [item["id"] for item in load_items() if item.get("type") == "branch"]
+    wait_for_branches(branches, READY_TIMEOUT)  #wait until every branch is serving
+    customers = (item for item in load_items() if item.get("type") == "customer")
+    concurrency = int(get_option("concurrency", CONCURRENCY))
+    run = functools.partial(run_customer, batch=int(get_option("batch", EVENT_BATCH)), window=int(get_option("window", SESSION_WINDOW)))
 
-    Args:
-        data (list[dict]): List of customer response dictionaries to save.
+    #process all customer entries, keeping results in input order
+    return itertools.chain.from_iterable(map_ordered(run, customers, concurrency))
+
+
+def export(data):
     """
+    Writes the processed customer responses to the output file as they are produced.
 
-    with open(OUTPUT_FILE, 'w') as file:
-        json.dump(data, file, indent=2)
+    Args:
+        data (iterable[dict]): Customer response entries to save.
+    """
+    export_items(data)
 
 
 #run when script called directly
 if __name__ == "__main__":  
+    metrics.setup(get_option("metrics", METRICS_FILE), client=True)
     try:
         output = process_customers()
         export(output)
+    except grpc.FutureTimeoutError:
+        print("ERROR: Branch servers did not become ready.")
+        print("Ensure all branch servers are running before starting the client.")
+        exit(1)
     except grpc.RpcError as e:
         print(f"ERROR: {e.details()}")
         print("Ensure all branch servers are running before starting the client.")
-        exit(1)
\ No newline at end of file
+        exit(1)
+    finally:
+        close_channels()
\ No newline at end of file
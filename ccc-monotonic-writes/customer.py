@@ -7,9 +7,12 @@ tfilewic
 Customer client logic and event execution.
 """
 
+import itertools
 import banks_pb2
 import banks_pb2_grpc
-from utilities import create_channel, QUERY, WITHDRAW, DEPOSIT
+from collections import deque
+from operator import itemgetter
+from utilities import batched, create_channel, split_write_id, QUERY, WITHDRAW, DEPOSIT, DEFAULT_ACCOUNT, EVENT_BATCH, SESSION_WINDOW
 
 
 class Customer:
@@ -18,13 +21,17 @@ class Customer:
     Handles stub creation and sequential event execution based on the input file.
     """
     
-    def __init__(self, id, events):
+    def __init__(self, id, events, batch=EVENT_BATCH, window=SESSION_WINDOW):
         # unique ID of the Customer
         self.id = id
         # events from the input
         self.events = events
-        # set of writes this customer has completed
-        self.writeset = set()
+        # events sent per Execute_Batch call (1 sends each event as its own RPC)
+        self.batch = batch
+        # events in flight at once (1 waits for each reply before sending the next event)
+        self.window = window
+        # session token: highest completed write sequence per origin branch
+        self.versions = {}
         # a list of received messages used for debugging purpose
         self.received_messages = list()
         # map of stubs
@@ -57,6 +64,23 @@ class Customer:
 
         return self.stubs[branch_id]
 
+    def record_write(self, write_id: int):
+        """
+        Adds a completed write to the session token.
+
+        Args:
+        write_id (int): The ID of the write returned by the branch.
+        """
+        origin, sequence = split_write_id(write_id)
+        self.versions[origin] = max(self.versions.get(origin, 0), sequence)
+
+    def awaitPropagation(self):
+        """
+        Blocks until every branch this customer used has finished propagating its writes.
+        """
+        for stub in self.stubs.values():
+            stub.Sync(banks_pb2.SyncRequest())
+
     def executeEvents(self) -> dict:
         """
         Executes all customer events in order.
@@ -64,6 +88,11 @@ class Customer:
         Returns:
             dict: A dictionary containing the received query responses for this customer id.
         """
+        if (self.batch > 1):
+            return self.executeBatches()
+        if (self.window > 1):
+            return self.executePipelined()
+
         output = []
 
         #process all events
@@ -71,20 +100,21 @@ class Customer:
             branch = event["branch"]
             stub = self.getStub(branch)
             interface = event["interface"]
+            account_id = event.get("account", DEFAULT_ACCOUNT)  #accounts are optional in the input
     
             #handle deposits and withdrawals
             if interface in {DEPOSIT, WITHDRAW}:
                 money = event["money"] if interface == DEPOSIT else -event["money"]
-                request = banks_pb2.TransactionRequest(amount=money, writeset=list(self.writeset))
+                request = banks_pb2.TransactionRequest(amount=money, versions=self.versions, account_id=account_id)
                 response = stub.Deposit(request) if (interface == DEPOSIT) else stub.Withdraw(request)
     
                 write_id = response.write_id
                 if (write_id != 0):
-                    self.writeset.add(response.write_id)
+                    self.record_write(write_id)
 
             #handle balance queries
             elif interface == QUERY:
-                request = banks_pb2.BalanceRequest()
+                request = banks_pb2.BalanceRequest(account_id=account_id)
                 response = stub.Query(request)
                 entry = {"id": event["id"], "balance": response.balance}
                 output.append(entry) 
@@ -94,4 +124,106 @@ class Customer:
                 continue          
 
         return output 
-    1
\ No newline at end of file
+
+
+    def executeBatches(self) -> list:
+        """
+        Executes all customer events in order, sending each run of consecutive events for
+        the same branch in Execute_Batch calls of up to batch events. The branch stamps the
+        session token on each write, so the guarantee matches the per-event RPCs.
+
+        Returns:
+            list: The received query responses for this customer id.
+        """
+        output = []
+        supported = (event for event in self.events if event["interface"] in {DEPOSIT, WITHDRAW, QUERY})  #ignore unsupported types
+
+        for branch, run in itertools.groupby(supported, key=itemgetter("branch")):
+            for events in batched(run, self.batch):
+                operations = []
+                for event in events:
+                    interface = event["interface"]
+                    account_id = event.get("account", DEFAULT_ACCOUNT)  #accounts are optional in the input
+                    if interface == DEPOSIT:
+                        operations.append(banks_pb2.Operation(deposit=banks_pb2.TransactionRequest(amount=event["money"], account_id=account_id)))
+                    elif interface == WITHDRAW:
+                        operations.append(banks_pb2.Operation(withdraw=banks_pb2.TransactionRequest(amount=-event["money"], account_id=account_id)))
+                    else:
+                        operations.append(banks_pb2.Operation(query=banks_pb2.BalanceRequest(account_id=account_id)))
+
+                request = banks_pb2.OperationBatch(versions=self.versions, operations=operations)
+                response = self.getStub(branch).Execute_Batch(request)
+
+                for event, result in zip(events, response.results):
+                    if event["interface"] == QUERY:
+                        output.append({"id": event["id"], "balance": result.query.balance})
+                    elif (result.transaction.write_id != 0):
+                        self.record_write(result.transaction.write_id)
+
+        return output
+
+
+    def executePipelined(self) -> list:
+        """
+        Executes all customer events with up to window of them in flight, collecting the
+        replies in event order.
+
+        A write waits for the replies of all earlier writes, since their ids go in its
+        session token, and of earlier queries of its account: once applied it propagates
+        to every branch, where such a query still in flight could observe it. A query
+        waits for the replies of earlier writes to its account, since a write is replied
+        to once its peers have applied it and any branch queried after it must reflect
+        it. Events otherwise overlap freely, so only sessions that touch several accounts
+        keep more than one write in flight.
+
+        Returns:
+            list: The received query responses for this customer id.
+        """
+        output = []
+        pending = deque()   #(index, event, call) of the events in flight, in event order
+        last_write = 0  #index of the latest write sent (0 for none)
+        written = {}    #index of the latest write sent per account
+        queried = {}    #index of the latest query sent per account
+        supported = (event for event in self.events if event["interface"] in {DEPOSIT, WITHDRAW, QUERY})  #ignore unsupported types
+
+        for index, event in enumerate(supported, 1):
+            branch = event["branch"]
+            interface = event["interface"]
+            account_id = event.get("account", DEFAULT_ACCOUNT)  #accounts are optional in the input
+
+            if interface == QUERY:
+                depends = written.get(account_id, 0)    #only writes to its account change the balance
+            else:
+                depends = max(last_write, queried.get(account_id, 0))
+            while pending and (pending[0][0] <= depends or len(pending) >= self.window):   #wait for dependencies and a free slot
+                self.complete(*pending.popleft()[1:], output)
+
+            stub = self.getStub(branch)
+            if interface == QUERY:
+                call = stub.Query.future(banks_pb2.BalanceRequest(account_id=account_id))
+                queried[account_id] = index
+            else:
+                money = event["money"] if interface == DEPOSIT else -event["money"]
+                request = banks_pb2.TransactionRequest(amount=money, versions=self.versions, account_id=account_id)
+                call = stub.Deposit.future(request) if (interface == DEPOSIT) else stub.Withdraw.future(request)
+                last_write = written[account_id] = index
+            pending.append((index, event, call))
+
+        while pending:
+            self.complete(*pending.popleft()[1:], output)
+        return output
+
+    def complete(self, event, call, output):
+        """
+        Waits for the reply to an in-flight event and records it.
+
+        Args:
+        event (dict): The event the call was sent for.
+        call (grpc.Future): The call future.
+        output (list): Query responses, appended to in event order.
+        """
+        response = call.result()
+        if event["interface"] == QUERY:
+            output.append({"id": event["id"], "balance": response.balance})
+        elif (response.write_id != 0):
+            self.record_write(response.write_id)
\ No newline at end of file
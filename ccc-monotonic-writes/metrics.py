@@ -0,0 +1,364 @@
+"""
+metrics.py
+CSE 531 - CCC Monotonic Writes Project
+tfilewic
+2026-10-18
+
+Latency histograms, counters and gauges for branches and customers, dumped to a JSON file.
+"""
+
+import asyncio
+import atexit
+import functools
+import grpc
+import json
+import math
+import os
+import threading
+from time import perf_counter, sleep
+from utilities import channel_interceptors, METRICS_INTERVAL
+
+BUCKETS = 40    #histogram buckets; bucket n counts samples below 2**n microseconds
+
+
+class Histogram:
+    """
+    Latency histogram with power-of-two microsecond buckets.
+
+    Recording a sample is one frexp and a few array updates, and the memory
+    is fixed no matter how many samples are recorded. Percentiles are
+    reported as the upper bound of the bucket they fall in.
+    """
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        # number of samples per bucket
+        self.counts = [0] * BUCKETS
+        # number of samples
+        self.count = 0
+        # sum of the samples in seconds
+        self.total = 0.0
+        # largest sample in seconds
+        self.max = 0.0
+
+
+    def record(self, seconds):
+        """
+        Adds a sample.
+
+        Args:
+            seconds (float): The measured time.
+        """
+        bucket = math.frexp(seconds * 1e6)[1] if seconds > 0 else 0
+        self.counts[min(max(bucket, 0), BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+
+    def percentile(self, fraction) -> float:
+        """
+        Returns the upper bound in milliseconds of the bucket holding a percentile.
+
+        Args:
+            fraction (float): Percentile as a fraction, e.g. 0.99.
+        """
+        rank = max(1, math.ceil(fraction * self.count))
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if (seen >= rank):
+                return min(2 ** bucket / 1000, self.max * 1000)
+        return self.max * 1000
+
+
+    def summary(self) -> dict:
+        """
+        Returns the count, mean, p50/p95/p99 and max in milliseconds.
+        """
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count * 1000, 3),
+            "p50_ms": round(self.percentile(0.50), 3),
+            "p95_ms": round(self.percentile(0.95), 3),
+            "p99_ms": round(self.percentile(0.99), 3),
+            "max_ms": round(self.max * 1000, 3)
+        }
+
+
+class Registry:
+    """
+    Process-wide metrics: histograms and counters keyed by name, plus gauges
+    read when a snapshot is taken.
+
+    Nothing is instrumented until enable() is called, so disabled metrics
+    cost nothing on the request paths.
+    """
+    def __init__(self):
+        # whether instrumentation is installed
+        self.enabled = False
+        # latency histograms keyed by name
+        self.histograms = {}
+        # event counts keyed by name
+        self.counters = {}
+        # functions returning the current value of each gauge, keyed by name
+        self.gauges = {}
+        # guards the maps across server threads
+        self.lock = threading.Lock()
+
+
+    def enable(self):
+        self.enabled = True
+
+    def observe(self, name, seconds):
+        """
+        Records a latency sample.
+
+        Args:
+            name (str): Histogram name.
+            seconds (float): The measured time.
+        """
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.record(seconds)
+
+    def increment(self, name, amount=1):
+        """
+        Adds to a counter.
+
+        Args:
+            name (str): Counter name.
+            amount (int): Amount to add.
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def gauge(self, name, read):
+        """
+        Registers a gauge.
+
+        Args:
+            name (str): Gauge name.
+            read (callable): Returns the gauge's current value.
+        """
+        with self.lock:
+            self.gauges[name] = read
+
+
+    def snapshot(self) -> dict:
+        """
+        Returns every metric as a JSON-serializable dict.
+        """
+        with self.lock:
+            histograms = {name: histogram.summary() for name, histogram in sorted(self.histograms.items())}
+            counters = dict(sorted(self.counters.items()))
+            gauges = sorted(self.gauges.items())
+        return {
+            "pid": os.getpid(),
+            "histograms": histograms,
+            "counters": counters,
+            "gauges": {name: read() for name, read in gauges}
+        }
+
+    def dump(self, path):
+        """
+        Atomically writes a snapshot to a JSON file.
+
+        Args:
+            path (str): File to write.
+        """
+        temporary = path + ".tmp"
+        with open(temporary, 'w') as file:
+            json.dump(self.snapshot(), file, indent=2)
+        os.replace(temporary, path)
+
+
+registry = Registry()   #metrics of this process
+
+
+def outcome(response):
+    """
+    Classifies a response for the success and failure counters.
+
+    Returns:
+        str: "success" or "fail", or None for responses without an outcome.
+    """
+    write_id = getattr(response, "write_id", None)
+    if write_id is None:
+        return None
+    return "success" if write_id else "fail"    #write id 0 reports a failed transaction
+
+
+def record_call(method, start, response):
+    """
+    Records the latency and outcome of a completed call.
+
+    Args:
+        method (str): Metric name of the call.
+        start (float): perf_counter() value when the call started.
+        response: The response message, or None if the call raised.
+    """
+    registry.observe(method, perf_counter() - start)
+    if response is None:
+        registry.increment(f"{method}/error")
+        return
+    result = outcome(response)
+    if result is not None:
+        registry.increment(f"{method}/{result}")
+
+
+class MetricsInterceptor(grpc.ServerInterceptor):
+    """
+    Server interceptor that records the latency and outcome of every unary RPC.
+    """
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if handler is None or handler.unary_unary is None:  #only unary calls are timed
+            return handler
+
+        method = "rpc/" + handler_call_details.method.rsplit("/", 1)[-1]
+        behavior = handler.unary_unary
+
+        def timed(request, context):
+            start = perf_counter()
+            response = None
+            try:
+                response = behavior(request, context)
+                return response
+            finally:
+                record_call(method, start, response)
+
+        return grpc.unary_unary_rpc_method_handler(
+            timed,
+            request_deserializer=handler.request_deserializer,
+            response_serializer=handler.response_serializer
+        )
+
+
+class AsyncMetricsInterceptor(grpc.aio.ServerInterceptor):
+    """
+    grpc.aio server interceptor that records the latency and outcome of every unary RPC.
+    """
+    async def intercept_service(self, continuation, handler_call_details):
+        handler = await continuation(handler_call_details)
+        if handler is None or handler.unary_unary is None:  #only unary calls are timed
+            return handler
+
+        method = "rpc/" + handler_call_details.method.rsplit("/", 1)[-1]
+        behavior = handler.unary_unary
+
+        async def timed(request, context):
+            start = perf_counter()
+            response = None
+            try:
+                response = await behavior(request, context)
+                return response
+            finally:
+                record_call(method, start, response)
+
+        return grpc.unary_unary_rpc_method_handler(
+            timed,
+            request_deserializer=handler.request_deserializer,
+            response_serializer=handler.response_serializer
+        )
+
+
+class ClientMetricsInterceptor(grpc.UnaryUnaryClientInterceptor):
+    """
+    Client interceptor that records the latency and outcome of every unary call,
+    including calls made with .future().
+    """
+    def intercept_unary_unary(self, continuation, client_call_details, request):
+        method = "call/" + client_call_details.method.rsplit("/", 1)[-1]
+        start = perf_counter()
+        call = continuation(client_call_details, request)
+        call.add_done_callback(lambda done: record_call(method, start, None if done.exception() else done.result()))
+        return call
+
+
+def timed(name, function):
+    """
+    Wraps a function or coroutine function so every call records its duration.
+
+    Args:
+        name (str): Histogram name.
+        function (callable): The function to wrap.
+
+    Returns:
+        callable: The wrapped function.
+    """
+    if asyncio.iscoroutinefunction(function):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                registry.observe(name, perf_counter() - start)
+    else:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                registry.observe(name, perf_counter() - start)
+    return wrapper
+
+
+def instrument(branch):
+    """
+    Hooks a Branch or AsyncBranch: times its propagation fan-out and dependency
+    waits, and registers gauges for its in-flight propagations, blocked waiters,
+    parked propagations and outbox depth.
+
+    Args:
+        branch: The branch to instrument.
+    """
+    prefix = f"branch-{branch.id}"
+    branch.propagate = timed(f"{prefix}/propagate", branch.propagate)
+    branch.wait_for_writes = timed(f"{prefix}/wait_for_writes", branch.wait_for_writes)
+    registry.gauge(f"{prefix}/inflight", lambda: len(branch.calls))
+    registry.gauge(f"{prefix}/blocked_waiters", lambda: branch.blocked_waiters)
+    registry.gauge(f"{prefix}/parked", lambda: sum(len(writes) for writes in list(branch.parked.values())))
+
+    outboxes = getattr(branch, "outboxes", ())
+    if outboxes:
+        registry.gauge(f"{prefix}/outbox_depth", lambda: sum(outbox.depth() for outbox in outboxes))
+
+
+def dump_periodically(path, interval):
+    """
+    Writes a snapshot to a file every interval seconds.
+
+    Args:
+        path (str): File to write.
+        interval (float): Seconds between snapshots.
+    """
+    while True:
+        sleep(interval)
+        registry.dump(path)
+
+
+def setup(path, client=False, interval=METRICS_INTERVAL):
+    """
+    Enables metrics for this process and dumps them to a file every interval
+    seconds and at exit. Does nothing if path is None.
+
+    Args:
+        path (str): File the snapshots are written to, or None to leave metrics disabled.
+        client (bool): Also time the calls made on pooled channels.
+        interval (float): Seconds between snapshots.
+    """
+    if path is None:
+        return
+
+    registry.enable()
+    if client:
+        channel_interceptors.append(ClientMetricsInterceptor())
+    threading.Thread(target=dump_periodically, args=(path, interval), daemon=True).start()
+    atexit.register(registry.dump, path)
@@ -0,0 +1,30 @@
+"""
+conftest.py
+CSE 531 - CCC Monotonic Writes Project
+tfilewic
+2026-10-18
+
+Makes the branch modules importable from the tests, compiling the protos into a
+temporary directory when the generated modules are missing.
+"""
+
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, ROOT)    #modules live one level up, not in a package
+
+if not os.path.exists(os.path.join(ROOT, "banks_pb2.py")):  #generated modules are not checked in
+    try:
+        from grpc_tools import protoc
+    except ImportError: #tests that need the generated modules skip themselves
+        protoc = None
+    if protoc is not None:
+        generated = tempfile.mkdtemp()
+        atexit.register(shutil.rmtree, generated, True)
+        protoc.main(["protoc", "-I" + os.path.join(ROOT, "protos"), "--python_out=" + generated, "--grpc_python_out=" + generated, "banks.proto"])
+        sys.path.insert(0, generated)
@@ -0,0 +1,48 @@
+"""
+test_ledger.py
+CSE 531 - CCC Monotonic Writes Project
+tfilewic
+2026-10-18
+
+Tests for the account ledger.
+"""
+
+from ledger import Ledger
+from utilities import DEFAULT_ACCOUNT
+
+
+def test_apply_rejects_overdraft():
+    ledger = Ledger(100)
+    assert ledger.apply(DEFAULT_ACCOUNT, -150) is False
+    assert ledger.balance(DEFAULT_ACCOUNT) == 100
+    assert ledger.apply(DEFAULT_ACCOUNT, -100) is True
+    assert ledger.balance(DEFAULT_ACCOUNT) == 0
+
+
+def test_adjust_opens_accounts():
+    ledger = Ledger(10)
+    assert 7 not in ledger
+    assert ledger.balance(7) == 0
+    ledger.adjust(7, -5)    #propagations apply unconditionally
+    assert 7 in ledger
+    assert ledger.balance(7) == -5
+    assert len(ledger) == 2
+
+
+def test_dump_load_round_trip():
+    ledger = Ledger(400)
+    for account in (5, 3, 1 << 40, 9):
+        ledger.adjust(account, account % 1000)
+    ledger.adjust(3, -2)
+
+    prefix = b"header"
+    data = prefix + ledger.dump() + b"trailer"
+    loaded, offset = Ledger.load(data, len(prefix))
+    assert data[offset:] == b"trailer"
+    assert loaded.slots == ledger.slots
+    assert loaded.balances == ledger.balances
+    assert loaded.balance(DEFAULT_ACCOUNT) == 400
+
+    loaded.adjust(11, 1)    #the loaded ledger keeps growing
+    assert loaded.balance(11) == 1
+    assert ledger.balance(11) == 0
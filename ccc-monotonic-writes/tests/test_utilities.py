@@ -0,0 +1,98 @@
+"""
+test_utilities.py
+CSE 531 - CCC Monotonic Writes Project
+tfilewic
+2026-10-18
+
+Tests for the streaming input parser and the barrier tickets.
+"""
+
+import io
+import json
+import pytest
+import utilities
+
+
+def parse(text, chunk, name="input.json") -> list:
+    """
+    Parses a JSON document with parse_items, reading chunk characters at a time.
+    """
+    file = io.StringIO(text)
+    file.name = name
+    utilities.READ_CHUNK = chunk
+    return list(utilities.parse_items(file))
+
+
+@pytest.fixture(autouse=True)
+def restore_chunk(monkeypatch):
+    monkeypatch.setattr(utilities, "READ_CHUNK", utilities.READ_CHUNK)
+
+
+@pytest.mark.parametrize("chunk", [1, 2, 3, 5, 7, 1 << 20])
+def test_items_match_json_loads(chunk):
+    text = json.dumps([
+        {"id": 1, "type": "branch", "balance": 400},
+        {"id": 2, "type": "customer", "events": [{"interface": "deposit", "money": 70, "branch": 1}]},
+        "a,]\"b",
+        [],
+        {},
+        -0.5e-3,
+        None,
+        True,
+    ], indent=2)
+    assert parse(text, chunk) == json.loads(text)
+
+
+@pytest.mark.parametrize("chunk", [1, 3, 5])
+def test_number_split_across_chunks(chunk):
+    assert parse("[3.5e10]", chunk) == [3.5e10]
+    assert parse("[123456789, -12]", chunk) == [123456789, -12]
+
+
+@pytest.mark.parametrize("chunk", [1, 2, 1 << 20])
+def test_whitespace_across_chunks(chunk):
+    assert parse("  \n\n    [ \n 1 ,\n\n   2 \n ]  \n", chunk) == [1, 2]
+    assert parse("   [   ]   ", chunk) == []
+
+
+@pytest.mark.parametrize("chunk", [1, 2, 3, 1 << 20])
+@pytest.mark.parametrize("text", ["[1 2]", "[1,,2]", "[1,]", "[,1]", "[1", "", "{}", "[1] x", "[3.5e]", "[\"a]"])
+def test_invalid_json_raises(text, chunk):
+    with pytest.raises(json.JSONDecodeError):
+        parse(text, chunk)
+
+
+@pytest.mark.parametrize("chunk", [1, 2, 3, 1 << 20])
+def test_escapes_across_chunks(chunk):
+    text = json.dumps(["\\", "a\\\"]b\\\\", {"k\"[": ["}", "\\u005d"]}])
+    assert parse(text, chunk) == json.loads(text)
+
+
+def test_items_are_yielded_before_a_later_syntax_error():
+    file = io.StringIO('[{"id": 1}, {"id": 2} x]')
+    file.name = "input.json"
+    items = utilities.parse_items(file)
+    assert next(items) == {"id": 1}
+    assert next(items) == {"id": 2}
+    with pytest.raises(json.JSONDecodeError):
+        next(items)
+
+
+def test_json_lines():
+    assert parse('{"id": 1}\n\n[2, 3]\n', 1, name="input.jsonl") == [{"id": 1}, [2, 3]]
+
+
+def test_tickets_watermark_waits_for_earlier_tickets_only():
+    tickets = utilities.Tickets()
+    first, second, third = (tickets.issue() for _ in range(3))
+    assert tickets.finish(third) is False   #finished early: the watermark stays put
+    assert len(tickets) == 2
+    assert not tickets.covers(first)
+
+    assert tickets.finish(first) is True
+    assert tickets.covers(first) and not tickets.covers(third)
+    sent = tickets.issued
+    tickets.issue() #started after the barrier
+    assert tickets.finish(second) is True
+    assert tickets.covers(sent)
+    assert len(tickets) == 1 and not tickets.early
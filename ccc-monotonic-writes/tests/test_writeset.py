@@ -0,0 +1,102 @@
+"""
+test_writeset.py
+CSE 531 - CCC Monotonic Writes Project
+tfilewic
+2026-10-18
+
+Tests for the applied write id set.
+"""
+
+import random
+from utilities import make_write_id
+from writeset import WriteSet
+
+
+def add_all(writeset, origin, sequences) -> list:
+    return [writeset.add(make_write_id(origin, sequence)) for sequence in sequences]
+
+
+def test_in_order_writes_only_move_watermark():
+    writeset = WriteSet()
+    assert add_all(writeset, 1, range(1, 1001)) == [True] * 1000
+    assert writeset.versions == {1: 1000}
+    assert writeset.ranges == {}
+    assert len(writeset) == 1000
+    assert make_write_id(1, 1000) in writeset
+    assert make_write_id(1, 1001) not in writeset
+
+
+def test_out_of_order_writes_merge_ranges():
+    writeset = WriteSet()
+    add_all(writeset, 2, [1, 5, 3, 6])
+    assert writeset.versions == {2: 1}
+    assert list(writeset.ranges[2]) == [3, 4, 5, 7]
+    assert writeset.highest(2) == 6
+    assert make_write_id(2, 4) not in writeset
+    assert make_write_id(2, 5) in writeset
+
+    add_all(writeset, 2, [4])   #fills the gap between two ranges
+    assert list(writeset.ranges[2]) == [3, 7]
+
+    add_all(writeset, 2, [2])   #continues the watermark and absorbs the range
+    assert writeset.versions == {2: 6}
+    assert 2 not in writeset.ranges
+    assert len(writeset) == 6
+
+
+def test_duplicates_are_rejected():
+    writeset = WriteSet()
+    add_all(writeset, 3, [1, 2, 5])
+    assert add_all(writeset, 3, [1, 2, 5]) == [False] * 3
+    assert len(writeset) == 3
+
+
+def test_origins_are_independent():
+    writeset = WriteSet()
+    add_all(writeset, 1, [1, 2])
+    add_all(writeset, 2, [2])
+    assert make_write_id(2, 1) not in writeset
+    assert make_write_id(1, 2) in writeset
+    assert writeset.highest(3) == 0
+
+
+def test_matches_set_in_random_order():
+    rng = random.Random(531)
+    sequences = [(origin, sequence) for origin in (1, 2, 3) for sequence in range(1, 301)]
+    rng.shuffle(sequences)
+    writeset = WriteSet()
+    added = set()
+    for origin, sequence in sequences[:600]:
+        assert writeset.add(make_write_id(origin, sequence)) is ((origin, sequence) not in added)
+        added.add((origin, sequence))
+
+    for origin in (1, 2, 3):
+        for sequence in range(1, 302):
+            assert (make_write_id(origin, sequence) in writeset) == ((origin, sequence) in added)
+    assert len(writeset) == len(added)
+
+
+def test_dump_load_round_trip():
+    writeset = WriteSet()
+    add_all(writeset, 1, range(1, 50))
+    add_all(writeset, 2, [1, 4, 5, 9])
+    add_all(writeset, 7, [3])
+
+    prefix = b"ledger"
+    data = prefix + writeset.dump() + b"history"
+    loaded, offset = WriteSet.load(data, len(prefix))
+    assert data[offset:] == b"history"
+    assert loaded.versions == writeset.versions
+    assert loaded.ranges == writeset.ranges
+    assert len(loaded) == len(writeset)
+
+    assert loaded.add(make_write_id(7, 1))  #the loaded set keeps merging
+    assert loaded.add(make_write_id(7, 2))
+    assert loaded.versions[7] == 3
+    assert 7 not in loaded.ranges
+
+
+def test_empty_dump_load_round_trip():
+    loaded, offset = WriteSet.load(WriteSet().dump())
+    assert loaded.versions == {} and loaded.ranges == {} and len(loaded) == 0
+    assert offset == len(WriteSet().dump())
@@ -7,9 +7,17 @@ tfilewic
 Shared constants and helper functions.
 """
 
+import asyncio
 import grpc
+import itertools
 import json
+import queue
+import re
 import sys
+import threading
+from collections import deque
+from concurrent import futures
+from time import monotonic
 
 BASE_PORT = 50000   #base port used to assign ports sequentially
 QUERY = "query"
@@ -17,6 +25,49 @@ DEPOSIT = "deposit"
 WITHDRAW = "withdraw"
 INPUT_FILE = "input.json"
 OUTPUT_FILE = "output.json"
+DEFAULT_ACCOUNT = 0 #account used by requests that name none; opened with the branch's input balance
+PROPAGATION_ACKS = None  #peer acks a propagated write waits for (None waits for every peer)
+SYNC_TIMEOUT = 10.0 #seconds a Sync barrier waits for outstanding propagations
+READY_TIMEOUT = 10.0    #seconds to wait for branches to accept connections
+PROPAGATION_BATCHING = False    #coalesce propagations to each peer into Propagate_Batch calls
+BATCH_SIZE = 64 #most propagation requests sent in one batch
+BATCH_WINDOW = 0.0005   #seconds a partial batch waits for more requests before flushing
+PROPAGATION_STREAMING = False   #pipeline propagations over a long-lived Replicate stream per peer (thread-runtime branches with more than server.MAX_STREAMS peers batch instead)
+SNAPSHOT_INTERVAL = 100000  #WAL records appended between branch snapshots
+READ_CHUNK = 1 << 20 #characters read at a time when streaming the input file
+WHITESPACE = re.compile(r"[ \t\n\r]*")   #JSON insignificant whitespace
+SCALAR_END = re.compile(r"[,\] \t\n\r]")  #characters that end a number or literal array item
+STRUCTURE = re.compile(r'["\[\]{}]')  #characters that open a string or change the nesting depth
+STRING_END = re.compile(r'["\\]') #characters that close a string or escape the next one
+EXPECTING = {"[": "Expecting '['", "first": "Expecting value or ']'", "item": "Expecting value", ",": "Expecting ',' delimiter or ']'"}
+CHANNEL_SUBCHANNELS = 1 #pooled channels (and connections) per branch target
+KEEPALIVE_TIME_MS = 30000   #milliseconds between keepalive pings on idle channels
+KEEPALIVE_TIMEOUT_MS = 10000    #milliseconds to wait for a keepalive ack before dropping the connection
+CHANNEL_OPTIONS = [
+    ("grpc.keepalive_time_ms", KEEPALIVE_TIME_MS),
+    ("grpc.keepalive_timeout_ms", KEEPALIVE_TIMEOUT_MS),
+    ("grpc.keepalive_permit_without_calls", 1),
+]
+SERVER_OPTIONS = [  #let branch servers accept the channel keepalive pings
+    ("grpc.keepalive_permit_without_calls", 1),
+    ("grpc.http2.min_ping_interval_without_data_ms", KEEPALIVE_TIME_MS),
+]
+METRICS_FILE = None #JSON file metrics are dumped to (override with --metrics=PATH; None disables metrics)
+METRICS_INTERVAL = 5.0  #seconds between metrics dumps
+EVENT_BATCH = 1 #customer events sent per Execute_Batch call (override with --batch=N; 1 sends each event as its own RPC)
+SESSION_WINDOW = 1  #customer events in flight at once within a session (override with --window=N; 1 waits for each reply before sending the next event)
+ANTI_ENTROPY_INTERVAL = 5.0 #seconds between anti-entropy catch-up rounds with a random peer (None disables)
+RECOVERY_RETRY = 0.1 #seconds between attempts to reach the peers a starting branch has not caught up from yet
+STATE_CHUNK = 1 << 20  #bytes per message of a full-state transfer to a branch behind the pruned history
+WAIT_TIMEOUT = 10.0 #seconds a request may block waiting for the writes it depends on
+SEQUENCE_BITS = 32  #low bits of a 64-bit write id holding the per-origin sequence; the high bits hold the origin branch id
+SEQUENCE_MASK = (1 << SEQUENCE_BITS) - 1
+
+
+channels = {}   #pooled channels keyed by target
+channels_lock = threading.Lock()    #guards the channel pool
+channel_turns = itertools.count()   #round robin over a target's pooled channels
+channel_interceptors = []   #client interceptors applied to channels opened by create_channel
 
 
 def get_port(id: int) -> int:
@@ -34,7 +85,11 @@ def get_port(id: int) -> int:
 
 def create_channel(id: int) -> grpc.Channel:
     """
-    Creates an insecure gRPC channel to the branch with the given ID.
+    Returns a pooled insecure gRPC channel to the branch with the given ID.
+
+    Channels are shared by every caller in the process and kept alive with
+    keepalive pings. With CHANNEL_SUBCHANNELS > 1 each target gets that many
+    channels with their own connections, handed out round robin.
 
     Args:
         id (int): Branch ID to connect to.
@@ -42,26 +97,493 @@ def create_channel(id: int) -> grpc.Channel:
     Returns:
         grpc.Channel: gRPC communication channel to the target branch.
     """
+    target = f"localhost:{get_port(id)}"
+    with channels_lock:
+        pool = channels.get(target)
+        if pool is None:
+            options = CHANNEL_OPTIONS
+            if (CHANNEL_SUBCHANNELS > 1):   #give each channel its own connection instead of the shared subchannel
+                options = options + [("grpc.use_local_subchannel_pool", 1)]
+            pool = [grpc.insecure_channel(target, options=options) for _ in range(CHANNEL_SUBCHANNELS)]
+            if channel_interceptors:    #e.g. client metrics
+                pool = [grpc.intercept_channel(channel, *channel_interceptors) for channel in pool]
+            channels[target] = pool
+        return pool[next(channel_turns) % len(pool)]
+
+
+def close_channels() -> None:
+    """
+    Closes every pooled channel. Later create_channel() calls open new ones.
+    """
+    with channels_lock:
+        for pool in channels.values():
+            for channel in pool:
+                channel.close()
+        channels.clear()
+
+
+def create_aio_channel(id: int) -> grpc.aio.Channel:
+    """
+    Creates an insecure grpc.aio channel to the branch with the given ID.
+    Must be called while an event loop is running.
+
+    Args:
+        id (int): Branch ID to connect to.
+
+    Returns:
+        grpc.aio.Channel: Asynchronous gRPC channel to the target branch.
+    """
     port = get_port(id)
-    return grpc.insecure_channel(f"localhost:{port}")
+    return grpc.aio.insecure_channel(f"localhost:{port}", options=CHANNEL_OPTIONS)
+
+
+def make_write_id(origin: int, sequence: int) -> int:
+    """
+    Builds the 64-bit write id for the given sequence number of an origin branch.
+
+    Ids of one origin are dense and increasing, and never collide with another
+    origin's ids however many writes it performs.
+
+    Args:
+        origin (int): ID of the branch that performed the write.
+        sequence (int): Per-origin sequence number of the write, starting at 1.
+
+    Returns:
+        int: The write id.
+
+    Raises:
+        ValueError: If the sequence does not fit in SEQUENCE_BITS.
+    """
+    if (sequence > SEQUENCE_MASK):
+        raise ValueError(f"write sequence {sequence} of branch {origin} exceeds {SEQUENCE_BITS} bits")
+    return (origin << SEQUENCE_BITS) | sequence
+
+
+def split_write_id(write_id: int) -> tuple[int, int]:
+    """
+    Splits a write id into its origin branch and per-origin sequence number.
+
+    Args:
+        write_id (int): The write id.
+
+    Returns:
+        tuple[int, int]: The origin branch ID and sequence number.
+    """
+    return write_id >> SEQUENCE_BITS, write_id & SEQUENCE_MASK
+
+
+def wait_for_branches(ids: list, timeout: float) -> None:
+    """
+    Blocks until every branch in the list accepts connections.
+
+    Args:
+        ids (list): Branch IDs to wait for.
+        timeout (float): Maximum number of seconds to wait for all of them.
+
+    Raises:
+        grpc.FutureTimeoutError: If a branch is not ready before the timeout.
+    """
+    deadline = monotonic() + timeout
+    for id in ids:
+        channel = create_channel(id)
+        grpc.channel_ready_future(channel).result(timeout=max(0, deadline - monotonic()))
+
+
+def await_acks(calls: list, required: int = None) -> None:
+    """
+    Blocks until the required number of outstanding RPC calls have succeeded.
+
+    Args:
+        calls (list): Call futures returned by stub.<method>.future(...).
+        required (int): Number of successful replies to wait for, or None for all of them.
+
+    Raises:
+        grpc.RpcError: If enough calls fail that the required number of acks can no longer be reached.
+    """
+    required = len(calls) if required is None else min(required, len(calls))
+    completed = queue.SimpleQueue()
+    for call in calls:
+        call.add_done_callback(completed.put)  #collect calls as they finish
+
+    acked = 0
+    failed = 0
+    while acked < required:
+        call = completed.get()
+        if call.exception() is None:
+            acked += 1
+        else:
+            failed += 1
+            if failed > len(calls) - required:  #required acks are unreachable
+                raise call.exception()
+
+
+async def gather_acks(calls: list, required: int = None) -> None:
+    """
+    Waits until the required number of outstanding grpc.aio calls have succeeded.
+
+    Args:
+        calls (list): Tasks or call objects returned by grpc.aio stubs.
+        required (int): Number of successful replies to wait for, or None for all of them.
+
+    Raises:
+        grpc.RpcError: If enough calls fail that the required number of acks can no longer be reached.
+    """
+    required = len(calls) if required is None else min(required, len(calls))
+    completed = asyncio.as_completed(calls)
+
+    acked = 0
+    failed = 0
+    while acked < required:
+        try:
+            await next(completed)
+            acked += 1
+        except grpc.RpcError:
+            failed += 1
+            if failed > len(calls) - required:  #required acks are unreachable
+                raise
+
+
+class Tickets:
+    """
+    Numbers operations as they start and tracks the ticket below which every one has
+    finished, so a barrier waits for the operations started before it and never for
+    later ones.
+
+    Tickets finishing ahead of an earlier one are held in a set until the watermark
+    reaches them. Not thread-safe: callers guard it with their own lock or event loop.
+    """
+    __slots__ = ("issued", "finished", "early")
+
+    def __init__(self):
+        # number of tickets issued
+        self.issued = 0
+        # every ticket up to this one has finished
+        self.finished = 0
+        # tickets that finished while an earlier one was still running
+        self.early = set()
+
+
+    def __len__(self) -> int:
+        return self.issued - self.finished - len(self.early)    #operations still running
+
+
+    def issue(self) -> int:
+        """
+        Starts an operation.
+
+        Returns:
+            int: The operation's ticket.
+        """
+        self.issued += 1
+        return self.issued
+
+    def finish(self, ticket) -> bool:
+        """
+        Marks an operation finished.
+
+        Args:
+            ticket (int): Ticket returned by issue().
+
+        Returns:
+            bool: True if the watermark advanced, so barriers may be released.
+        """
+        if (ticket != self.finished + 1):
+            self.early.add(ticket)
+            return False
+
+        self.finished = ticket
+        while (self.finished + 1) in self.early:
+            self.finished += 1
+            self.early.remove(self.finished)
+        return True
 
+    def covers(self, ticket) -> bool:
+        """
+        Returns whether every operation up to a ticket has finished.
 
-def import_file() -> dict:
+        Args:
+            ticket (int): A ticket, or the issued count read when a barrier started.
+        """
+        return self.finished >= ticket
+
+
+def get_option(name: str, default=None):
     """
-    Loads and parses the input JSON file.
+    Reads a --name=value option from the command line.
+
+    Args:
+        name (str): Option name without the leading dashes.
+        default: Value returned when the option is not given.
 
     Returns:
-        dict: Parsed JSON data, or an empty dictionary if the file is missing or invalid.
+        str: The option value, or the default if the option is missing.
+    """
+    prefix = f"--{name}="
+    for arg in sys.argv[1:]:
+        if arg.startswith(prefix):
+            return arg[len(prefix):]
+    return default
+
+
+class ItemScanner:
+    """
+    Finds where a top-level JSON array item ends, one chunk at a time.
+
+    The nesting depth and string state carry over from chunk to chunk, so every
+    character of an item is scanned once however many reads it spans. Only the
+    structure is tracked; the item is validated when it is decoded.
+    """
+    __slots__ = ("scalar", "depth", "quoted", "escaped")
+
+    def __init__(self, first):
+        # whether the item is a number or literal, which ends at the first delimiter
+        self.scalar = first not in "[{\""
+        # brackets and braces open at the scan position
+        self.depth = 0
+        # whether the scan position is inside a string
+        self.quoted = False
+        # whether the chunk ended on a backslash inside a string
+        self.escaped = False
+
+
+    def scan(self, text, position=0) -> int:
+        """
+        Scans a chunk for the end of the item.
+
+        Args:
+            text (str): The chunk.
+            position (int): Index of the first character of the item not scanned yet.
+
+        Returns:
+            int: Index just past the item, or -1 if it continues in the next chunk.
+        """
+        if self.scalar:
+            match = SCALAR_END.search(text, position)
+            return match.start() if match else -1
+
+        if self.escaped and (position < len(text)): #skip the escaped character
+            self.escaped = False
+            position += 1
+        while not self.escaped:
+            match = (STRING_END if self.quoted else STRUCTURE).search(text, position)
+            if match is None:
+                return -1
+            position = match.end()
+            char = match.group()
+            if (char == "\\"):
+                self.escaped = (position == len(text))
+                position += 1
+            elif (char == "\""):
+                self.quoted = not self.quoted
+                if not (self.quoted or self.depth): #a top-level string
+                    return position
+            elif char in "[{":
+                self.depth += 1
+            else:
+                self.depth -= 1
+                if not self.depth:
+                    return position
+        return -1
+
+
+def input_filename() -> str:
+    """
+    Returns the input file named on the command line, or the default input file.
+    """
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]  #skip --name=value options
+    return args[0] if args else INPUT_FILE  #use CLI arg if given, else default file
+
+
+def parse_items(file):
+    """
+    Lazily parses the items of a JSON array, or of a JSON Lines file opened as one.
+
+    The array is read in READ_CHUNK sized pieces. An ItemScanner finds where each
+    item ends, scanning every new chunk once, and the item is decoded when it is
+    complete, so only the current item and one chunk are held in memory. Items
+    are yielded as they are parsed, before the rest of the input is validated.
+
+    Args:
+        file: Text file open for reading; a name ending in .jsonl selects JSON Lines.
+
+    Yields:
+        Each top-level item.
+
+    Raises:
+        json.JSONDecodeError: If the content is not a JSON array or JSON Lines.
+    """
+    if file.name.endswith(".jsonl"):
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+        return
+
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    eof = False
+    expected = "["  #next token: "[", an item or "]" ("first"), an item ("item"), "," or "]" (","), or nothing ("end")
+    while True:
+        position = WHITESPACE.match(buffer, position).end()
+        if (position == len(buffer)):   #whitespace may continue in the next chunk
+            if eof:
+                if (expected == "end"):
+                    return
+                raise json.JSONDecodeError(EXPECTING[expected], buffer, position)
+            buffer = file.read(READ_CHUNK)
+            eof = not buffer
+            position = 0
+            continue
+
+        char = buffer[position]
+        if (expected == "["):
+            if (char != "["):
+                raise json.JSONDecodeError(EXPECTING[expected], buffer, position)
+            expected = "first"
+            position += 1
+        elif (expected == ","):
+            if (char not in ",]"):
+                raise json.JSONDecodeError(EXPECTING[expected], buffer, position)
+            expected = "item" if (char == ",") else "end"
+            position += 1
+        elif (expected == "end"):
+            raise json.JSONDecodeError("Extra data", buffer, position)
+        elif (char == "]" and expected == "first"): #empty array
+            expected = "end"
+            position += 1
+        elif (char in ",]"):
+            raise json.JSONDecodeError(EXPECTING["item"], buffer, position)
+        else:
+            scanner = ItemScanner(char)
+            pieces = []
+            end = scanner.scan(buffer, position)
+            while (end < 0):    #the item continues in the next chunk
+                pieces.append(buffer[position:])
+                buffer = file.read(READ_CHUNK)
+                position = 0
+                if not buffer:  #the item runs to the end of the input
+                    eof = True
+                    end = 0
+                    break
+                end = scanner.scan(buffer)
+            pieces.append(buffer[position:end])
+
+            text = "".join(pieces)
+            item, stop = decoder.raw_decode(text)
+            if (stop < len(text)):  #e.g. a malformed number
+                raise json.JSONDecodeError(EXPECTING[","], text, stop)
+            yield item
+            expected = ","
+            position = end
+
+
+def load_items(filename: str = None):
+    """
+    Lazily loads the items of the input file (a JSON array or, for .jsonl files, JSON Lines).
+    Items are yielded as they are parsed, so the items before a syntax error are
+    still yielded before the error is reported.
+
+    Args:
+        filename (str): File to read, or None for the input file named on the command line.
+
+    Yields:
+        dict: Each customer or branch entry; nothing more once the file is missing or found invalid.
     """
-    filename = sys.argv[1] if len(sys.argv) > 1 else INPUT_FILE  #use CLI arg if given, else default file
+    filename = filename or input_filename()
 
     try:
         with open(filename, 'r') as file:
-            data = json.load(file)  #parse JSON content
-            return data #return parsed data
+            yield from parse_items(file)
     except FileNotFoundError:   #handle missing file
         print(f"Error: File '{filename}' not found.")
-        return {}
     except json.JSONDecodeError:    #handle invalid JSON syntax
         print(f"Error: Invalid JSON in '{filename}'.")
-        return {}
\ No newline at end of file
+
+
+def import_file() -> list:
+    """
+    Loads and parses the input file.
+
+    Returns:
+        list: Parsed entries, or an empty list if the file is missing or invalid.
+    """
+    return list(load_items())
+
+
+def write_items(file, items):
+    """
+    Writes items as a JSON array one item at a time, formatted as json.dump(items, file, indent=2).
+
+    Args:
+        file: Text file open for writing.
+        items (iterable): JSON-serializable items.
+    """
+    file.write("[")
+    separator = "\n"
+    for item in items:
+        file.write(separator + "  " + json.dumps(item, indent=2).replace("\n", "\n  "))
+        separator = ",\n"
+    file.write("\n]" if separator == ",\n" else "]")
+
+
+def export_items(items, filename: str = None):
+    """
+    Streams items to the output file as they are produced: as an indented JSON
+    array, or one compact item per line when the file name ends in .jsonl.
+
+    Args:
+        items (iterable): JSON-serializable items.
+        filename (str): File to write, or None for --output or the default output file.
+    """
+    filename = filename or get_option("output", OUTPUT_FILE)
+
+    with open(filename, 'w') as file:
+        if filename.endswith(".jsonl"):
+            for item in items:
+                file.write(json.dumps(item) + "\n")
+        else:
+            write_items(file, items)
+
+
+def map_ordered(function, items, concurrency: int):
+    """
+    Applies a function to items on a thread pool and yields the results in input order.
+
+    Unlike Executor.map, items are pulled lazily and at most concurrency of them are
+    in flight or waiting to be yielded at once.
+
+    Args:
+        function (callable): Function applied to each item.
+        items (iterable): Items to process.
+        concurrency (int): Most items processed at once.
+
+    Yields:
+        Each result, in the order of the items.
+    """
+    with futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = deque()
+        for item in items:
+            if len(pending) == concurrency:
+                yield pending.popleft().result()
+            pending.append(executor.submit(function, item))
+        while pending:
+            yield pending.popleft().result()
+
+
+def batched(items, size: int):
+    """
+    Splits items into lists of at most size items, pulling them lazily.
+
+    Args:
+        items (iterable): Items to split.
+        size (int): Most items per list.
+
+    Yields:
+        list: The next items, in order.
+    """
+    iterator = iter(items)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
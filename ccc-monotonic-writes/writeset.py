@@ -0,0 +1,159 @@
+"""
+writeset.py
+CSE 531 - CCC Monotonic Writes Project
+tfilewic
+2026-10-18
+
+Compact set of the write ids a branch has applied.
+"""
+
+import struct
+from array import array
+from bisect import bisect_right
+from utilities import split_write_id
+
+
+HEADER = struct.Struct("<qq")   #header of an encoded write set: number of origins and number of write ids
+
+
+class WriteSet:
+    """
+    Applied write ids, kept per origin branch as a contiguous watermark plus
+    the ranges applied out of order above it.
+
+    Every sequence up to an origin's watermark is applied. Writes past a gap
+    are kept as half-open [start, stop) ranges in a flat array('q') of
+    bounds, so membership is one bisect and a write that closes a gap merges
+    its neighbours. Writes that arrive in order only move the watermark, so
+    memory stays constant no matter how many are applied.
+    """
+    __slots__ = ("versions", "ranges", "count")
+
+    def __init__(self):
+        # highest contiguous write sequence applied per origin branch
+        self.versions = {}
+        # bounds of the ranges applied above the watermark per origin branch, as [start, stop, start, stop, ...]
+        self.ranges = {}
+        # number of write ids in the set
+        self.count = 0
+
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, write_id) -> bool:
+        origin, sequence = split_write_id(write_id)
+        if (sequence <= self.versions.get(origin, 0)):
+            return True
+
+        bounds = self.ranges.get(origin)
+        return bounds is not None and bisect_right(bounds, sequence) % 2 == 1  #inside a [start, stop) range
+
+
+    def add(self, write_id) -> bool:
+        """
+        Adds a write id, merging it into its origin's watermark or ranges.
+
+        Args:
+            write_id (int): The write id to add.
+
+        Returns:
+            bool: True if the id was added, False if it was already in the set.
+        """
+        origin, sequence = split_write_id(write_id)
+        watermark = self.versions.get(origin, 0)
+        bounds = self.ranges.get(origin)
+
+        if (sequence <= watermark):
+            return False
+        if (sequence == watermark + 1 and bounds is None): #in-order write: only the watermark moves
+            self.versions[origin] = sequence
+            self.count += 1
+            return True
+
+        if bounds is None:
+            bounds = self.ranges[origin] = array("q")
+        index = bisect_right(bounds, sequence)
+        if (index % 2 == 1):    #inside a range
+            return False
+
+        joins_left = index > 0 and bounds[index - 1] == sequence
+        joins_right = index < len(bounds) and bounds[index] == sequence + 1
+        if joins_left and joins_right:  #fills the gap between two ranges
+            del bounds[index - 1:index + 1]
+        elif joins_left:
+            bounds[index - 1] = sequence + 1
+        elif joins_right:
+            bounds[index] = sequence
+        else:
+            bounds[index:index] = array("q", (sequence, sequence + 1))
+
+        if (bounds[0] == watermark + 1):    #the first range now continues the watermark
+            watermark = bounds[1] - 1
+            del bounds[:2]
+        self.versions[origin] = watermark
+        if not bounds:
+            del self.ranges[origin]
+
+        self.count += 1
+        return True
+
+
+    def highest(self, origin) -> int:
+        """
+        Returns the highest write sequence applied from an origin, contiguous or not.
+
+        Args:
+            origin (int): The origin branch ID.
+        """
+        bounds = self.ranges.get(origin)
+        return bounds[-1] - 1 if bounds else self.versions.get(origin, 0)
+
+
+    def dump(self) -> bytes:
+        """
+        Encodes the write set as the origin, watermark and bound count columns followed
+        by every origin's range bounds.
+
+        Returns:
+            bytes: The encoded write set.
+        """
+        origins = array("q", self.versions)    #every origin with ranges also has a watermark
+        watermarks = array("q", self.versions.values())
+        lengths = array("q", (len(self.ranges.get(origin, ())) for origin in origins))
+        bounds = array("q")
+        for origin in origins:
+            bounds.extend(self.ranges.get(origin, ()))
+        return HEADER.pack(len(origins), self.count) + origins.tobytes() + watermarks.tobytes() + lengths.tobytes() + bounds.tobytes()
+
+
+    @classmethod
+    def load(cls, data, offset=0):
+        """
+        Decodes a write set written by dump().
+
+        Args:
+            data (bytes): Buffer holding the encoded write set.
+            offset (int): Position of the write set in the buffer.
+
+        Returns:
+            tuple[WriteSet, int]: The write set and the position just after it.
+        """
+        origins, count = HEADER.unpack_from(data, offset)
+        offset += HEADER.size
+        columns = []
+        for _ in range(3):
+            column = array("q")
+            column.frombytes(data[offset:offset + 8 * origins])
+            offset += 8 * origins
+            columns.append(column)
+
+        writeset = cls()
+        writeset.count = count
+        for origin, watermark, length in zip(*columns):
+            writeset.versions[origin] = watermark
+            if length:
+                bounds = writeset.ranges[origin] = array("q")
+                bounds.frombytes(data[offset:offset + 8 * length])
+                offset += 8 * length
+        return writeset, offset
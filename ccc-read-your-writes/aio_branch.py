@@ -0,0 +1,286 @@
+"""
+aio_branch.py
+CSE 531 - CCC Read Your Writes Project
+tfilewic
+2026-10-18
+
+Asynchronous (grpc.aio) branch server logic and RPC handlers.
+"""
+
+import asyncio
+import functools
+import grpc
+import banks_pb2
+import banks_pb2_grpc
+from ledger import Ledger
+from writeset import WriteSet
+from utilities import create_aio_channel, gather_acks, Tickets, make_write_id, split_write_id, PROPAGATION_ACKS, SYNC_TIMEOUT, WAIT_TIMEOUT, QUERY
+from time import monotonic
+
+
+class AsyncBranch(banks_pb2_grpc.RPCServicer):
+    """
+    Represents a branch server running on a grpc.aio event loop.
+    Handles local balance updates and propagates changes to peer branches.
+
+    Requests waiting for the writes they depend on, or for peer acks, suspend
+    instead of holding a server thread. All handlers run on one event loop, so
+    state updates between awaits are atomic without a lock. Propagations use
+    the unary RPCs.
+    """
+    def __init__(self, id, balance, branches, acks=PROPAGATION_ACKS):
+        # unique ID of the Branch
+        self.id = id
+        # replica of the Branch's account balances
+        self.accounts = Ledger(balance)
+        # the list of process IDs of the branches
+        self.branches = branches
+        # the list of Client stubs to communicate with the branches
+        self.stubList = list()
+        # write ids this branch has applied
+        self.write_set = WriteSet()
+        # highest contiguous write sequence applied per origin branch, maintained by the write set
+        self.versions = self.write_set.versions
+        # sequence number of the last client write this branch performed
+        self.sequence = 0
+        # number of peer acks a propagated write waits for (None for all peers)
+        self.acks = acks
+        # tickets of the propagation calls in send order; its length is the number still waiting on a peer reply
+        self.calls = Tickets()
+        # set and replaced whenever the oldest in-flight propagation call completes, waking Sync waiters
+        self.propagated = asyncio.Event()
+        # set and replaced whenever a write is applied, waking every dependency waiter
+        self.applied = asyncio.Event()
+        # number of requests currently blocked waiting for dependent writes
+        self.blocked_waiters = 0
+
+        # add all branch stubs to stub list
+        for branch in branches:
+            if branch != self.id:
+                channel = create_aio_channel(branch)
+                self.stubList.append(banks_pb2_grpc.RPCStub(channel))
+
+
+    def track(self, calls):
+        """
+        Issues each propagation call a ticket, held until its peer replies.
+
+        Args:
+            calls (list): Tasks wrapping the peer calls.
+        """
+        for call in calls:
+            call.add_done_callback(functools.partial(self.untrack, self.calls.issue()))
+
+    def untrack(self, ticket, call):
+        """
+        Done callback that marks a propagation call as complete and releases the Sync
+        waiters whose earlier calls have all completed.
+
+        Args:
+            ticket (int): The call's ticket.
+            call (asyncio.Task): The completed task.
+        """
+        if not call.cancelled():
+            call.exception()    #failures are reported through gather_acks
+        if self.calls.finish(ticket):
+            self.propagated.set()
+            self.propagated = asyncio.Event()
+
+    async def propagate(self, amount, write_id, account_id):
+        """
+        Propagates a deposit or withdrawal request to all other branches.
+
+        Sends to every peer at once and waits for the configured number of acks.
+
+        Args:
+            amount (int): The amount to apply.
+            write_id (int): The unique ID of the write operation.
+            account_id (int): The account the write applies to.
+        """
+        propagation_request = banks_pb2.PropagationRequest(amount=amount, write_id=write_id, account_id=account_id)
+
+        calls = []
+        for branchStub in self.stubList:
+            if (propagation_request.amount > 0):
+                calls.append(asyncio.ensure_future(branchStub.Propagate_Deposit(propagation_request)))
+            elif (propagation_request.amount < 0):
+                calls.append(asyncio.ensure_future(branchStub.Propagate_Withdraw(propagation_request)))
+
+        self.track(calls)   #count calls for Sync barriers
+        await gather_acks(calls, self.acks) #wait for peer acks
+
+    def record_write(self, write_id):
+        """
+        Marks a write as applied and advances its origin's contiguous version.
+
+        Args:
+            write_id (int): The unique ID of the applied write.
+        """
+        self.write_set.add(write_id)    #also advances the origin's contiguous version
+
+        self.applied.set()  #wake dependency waiters
+        self.applied = asyncio.Event()
+
+    async def wait_for_writes(self, client_versions, timeout=WAIT_TIMEOUT) -> bool:
+        """
+        Suspends until this branch covers the client's session version vector.
+
+        Waiters sleep on the applied event and only re-check the origins still behind
+        each time a write lands.
+
+        Args:
+            client_versions (dict[int, int]): Highest write sequence the client depends on per origin branch.
+            timeout (float): Maximum number of seconds to wait.
+
+        Returns:
+            bool: True once all writes are applied, False if the timeout expired first.
+        """
+        missing = {origin: sequence for origin, sequence in client_versions.items() if self.versions.get(origin, 0) < sequence}
+        if not missing:
+            return True
+
+        self.blocked_waiters += 1
+        try:
+            deadline = monotonic() + timeout
+            while missing:
+                remaining = deadline - monotonic()
+                if (remaining <= 0):
+                    return False
+                try:
+                    await asyncio.wait_for(self.applied.wait(), remaining)  #woken by the apply path
+                except asyncio.TimeoutError:
+                    return False
+                missing = {origin: sequence for origin, sequence in missing.items() if self.versions.get(origin, 0) < sequence}
+            return True
+        finally:
+            self.blocked_waiters -= 1
+
+    """
+    Since the assignment spec requires a central handler, all RPC interface methods delegate to MsgDelivery.
+    """
+    async def Query(self, request, context):
+        return await self.MsgDelivery(request, context)
+
+    async def Deposit(self, request, context):
+        return await self.MsgDelivery(request, context)
+
+    async def Withdraw(self, request, context):
+        return await self.MsgDelivery(request, context)
+
+    async def Propagate_Deposit(self, request, context):
+        return await self.MsgDelivery(request, context)
+
+    async def Propagate_Withdraw(self, request, context):
+        return await self.MsgDelivery(request, context)
+
+    async def Replicate(self, request_iterator, context):
+        """
+        Applies a peer's replication stream in order, delegating each propagation to MsgDelivery
+        and acking cumulatively.
+        """
+        async for message in request_iterator:
+            await self.MsgDelivery(message.request, context)
+            yield banks_pb2.ReplicationAck(sequence=message.sequence)
+
+    async def Propagate_Batch(self, request, context):
+        """
+        Applies a batch of propagations in order, delegating each one to MsgDelivery.
+        """
+        response = banks_pb2.PropagationBatchResponse()
+        for entry in request.requests:
+            response.responses.append(await self.MsgDelivery(entry, context))
+        return response
+
+    async def Execute_Batch(self, request, context):
+        """
+        Executes a customer's operations in order, delegating each one to MsgDelivery,
+        and returns their results in the same order. Each query carries the batch's
+        session token extended with the batch's earlier writes, as the customer would
+        have sent it.
+        """
+        session = dict(request.versions)
+        response = banks_pb2.OperationBatchResponse()
+        for operation in request.operations:
+            interface = operation.WhichOneof("operation")
+            message = getattr(operation, interface)
+            if (interface == QUERY):
+                message.versions.update(session)    #stamp the session token
+                response.results.add(query=await self.MsgDelivery(message, context))
+                continue
+
+            result = await self.MsgDelivery(message, context)
+            if (result.write_id != 0):  #extend the session with the write
+                origin, sequence = split_write_id(result.write_id)
+                session[origin] = max(session.get(origin, 0), sequence)
+            response.results.add(transaction=result)
+        return response
+
+    async def settle(self, sent):
+        """
+        Suspends until every propagation call up to a ticket has completed.
+
+        Args:
+            sent (int): Number of calls issued when the barrier started.
+        """
+        while not self.calls.covers(sent):
+            await self.propagated.wait()
+
+    async def Sync(self, request, context):
+        """
+        Barrier that returns once every propagation this branch sent before the call has been
+        acknowledged. Propagations sent after it do not hold it up, so it cannot starve under load.
+        """
+        try:
+            await asyncio.wait_for(self.settle(self.calls.issued), SYNC_TIMEOUT)
+        except asyncio.TimeoutError:
+            await context.abort(grpc.StatusCode.DEADLINE_EXCEEDED, "timed out waiting for propagations")
+
+        return banks_pb2.SyncResponse()
+
+
+    async def MsgDelivery(self, request, context):
+        """
+        Central handler for all incoming gRPC requests.
+
+        Determines request type and processes accordingly.
+
+        Args:
+            request: The gRPC request message (TransactionRequest, PropagationRequest, or BalanceRequest).
+            context: The grpc.aio context object for the call.
+
+        Returns:
+            banks_pb2.TransactionResponse or banks_pb2.BalanceResponse:
+            The appropriate response message containing result or balance.
+        """
+        if isinstance(request, banks_pb2.TransactionRequest):   #handle customer deposit or withdraw
+            response = banks_pb2.TransactionResponse()
+            if not self.accounts.apply(request.account_id, request.amount): #apply unless funds are insufficient
+                write_id = 0
+            else:
+                self.sequence += 1  #generate write id
+                write_id = make_write_id(self.id, self.sequence)
+                self.record_write(write_id)
+            response.versions.update(self.versions) #publish the watermark for session read routing
+
+            if (write_id != 0):
+                await self.propagate(request.amount, write_id, request.account_id)
+
+            response.write_id = write_id
+
+        elif isinstance(request, banks_pb2.PropagationRequest):   #handle propagation
+            response = banks_pb2.TransactionResponse()
+
+            if request.write_id not in self.write_set:  #idempotently update branch balance
+                self.accounts.adjust(request.account_id, request.amount)
+                self.record_write(request.write_id)
+
+            response.write_id = request.write_id
+
+        elif isinstance(request, banks_pb2.BalanceRequest): #handle balance request
+            if not await self.wait_for_writes(request.versions):   #enforce read-your-writes
+                await context.abort(grpc.StatusCode.DEADLINE_EXCEEDED, "timed out waiting for session writes")
+            response = banks_pb2.BalanceResponse()
+            response.balance = self.accounts.balance(request.account_id)
+            response.versions.update(self.versions) #publish the watermark for session read routing
+
+        return response
@@ -7,24 +7,40 @@ tfilewic
 Customer client logic and event execution.
 """
 
+import itertools
 import banks_pb2
 import banks_pb2_grpc
-from utilities import create_channel, QUERY, WITHDRAW, DEPOSIT, SUCCESS, FAIL
+from collections import deque
+from operator import itemgetter
+from utilities import batched, create_channel, split_write_id, QUERY, WITHDRAW, DEPOSIT, SUCCESS, FAIL, DEFAULT_ACCOUNT, READ_ROUTING, EVENT_BATCH, SESSION_WINDOW
 
 
 class Customer:
     """
     Represents a customer client that sends banking requests to its assigned branch.
     Handles stub creation and sequential event execution based on the input file.
+
+    With "session" routing, a query goes to a branch whose last reported watermark
+    already covers the session, so it does not block waiting for propagation.
+    Reported watermarks only trail a branch's real one, so the guarantee holds;
+    without a covering branch the query goes to the requested branch.
     """
     
-    def __init__(self, id, events):
+    def __init__(self, id, events, routing=READ_ROUTING, batch=EVENT_BATCH, window=SESSION_WINDOW):
         # unique ID of the Customer
         self.id = id
         # events from the input
         self.events = events
-        # set of writes this customer has completed
-        self.write_set = set()
+        # events sent per Execute_Batch call (1 sends each event as its own RPC)
+        self.batch = batch
+        # events in flight at once (1 waits for each reply before sending the next event)
+        self.window = window
+        # session token: highest completed write sequence per origin branch
+        self.versions = {}
+        # where queries go: "branch" (the requested branch) or "session" (a branch known to cover the session)
+        self.routing = routing
+        # last watermark each contacted branch reported, as {branch_id: {origin: sequence}}
+        self.watermarks = {}
         # a list of received messages used for debugging purpose
         self.received_messages = list()
         # map of stubs
@@ -57,6 +73,64 @@ class Customer:
 
         return self.stubs[branch_id]
 
+    def record_write(self, write_id: int):
+        """
+        Adds a completed write to the session token.
+
+        Args:
+        write_id (int): The ID of the write returned by the branch.
+        """
+        origin, sequence = split_write_id(write_id)
+        self.versions[origin] = max(self.versions.get(origin, 0), sequence)
+
+    def observe(self, branch_id: int, versions):
+        """
+        Merges the watermark a branch reported into its known watermark.
+
+        Args:
+        branch_id (int): The ID of the branch that responded.
+        versions (Mapping[int, int]): Highest contiguous write sequence the branch applied per origin branch.
+        """
+        known = self.watermarks.setdefault(branch_id, {})
+        for origin, sequence in versions.items():
+            if (sequence > known.get(origin, 0)):
+                known[origin] = sequence
+
+    def covers(self, branch_id: int) -> bool:
+        """
+        Returns whether a branch's known watermark covers every write in the session.
+
+        Args:
+        branch_id (int): The ID of the branch to check.
+        """
+        known = self.watermarks.get(branch_id, {})
+        return all(sequence <= known.get(origin, 0) for origin, sequence in self.versions.items())
+
+    def route(self, branch_id: int) -> int:
+        """
+        Picks the branch a query is sent to.
+
+        Args:
+        branch_id (int): The ID of the requested branch.
+
+        Returns:
+        int: The requested branch, or with session routing a branch known to cover the session if the requested one is not.
+        """
+        if (self.routing != "session" or self.covers(branch_id)):
+            return branch_id
+
+        for candidate in self.watermarks:
+            if self.covers(candidate):
+                return candidate
+        return branch_id    #fall back to the requested branch, which waits for the session writes
+
+    def awaitPropagation(self):
+        """
+        Blocks until every branch this customer used has finished propagating its writes.
+        """
+        for stub in self.stubs.values():
+            stub.Sync(banks_pb2.SyncRequest())
+
     def executeEvents(self) -> dict:
         """
         Executes all customer events in order.
@@ -64,6 +138,11 @@ class Customer:
         Returns:
             dict: A dictionary containing the received responses for this customer id.
         """
+        if (self.batch > 1):
+            return self.executeBatches()
+        if (self.window > 1):
+            return self.executePipelined()
+
         output = []
 
         #process all events
@@ -72,25 +151,29 @@ class Customer:
             stub = self.getStub(branch)
             
             interface = event["interface"]
+            account_id = event.get("account", DEFAULT_ACCOUNT)  #accounts are optional in the input
             entry = {"interface": interface, "branch": branch}
 
             #handle deposits and withdrawals
             if interface in {DEPOSIT, WITHDRAW}:
                 money = event["money"] if interface == DEPOSIT else -event["money"]
-                request = banks_pb2.TransactionRequest(amount=money)
+                request = banks_pb2.TransactionRequest(amount=money, account_id=account_id)
                 response = stub.Deposit(request) if (interface == DEPOSIT) else stub.Withdraw(request)
     
                 write_id = response.write_id
+                self.observe(branch, response.versions)
                 if (write_id == 0):
                     entry["result"] = FAIL
                 else:
                     entry["result"] = SUCCESS
-                    self.write_set.add(write_id)
+                    self.record_write(write_id)
 
             #handle balance queries
             elif interface == QUERY:
-                request = banks_pb2.BalanceRequest(writeset=list(self.write_set))
-                response = stub.Query(request)
+                target = self.route(branch)
+                request = banks_pb2.BalanceRequest(versions=self.versions, account_id=account_id)
+                response = self.getStub(target).Query(request)
+                self.observe(target, response.versions)
                 entry["balance"] = response.balance
 
             #ignore unsupported types
@@ -100,4 +183,124 @@ class Customer:
             output.append({"id": self.id, "recv": [entry]}) 
 
         return output 
-    1
\ No newline at end of file
+
+
+    def executeBatches(self) -> list:
+        """
+        Executes all customer events in order, sending each run of consecutive events for
+        the same branch in Execute_Batch calls of up to batch events. The branch stamps the
+        session token on each query, so the guarantee matches the per-event RPCs. Queries
+        in a batch go to the requested branch regardless of the routing mode.
+
+        Returns:
+            list: The received responses for this customer id.
+        """
+        output = []
+        supported = (event for event in self.events if event["interface"] in {DEPOSIT, WITHDRAW, QUERY})  #ignore unsupported types
+
+        for branch, run in itertools.groupby(supported, key=itemgetter("branch")):
+            for events in batched(run, self.batch):
+                operations = []
+                for event in events:
+                    interface = event["interface"]
+                    account_id = event.get("account", DEFAULT_ACCOUNT)  #accounts are optional in the input
+                    if interface == DEPOSIT:
+                        operations.append(banks_pb2.Operation(deposit=banks_pb2.TransactionRequest(amount=event["money"], account_id=account_id)))
+                    elif interface == WITHDRAW:
+                        operations.append(banks_pb2.Operation(withdraw=banks_pb2.TransactionRequest(amount=-event["money"], account_id=account_id)))
+                    else:
+                        operations.append(banks_pb2.Operation(query=banks_pb2.BalanceRequest(account_id=account_id)))
+
+                request = banks_pb2.OperationBatch(versions=self.versions, operations=operations)
+                response = self.getStub(branch).Execute_Batch(request)
+
+                for event, result in zip(events, response.results):
+                    entry = {"interface": event["interface"], "branch": branch}
+                    if event["interface"] == QUERY:
+                        self.observe(branch, result.query.versions)
+                        entry["balance"] = result.query.balance
+                    else:
+                        self.observe(branch, result.transaction.versions)
+                        write_id = result.transaction.write_id
+                        if (write_id == 0):
+                            entry["result"] = FAIL
+                        else:
+                            entry["result"] = SUCCESS
+                            self.record_write(write_id)
+                    output.append({"id": self.id, "recv": [entry]})
+
+        return output
+
+
+    def executePipelined(self) -> list:
+        """
+        Executes all customer events with up to window of them in flight, collecting the
+        replies in event order.
+
+        A query waits for the replies of earlier writes to its account, since their ids
+        go in its session token. A write waits for the replies of earlier events on its
+        account: once applied it propagates to every branch, where an earlier query of
+        the account still in flight could observe it, and its funds check must see every
+        earlier write to the account. Events on different accounts overlap freely, so a
+        session on a single account gains nothing from a window over its writes.
+
+        Returns:
+            list: The received responses for this customer id.
+        """
+        output = []
+        pending = deque()   #(index, event, target, call) of the events in flight, in event order
+        written = {}    #index of the latest write sent per account
+        queried = {}    #index of the latest query sent per account
+        supported = (event for event in self.events if event["interface"] in {DEPOSIT, WITHDRAW, QUERY})  #ignore unsupported types
+
+        for index, event in enumerate(supported, 1):
+            branch = event["branch"]
+            interface = event["interface"]
+            account_id = event.get("account", DEFAULT_ACCOUNT)  #accounts are optional in the input
+
+            if interface == QUERY:
+                depends = written.get(account_id, 0)    #only writes to its account change the balance
+            else:
+                depends = max(written.get(account_id, 0), queried.get(account_id, 0))
+            while pending and (pending[0][0] <= depends or len(pending) >= self.window):   #wait for dependencies and a free slot
+                self.complete(*pending.popleft()[1:], output)
+
+            if interface == QUERY:
+                target = self.route(branch)
+                request = banks_pb2.BalanceRequest(versions=self.versions, account_id=account_id)
+                call = self.getStub(target).Query.future(request)
+                queried[account_id] = index
+            else:
+                target = branch
+                money = event["money"] if interface == DEPOSIT else -event["money"]
+                request = banks_pb2.TransactionRequest(amount=money, account_id=account_id)
+                stub = self.getStub(branch)
+                call = stub.Deposit.future(request) if (interface == DEPOSIT) else stub.Withdraw.future(request)
+                written[account_id] = index
+            pending.append((index, event, target, call))
+
+        while pending:
+            self.complete(*pending.popleft()[1:], output)
+        return output
+
+    def complete(self, event, target, call, output):
+        """
+        Waits for the reply to an in-flight event and records it.
+
+        Args:
+        event (dict): The event the call was sent for.
+        target (int): The ID of the branch the call was sent to.
+        call (grpc.Future): The call future.
+        output (list): Response entries, appended to in event order.
+        """
+        response = call.result()
+        self.observe(target, response.versions)
+        entry = {"interface": event["interface"], "branch": event["branch"]}
+        if event["interface"] == QUERY:
+            entry["balance"] = response.balance
+        elif (response.write_id == 0):
+            entry["result"] = FAIL
+        else:
+            entry["result"] = SUCCESS
+            self.record_write(response.write_id)
+        output.append({"id": self.id, "recv": [entry]})
\ No newline at end of file
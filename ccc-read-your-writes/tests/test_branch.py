@@ -0,0 +1,116 @@
+"""
+test_branch.py
+CSE 531 - CCC Read Your Writes Project
+tfilewic
+2026-10-18
+
+Tests for the branch's anti-entropy, called in process without a server.
+"""
+
+import grpc
+import pytest
+
+pytest.importorskip("banks_pb2")    #generated by conftest when grpcio-tools is installed
+
+import banks_pb2
+from branch import Branch
+from utilities import make_write_id
+
+
+class Aborted(grpc.RpcError):
+    """
+    Raised by Context.abort, as a real server aborts the call.
+    """
+    def __init__(self, code, details):
+        self.status = code
+        self.message = details
+
+    def code(self):
+        return self.status
+
+    def details(self):
+        return self.message
+
+
+class Context:
+    """
+    Stands in for the gRPC servicer context.
+    """
+    def abort(self, code, details):
+        raise Aborted(code, details)
+
+
+class Loopback:
+    """
+    Stands in for a peer's stub, calling the peer branch in process.
+    """
+    def __init__(self, branch):
+        self.branch = branch
+
+    def Catch_Up(self, request):
+        return self.branch.Catch_Up(request, Context())
+
+    def Transfer_State(self, request):
+        return self.branch.Transfer_State(request, Context())
+
+
+def propagation(origin, sequence, amount) -> banks_pb2.PropagationRequest:
+    return banks_pb2.PropagationRequest(amount=amount, write_id=make_write_id(origin, sequence), account_id=0)
+
+
+def receive(branch, origin, writes):
+    for sequence, amount in writes:
+        branch.MsgDelivery(propagation(origin, sequence, amount), Context())
+
+
+def catch_up_request(id, versions) -> banks_pb2.CatchUpRequest:
+    return banks_pb2.CatchUpRequest(versions=versions, id=id)
+
+
+def test_catch_up_fills_a_gap():
+    source = Branch(1, 100, [1, 2, 3])
+    receive(source, 3, [(1, 1), (2, 2), (3, 4)])
+    lagging = Branch(2, 100, [1, 2, 3])
+    receive(lagging, 3, [(1, 1), (3, 4)])
+    lagging.stubList[0] = Loopback(source)
+
+    assert lagging.catch_up(0) == 1
+    assert lagging.accounts.balance(0) == 107
+    assert lagging.versions == {3: 3}
+
+
+def test_history_is_pruned_below_the_lowest_peer_watermark():
+    branch = Branch(1, 100, [1, 2, 3])
+    receive(branch, 3, [(sequence, 1) for sequence in range(1, 6)])
+
+    assert list(branch.Catch_Up(catch_up_request(2, {3: 5}), Context())) == []
+    assert branch.pruned == {}  #peer 3 has not reported yet
+    assert sorted(branch.history[3]) == [1, 2, 3, 4, 5]
+
+    missing = list(branch.Catch_Up(catch_up_request(3, {3: 2}), Context()))
+    assert [write.write_id for write in missing] == [make_write_id(3, sequence) for sequence in (3, 4, 5)]
+    assert branch.pruned == {3: 2}
+    assert sorted(branch.history[3]) == [3, 4, 5]
+
+    list(branch.Catch_Up(catch_up_request(3, {3: 4}), Context()))
+    assert branch.pruned == {3: 4}
+    assert sorted(branch.history[3]) == [5]
+
+    with pytest.raises(Aborted) as error:   #asks for pruned writes
+        list(branch.Catch_Up(catch_up_request(2, {3: 3}), Context()))
+    assert error.value.code() == grpc.StatusCode.OUT_OF_RANGE
+
+
+def test_catch_up_behind_the_pruned_history_transfers_the_state():
+    source = Branch(1, 100, [1, 2, 3])
+    receive(source, 3, [(1, 1), (2, 2), (3, 4), (4, 8), (5, 16)])
+    for peer in (2, 3):
+        list(source.Catch_Up(catch_up_request(peer, {3: 2}), Context()))
+    restarted = Branch(2, 0, [1, 2, 3])
+    receive(restarted, 3, [(6, 32)])    #a write the source has not applied yet
+    restarted.stubList[0] = Loopback(source)
+
+    assert restarted.catch_up(0) == 5
+    assert restarted.accounts.balance(0) == 163
+    assert restarted.versions == {3: 6}
+    assert restarted.pruned == {3: 2}
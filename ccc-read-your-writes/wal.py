@@ -0,0 +1,242 @@
+"""
+wal.py
+CSE 531 - CCC Read Your Writes Project
+tfilewic
+2026-10-18
+
+Write-ahead log and snapshots that make a branch's state durable across restarts.
+"""
+
+import os
+import struct
+import threading
+import zlib
+from utilities import SNAPSHOT_INTERVAL
+
+FRAME = struct.Struct("<II")    #record header: payload length and crc32
+
+
+class WriteAheadLog:
+    """
+    Append-only, group-committed log of the writes a branch applies, plus snapshots.
+
+    The log is a series of segment files (wal-<n>.log). Appends are buffered and
+    numbered; sync() makes them durable, and concurrent callers share one fsync:
+    the first caller flushes everything appended so far while the rest wait for it.
+
+    A snapshot (snapshot-<n>.bin) holds the state produced by every segment
+    before n, so recovery loads the newest snapshot and replays segments from n
+    on. Records are framed with a length and crc32, so a write torn by a crash
+    ends the replay of its segment.
+    """
+    def __init__(self, directory, interval=SNAPSHOT_INTERVAL):
+        # directory holding the segments and snapshots
+        self.directory = directory
+        # records appended between snapshots
+        self.interval = interval
+        # number of the segment being appended to
+        self.segment = 0
+        # file of the current segment (None until opened)
+        self.file = None
+        # sequence number of the last appended record
+        self.appended = 0
+        # sequence number of the last record known to be on disk
+        self.durable = 0
+        # records appended since the last snapshot
+        self.since_snapshot = 0
+        # whether a thread is flushing the log
+        self.flushing = False
+        # whether a snapshot is being written
+        self.checkpointing = False
+        # guards the counters and the current segment
+        self.lock = threading.Lock()
+        # notified when a flush completes
+        self.flushed = threading.Condition(self.lock)
+
+        os.makedirs(directory, exist_ok=True)
+
+
+    def numbered(self, prefix, suffix) -> list:
+        """
+        Lists the numbers of the files with the given prefix and suffix, in ascending order.
+        """
+        numbers = []
+        for name in os.listdir(self.directory):
+            if name.startswith(prefix) and name.endswith(suffix):
+                numbers.append(int(name[len(prefix):-len(suffix)]))
+        return sorted(numbers)
+
+    def path(self, prefix, number, suffix) -> str:
+        return os.path.join(self.directory, f"{prefix}{number}{suffix}")
+
+
+    def load_snapshot(self):
+        """
+        Reads the newest snapshot.
+
+        Returns:
+            bytes: The snapshot data, or None if no snapshot has been written.
+        """
+        snapshots = self.numbered("snapshot-", ".bin")
+        if not snapshots:
+            return None
+
+        self.segment = snapshots[-1]
+        with open(self.path("snapshot-", self.segment, ".bin"), 'rb') as file:
+            return file.read()
+
+    def replay(self):
+        """
+        Yields the records written after the loaded snapshot, oldest first.
+
+        Yields:
+            bytes: Each record payload.
+        """
+        for number in self.numbered("wal-", ".log"):
+            if number < self.segment:   #covered by the snapshot
+                continue
+            with open(self.path("wal-", number, ".log"), 'rb') as file:
+                data = file.read()
+
+            offset = 0
+            while offset + FRAME.size <= len(data):
+                length, checksum = FRAME.unpack_from(data, offset)
+                payload = data[offset + FRAME.size:offset + FRAME.size + length]
+                if len(payload) < length or zlib.crc32(payload) != checksum:    #torn tail
+                    break
+                offset += FRAME.size + length
+                self.since_snapshot += 1
+                yield payload
+
+    def open(self):
+        """
+        Starts a new segment for appends. Called once recovery has replayed the log.
+        """
+        segments = self.numbered("wal-", ".log")
+        self.segment = max(segments[-1] + 1 if segments else 0, self.segment)
+        self.file = open(self.path("wal-", self.segment, ".log"), 'ab')
+
+
+    def append(self, record: bytes) -> int:
+        """
+        Buffers a record at the end of the log. Callers append in the order they
+        apply writes and call sync() before acknowledging them.
+
+        Args:
+            record (bytes): The record payload.
+
+        Returns:
+            int: The record's sequence number, to pass to sync().
+        """
+        frame = FRAME.pack(len(record), zlib.crc32(record)) + record
+        with self.lock:
+            self.file.write(frame)
+            self.appended += 1
+            self.since_snapshot += 1
+            return self.appended
+
+    def sync(self, sequence: int):
+        """
+        Blocks until the record with the given sequence number is on disk.
+
+        Args:
+            sequence (int): Sequence number returned by append().
+        """
+        with self.lock:
+            while self.durable < sequence:
+                if self.flushing:   #join the flush in progress
+                    self.flushed.wait()
+                    continue
+
+                self.flushing = True
+                target = self.appended
+                file = self.file
+                self.lock.release()
+                try:
+                    file.flush()
+                    os.fsync(file.fileno())
+                finally:
+                    self.lock.acquire()
+                    self.flushing = False
+                    self.flushed.notify_all()
+                self.durable = max(self.durable, target)
+
+
+    def due(self) -> bool:
+        """
+        Returns whether enough records have been appended to take a snapshot.
+        """
+        return self.since_snapshot >= self.interval and not self.checkpointing
+
+    def rotate(self):
+        """
+        Seals the current segment and starts a new one. Must be called while the
+        state matching the log is captured, so the snapshot cut is exact.
+
+        Returns:
+            int: Number of the new segment, or None if a snapshot is already in progress.
+        """
+        with self.lock:
+            if self.checkpointing:
+                return None
+            while self.flushing:
+                self.flushed.wait()
+
+            self.checkpointing = True
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            self.durable = self.appended
+
+            self.segment += 1
+            self.since_snapshot = 0
+            self.file = open(self.path("wal-", self.segment, ".log"), 'ab')
+            return self.segment
+
+    def write_snapshot(self, segment: int, state: bytes):
+        """
+        Durably writes a snapshot covering every segment before the given one, then
+        removes the segments and snapshots it replaces.
+
+        Args:
+            segment (int): Segment number returned by rotate().
+            state (bytes): Encoded state captured together with the rotation.
+        """
+        try:
+            final = self.path("snapshot-", segment, ".bin")
+            temporary = final + ".tmp"
+            with open(temporary, 'wb') as file:
+                file.write(state)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temporary, final)    #atomically publish the snapshot
+
+            directory = os.open(self.directory, os.O_RDONLY)
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
+
+            for number in self.numbered("wal-", ".log"):
+                if number < segment:
+                    os.remove(self.path("wal-", number, ".log"))
+            for number in self.numbered("snapshot-", ".bin"):
+                if number < segment:
+                    os.remove(self.path("snapshot-", number, ".bin"))
+        finally:
+            with self.lock:
+                self.checkpointing = False
+
+
+    def close(self):
+        """
+        Flushes and closes the current segment.
+        """
+        with self.lock:
+            while self.flushing:
+                self.flushed.wait()
+            if self.file is not None:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.file.close()
+                self.file = None
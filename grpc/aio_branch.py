@@ -0,0 +1,206 @@
+"""
+aio_branch.py
+CSE 531 - gRPC Project
+tfilewic
+2026-10-18
+
+Asynchronous (grpc.aio) branch server logic and RPC handlers.
+"""
+
+import asyncio
+import functools
+import grpc
+import banks_pb2
+import banks_pb2_grpc
+from ledger import Ledger
+from utilities import create_aio_channel, gather_acks, Tickets, PROPAGATION_ACKS, SYNC_TIMEOUT, QUERY
+
+
+class AsyncBranch(banks_pb2_grpc.RPCServicer):
+    """
+    Represents a branch server running on a grpc.aio event loop.
+    Handles local balance updates and propagates changes to peer branches.
+
+    Handlers waiting on peers suspend instead of holding a server thread. All
+    handlers run on one event loop, so state updates between awaits are atomic
+    without a lock. Propagations use the unary RPCs.
+    """
+    def __init__(self, id, balance, branches, acks=PROPAGATION_ACKS):
+        # unique ID of the Branch
+        self.id = id
+        # replica of the Branch's account balances
+        self.accounts = Ledger(balance)
+        # the list of process IDs of the branches
+        self.branches = branches
+        # the list of Client stubs to communicate with the branches
+        self.stubList = list()
+        # a list of received messages used for debugging purpose
+        self.recvMsg = list()
+        # number of peer acks a propagated write waits for (None for all peers)
+        self.acks = acks
+        # tickets of the propagation calls in send order; its length is the number still waiting on a peer reply
+        self.calls = Tickets()
+        # set and replaced whenever the oldest in-flight propagation call completes, waking Sync waiters
+        self.propagated = asyncio.Event()
+
+        # add all branch stubs to stub list
+        for branch in branches:
+            if branch != self.id:
+                channel = create_aio_channel(branch)
+                self.stubList.append(banks_pb2_grpc.RPCStub(channel))
+
+
+    def track(self, calls):
+        """
+        Issues each propagation call a ticket, held until its peer replies.
+
+        Args:
+            calls (list): Tasks wrapping the peer calls.
+        """
+        for call in calls:
+            call.add_done_callback(functools.partial(self.untrack, self.calls.issue()))
+
+    def untrack(self, ticket, call):
+        """
+        Done callback that marks a propagation call as complete and releases the Sync
+        waiters whose earlier calls have all completed.
+
+        Args:
+            ticket (int): The call's ticket.
+            call (asyncio.Task): The completed task.
+        """
+        if not call.cancelled():
+            call.exception()    #failures are reported through gather_acks
+        if self.calls.finish(ticket):
+            self.propagated.set()
+            self.propagated = asyncio.Event()
+
+    async def propagate(self, request):
+        """
+        Propagates a deposit or withdrawal request to all other branches.
+
+        Sends to every peer at once and waits for the configured number of acks.
+
+        Args:
+            request (banks_pb2.TransactionRequest): The transaction to propagate.
+        """
+        calls = []
+        for branchStub in self.stubList:
+            if (request.amount > 0):
+                calls.append(asyncio.ensure_future(branchStub.Propagate_Deposit(request)))
+            elif (request.amount < 0):
+                calls.append(asyncio.ensure_future(branchStub.Propagate_Withdraw(request)))
+
+        self.track(calls)   #count calls for Sync barriers
+        await gather_acks(calls, self.acks) #wait for peer acks
+
+
+    """
+    Since the assignment spec requires a central handler, all RPC interface methods delegate to MsgDelivery.
+    """
+    async def Query(self, request, context):
+        return await self.MsgDelivery(request, context)
+
+    async def Deposit(self, request, context):
+        return await self.MsgDelivery(request, context)
+
+    async def Withdraw(self, request, context):
+        return await self.MsgDelivery(request, context)
+
+    async def Propagate_Deposit(self, request, context):
+        return await self.MsgDelivery(request, context)
+
+    async def Propagate_Withdraw(self, request, context):
+        return await self.MsgDelivery(request, context)
+
+    async def Replicate(self, request_iterator, context):
+        """
+        Applies a peer's replication stream in order, delegating each propagation to MsgDelivery
+        and acking cumulatively.
+        """
+        async for message in request_iterator:
+            await self.MsgDelivery(message.request, context)
+            yield banks_pb2.ReplicationAck(sequence=message.sequence)
+
+    async def Propagate_Batch(self, request, context):
+        """
+        Applies a batch of propagations in order, delegating each one to MsgDelivery.
+        """
+        response = banks_pb2.PropagationBatchResponse()
+        for entry in request.requests:
+            response.responses.append(await self.MsgDelivery(entry, context))
+        return response
+
+    async def Execute_Batch(self, request, context):
+        """
+        Executes a customer's operations in order, delegating each one to MsgDelivery,
+        and returns their results in the same order.
+        """
+        response = banks_pb2.OperationBatchResponse()
+        for operation in request.operations:
+            interface = operation.WhichOneof("operation")
+            result = await self.MsgDelivery(getattr(operation, interface), context)
+            if (interface == QUERY):
+                response.results.add(query=result)
+            else:
+                response.results.add(transaction=result)
+        return response
+
+    async def settle(self, sent):
+        """
+        Suspends until every propagation call up to a ticket has completed.
+
+        Args:
+            sent (int): Number of calls issued when the barrier started.
+        """
+        while not self.calls.covers(sent):
+            await self.propagated.wait()
+
+    async def Sync(self, request, context):
+        """
+        Barrier that returns once every propagation this branch sent before the call has been
+        acknowledged. Propagations sent after it do not hold it up, so it cannot starve under load.
+        """
+        try:
+            await asyncio.wait_for(self.settle(self.calls.issued), SYNC_TIMEOUT)
+        except asyncio.TimeoutError:
+            await context.abort(grpc.StatusCode.DEADLINE_EXCEEDED, "timed out waiting for propagations")
+
+        return banks_pb2.SyncResponse()
+
+
+    async def MsgDelivery(self, request, context):
+        """
+        Central handler for all incoming gRPC requests.
+
+        Determines request type and processes accordingly.
+
+        Args:
+            request: The gRPC request message (TransactionRequest or BalanceRequest).
+            context: The grpc.aio context object for the call.
+
+        Returns:
+            banks_pb2.TransactionResponse or banks_pb2.BalanceResponse:
+            The appropriate response message containing result or balance.
+        """
+        if isinstance(request, banks_pb2.TransactionRequest):   #handle deposit or withdraw
+            response = banks_pb2.TransactionResponse()
+            if (request.id == self.id): #customer request: apply unless funds are insufficient (no await between check and apply)
+                sufficient = self.accounts.apply(request.account_id, request.amount)
+            else:   #propagation the origin already accepted: apply unconditionally so replicas converge
+                self.accounts.adjust(request.account_id, request.amount)
+                sufficient = True
+
+            if not sufficient: #return fail on insufficient funds
+                response.result = "fail"
+            else:
+                if (request.id == self.id): #propagate customer requests
+                    await self.propagate(request)
+
+                response.result = "success"
+
+        elif isinstance(request, banks_pb2.BalanceRequest): #handle balance request
+            response = banks_pb2.BalanceResponse()
+            response.balance = self.accounts.balance(request.account_id)
+
+        return response
@@ -0,0 +1,171 @@
+"""
+benchmark.py
+CSE 531 - gRPC Project
+tfilewic
+2026-10-18
+
+Starts an in-process branch cluster, drives a synthetic customer workload
+through it and reports throughput and per-RPC latency as JSON.
+"""
+
+import functools
+import json
+import random
+from concurrent import futures
+from time import perf_counter
+from utilities import get_option, WITHDRAW, DEPOSIT, DEFAULT_ACCOUNT, EVENT_BATCH
+from customer import Customer
+import metrics
+import server
+
+BRANCHES = 3    #number of branches in the cluster
+SESSIONS = 10   #number of customer sessions
+SESSION_LENGTH = 100    #events per session
+CONCURRENCY = 4 #sessions run at once
+MIX = "deposit=0.4,withdraw=0.3,query=0.3"  #relative weight of each interface
+SKEW = 0.0  #zipf exponent for picking branches (0 is uniform)
+BALANCE = 1000  #starting balance of every branch
+MAX_AMOUNT = 100    #largest deposit or withdrawal amount
+SEED = 0    #random seed for the workload
+ACCOUNTS = 1    #accounts per branch the sessions are spread over (account 0 starts with BALANCE, others empty)
+
+
+def summarize() -> dict:
+    """
+    Builds the per-RPC latency summary in milliseconds from the latency histograms
+    the branch servers' metrics interceptor recorded.
+
+    Returns:
+        dict: Count, mean, p50/p95/p99 and max latency for each method.
+    """
+    with metrics.registry.lock:
+        histograms = sorted(metrics.registry.histograms.items())
+    return {name.split("/", 1)[1]: histogram.summary() for name, histogram in histograms if name.startswith("rpc/")}
+
+
+def parse_mix(mix: str) -> dict:
+    """
+    Parses an interface mix such as "deposit=0.4,withdraw=0.3,query=0.3".
+
+    Args:
+        mix (str): Comma separated interface=weight pairs.
+
+    Returns:
+        dict: Weight keyed by interface name.
+    """
+    weights = {}
+    for pair in mix.split(","):
+        interface, weight = pair.split("=")
+        weights[interface.strip()] = float(weight)
+    return weights
+
+
+def generate_workload(config: dict) -> list:
+    """
+    Generates branch and customer entries in the input file format.
+
+    Sessions are assigned to branches with a zipf distribution so that a
+    positive skew concentrates load on the lowest branch ids.
+
+    Args:
+        config (dict): Benchmark configuration.
+
+    Returns:
+        list: Input entries for the cluster and the customer sessions.
+    """
+    rng = random.Random(config["seed"])
+    branch_ids = list(range(1, config["branches"] + 1))
+    branch_weights = [1 / (id ** config["skew"]) for id in branch_ids]
+    interfaces = list(config["mix"].keys())
+    interface_weights = list(config["mix"].values())
+
+    data = [{"id": id, "type": "branch", "balance": BALANCE} for id in branch_ids]
+    event_id = 0
+    for _ in range(config["sessions"]):
+        account = rng.randrange(config["accounts"]) if (config["accounts"] > 1) else DEFAULT_ACCOUNT  #each session uses one account
+        events = []
+        for interface in rng.choices(interfaces, interface_weights, k=config["session_length"]):
+            event_id += 1
+            event = {"id": event_id, "interface": interface, "account": account}
+            if interface in {DEPOSIT, WITHDRAW}:
+                event["money"] = rng.randint(1, MAX_AMOUNT)
+            events.append(event)
+
+        id = rng.choices(branch_ids, branch_weights)[0] #customers talk to the branch sharing their id
+        data.append({"id": id, "type": "customer", "events": events})
+
+    return data
+
+
+def run_session(item: dict, batch: int = EVENT_BATCH) -> int:
+    """
+    Executes one customer session and waits for its writes to propagate.
+
+    Args:
+        item (dict): The customer entry.
+        batch (int): Events sent per Execute_Batch call.
+
+    Returns:
+        int: Number of events executed.
+    """
+    customer = Customer(item["id"], item["events"], batch)
+    customer.createStub()
+    customer.executeEvents()
+    customer.awaitPropagation()
+    return len(item["events"])
+
+
+def run(config: dict) -> dict:
+    """
+    Runs the benchmark against an in-process cluster.
+
+    Args:
+        config (dict): Benchmark configuration.
+
+    Returns:
+        dict: Throughput and per-RPC latency report.
+    """
+    data = generate_workload(config)
+    metrics.registry.enable()   #branch servers time every unary RPC
+    server.start_branches(data, data_dir=config["data_dir"])
+
+    try:
+        sessions = [item for item in data if item.get("type") == "customer"]
+        start = perf_counter()
+        with futures.ThreadPoolExecutor(max_workers=config["concurrency"]) as executor:
+            operations = sum(executor.map(functools.partial(run_session, batch=config["batch"]), sessions))
+        elapsed = perf_counter() - start
+    finally:
+        server.stop_branches(0)
+
+    return {
+        "variant": "grpc",
+        "config": config,
+        "operations": operations,
+        "seconds": round(elapsed, 3),
+        "ops_per_sec": round(operations / elapsed, 1),
+        "rpcs": summarize()
+    }
+
+
+#run when script called directly
+if __name__ == "__main__":
+    config = {
+        "branches": int(get_option("branches", BRANCHES)),
+        "sessions": int(get_option("sessions", SESSIONS)),
+        "session_length": int(get_option("session-length", SESSION_LENGTH)),
+        "concurrency": int(get_option("concurrency", CONCURRENCY)),
+        "mix": parse_mix(get_option("mix", MIX)),
+        "skew": float(get_option("skew", SKEW)),
+        "seed": int(get_option("seed", SEED)),
+        "accounts": int(get_option("accounts", ACCOUNTS)),
+        "data_dir": get_option("data-dir"),
+        "batch": int(get_option("batch", EVENT_BATCH))
+    }
+    report = json.dumps(run(config), indent=2)
+    print(report)
+
+    output = get_option("output")
+    if output:
+        with open(output, 'w') as file:
+            file.write(report)
@@ -7,9 +7,15 @@ tfilewic
 Branch server logic and RPC handlers.
 """
 
+import functools
+import grpc
+import threading
+from contextlib import ExitStack
 import banks_pb2
 import banks_pb2_grpc
-from utilities import create_channel
+from ledger import Ledger
+from outbox import PeerOutbox, ReplicationStream
+from utilities import create_channel, await_acks, Tickets, PROPAGATION_ACKS, PROPAGATION_BATCHING, PROPAGATION_STREAMING, SYNC_TIMEOUT, QUERY, LOCK_STRIPES
 
 
 class Branch(banks_pb2_grpc.RPCServicer):
@@ -17,17 +23,29 @@ class Branch(banks_pb2_grpc.RPCServicer):
     Represents a branch server.
     Handles local balance updates and propagates changes to peer branches.
     """
-    def __init__(self, id, balance, branches):
+    def __init__(self, id, balance, branches, acks=PROPAGATION_ACKS, batched=PROPAGATION_BATCHING, streamed=PROPAGATION_STREAMING, wal=None):
         # unique ID of the Branch
         self.id = id
-        # replica of the Branch's balance
-        self.balance = balance
+        # replica of the Branch's account balances
+        self.accounts = Ledger(balance)
         # the list of process IDs of the branches
         self.branches = branches
         # the list of Client stubs to communicate with the branches
         self.stubList = list()
         # a list of received messages used for debugging purpose
         self.recvMsg = list()
+        # number of peer acks a propagated write waits for (None for all peers)
+        self.acks = acks
+        # account locks guarding check-then-act updates, striped by account id; reads of balance are lock-free
+        self.locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        # guards opening accounts, which grows the ledger shared by every stripe
+        self.opening = threading.Lock()
+        # tickets of the propagation calls in send order; its length is the number still waiting on a peer reply
+        self.calls = Tickets()
+        # notified when the oldest in-flight propagation call completes
+        self.propagated = threading.Condition()
+        # write-ahead log of applied writes (None keeps the state in memory only)
+        self.wal = wal
  
         # add all branch stubs to stub list 
         for branch in branches:
@@ -35,19 +53,146 @@ class Branch(banks_pb2_grpc.RPCServicer):
                 channel =  create_channel(branch)
                 self.stubList.append(banks_pb2_grpc.RPCStub(channel))
 
+        # per-peer replication streams or batching queues, in the same order as stubList (empty for unary calls)
+        self.outboxes = []
+        for stub in self.stubList:
+            if streamed:
+                self.outboxes.append(ReplicationStream(stub))
+            elif batched:
+                self.outboxes.append(PeerOutbox(stub))
+
+
+    def restore(self):
+        """
+        Rebuilds the balances from the latest snapshot and the WAL tail, then opens the WAL for appends.
+        """
+        if self.wal is None:
+            return
+
+        snapshot = self.wal.load_snapshot()
+        if snapshot is not None:
+            self.accounts, _ = Ledger.load(snapshot)
+        for record in self.wal.replay():    #reapply writes logged after the snapshot
+            request = banks_pb2.TransactionRequest.FromString(record)
+            self.accounts.adjust(request.account_id, request.amount)
+        self.wal.open()
+
+    def journal(self, request) -> int:
+        """
+        Appends an applied write to the WAL. Must be called with the account's stripe lock held.
+
+        Args:
+            request (banks_pb2.TransactionRequest): The applied transaction.
+
+        Returns:
+            int: The record's WAL sequence number, or 0 without a WAL.
+        """
+        if self.wal is None:
+            return 0
+        return self.wal.append(request.SerializeToString())
+
+    def commit(self, sequence):
+        """
+        Waits until a journaled write is on disk, then takes a snapshot if one is due.
+
+        Args:
+            sequence (int): WAL sequence number returned by journal().
+        """
+        if not sequence:
+            return
+        self.wal.sync(sequence) #group commit with concurrent writers
+        if self.wal.due():
+            self.checkpoint()
+
+    def checkpoint(self):
+        """
+        Snapshots the balances and truncates the WAL behind them.
+        """
+        with ExitStack() as stack:  #capture the state and rotate the log at the same point
+            for lock in (self.opening, *self.locks):
+                stack.enter_context(lock)
+            segment = self.wal.rotate()
+            if segment is None:
+                return
+            state = self.accounts.dump()
+        self.wal.write_snapshot(segment, state)
+
+
+    def stop(self):
+        """
+        Stops the per-peer outboxes and closes the WAL.
+        Called once the server has stopped and before the peer channels close.
+        """
+        for outbox in self.outboxes:
+            outbox.close()
+        if self.wal is not None:
+            self.wal.close()
+
+
+    def lock_account(self, request) -> threading.Lock:
+        """
+        Returns the lock of a write's account stripe, first opening the account if the
+        write can create it, so writers under different stripes never grow the ledger at once.
+
+        Args:
+            request (banks_pb2.TransactionRequest): The write to apply.
+
+        Returns:
+            threading.Lock: The account's stripe lock.
+        """
+        account = request.account_id
+        if account not in self.accounts and (request.amount >= 0 or request.id != self.id):    #customer withdrawals never open accounts
+            with self.opening:
+                if account not in self.accounts:
+                    self.accounts.open(account)
+        return self.locks[account % len(self.locks)]
+
+
+    def track(self, calls):
+        """
+        Issues each propagation call a ticket, held until its peer replies.
+
+        Args:
+            calls (list): Call futures returned by the peer stubs.
+        """
+        with self.propagated:
+            tickets = [self.calls.issue() for _ in calls]
+        for call, ticket in zip(calls, tickets):
+            call.add_done_callback(functools.partial(self.untrack, ticket))
+
+    def untrack(self, ticket, call):
+        """
+        Done callback that marks a propagation call as complete and releases the Sync
+        waiters whose earlier calls have all completed.
+
+        Args:
+            ticket (int): The call's ticket.
+            call: The completed call future.
+        """
+        with self.propagated:
+            if self.calls.finish(ticket):
+                self.propagated.notify_all()
 
     def propagate(self, request):
         """
         Propagates a deposit or withdrawal request to all other branches.
 
+        Sends to every peer at once and waits for the configured number of acks.
+
         Args:
             request (banks_pb2.TransactionRequest): The transaction to propagate.
         """
-        for branchStub in self.stubList:
-            if (request.amount > 0):
-                branchStub.Propagate_Deposit(request)
+        calls = []
+        for peer, branchStub in enumerate(self.stubList):
+            if (request.amount != 0 and self.outboxes):  #send through the peer's stream or batch queue
+                calls.append(self.outboxes[peer].send(request))
+            elif (request.amount > 0):
+                calls.append(branchStub.Propagate_Deposit.future(request))
             elif (request.amount < 0):
-                branchStub.Propagate_Withdraw(request)
+                calls.append(branchStub.Propagate_Withdraw.future(request))
+
+        self.track(calls)   #count calls for Sync barriers
+        await_acks(calls, self.acks)    #wait for peer acks
 
 
     """
@@ -68,6 +213,51 @@ class Branch(banks_pb2_grpc.RPCServicer):
     def Propagate_Withdraw(self, request, context):
         return self.MsgDelivery(request, context)
 
+    def Replicate(self, request_iterator, context):
+        """
+        Applies a peer's replication stream in order, delegating each propagation to MsgDelivery
+        and acking cumulatively.
+        """
+        for message in request_iterator:
+            self.MsgDelivery(message.request, context)
+            yield banks_pb2.ReplicationAck(sequence=message.sequence)
+
+    def Propagate_Batch(self, request, context):
+        """
+        Applies a batch of propagations in order, delegating each one to MsgDelivery.
+        """
+        response = banks_pb2.PropagationBatchResponse()
+        for entry in request.requests:
+            response.responses.append(self.MsgDelivery(entry, context))
+        return response
+
+    def Execute_Batch(self, request, context):
+        """
+        Executes a customer's operations in order, delegating each one to MsgDelivery,
+        and returns their results in the same order.
+        """
+        response = banks_pb2.OperationBatchResponse()
+        for operation in request.operations:
+            interface = operation.WhichOneof("operation")
+            result = self.MsgDelivery(getattr(operation, interface), context)
+            if (interface == QUERY):
+                response.results.add(query=result)
+            else:
+                response.results.add(transaction=result)
+        return response
+
+    def Sync(self, request, context):
+        """
+        Barrier that returns once every propagation this branch sent before the call has been
+        acknowledged. Propagations sent after it do not hold it up, so it cannot starve under load.
+        """
+        with self.propagated:
+            sent = self.calls.issued
+            if not self.propagated.wait_for(lambda: self.calls.covers(sent), SYNC_TIMEOUT):
+                context.abort(grpc.StatusCode.DEADLINE_EXCEEDED, "timed out waiting for propagations")
+
+        return banks_pb2.SyncResponse()
+
 
     def MsgDelivery(self, request, context):
         """
@@ -85,19 +275,28 @@ class Branch(banks_pb2_grpc.RPCServicer):
         """
         if isinstance(request, banks_pb2.TransactionRequest):   #handle deposit or withdraw
             response = banks_pb2.TransactionResponse()
-            if (request.amount + self.balance < 0): #return fail on insufficient funds
+            sequence = 0
+            with self.lock_account(request):    #check funds, apply and journal atomically per account
+                if (request.id == self.id): #customer request: apply unless funds are insufficient
+                    sufficient = self.accounts.apply(request.account_id, request.amount)
+                else:   #propagation the origin already accepted: apply unconditionally so replicas converge
+                    self.accounts.adjust(request.account_id, request.amount)
+                    sufficient = True
+                if sufficient:
+                    sequence = self.journal(request)
+            self.commit(sequence)   #make the write durable before acking or propagating it
+
+            if not sufficient: #return fail on insufficient funds
                 response.result = "fail"
             else:
-                self.balance += request.amount  #update local balance
-
-                if (request.id == self.id): #propagate customer requests
+                if (request.id == self.id): #propagate customer requests outside the lock
                     self.propagate(request)
 
                 response.result = "success"
 
         elif isinstance(request, banks_pb2.BalanceRequest): #handle balance request
             response = banks_pb2.BalanceResponse()
-            response.balance = self.balance        
+            response.balance = self.accounts.balance(request.account_id) #lock-free read
         
         return response
 
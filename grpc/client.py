@@ -7,13 +7,13 @@ tfilewic
 Runs Customer events from input and writes output.
 """
 
-import json
+import functools
 import grpc
-from utilities import import_file, OUTPUT_FILE
+from utilities import close_channels, export_items, get_option, load_items, map_ordered, wait_for_branches, READY_TIMEOUT, METRICS_FILE, EVENT_BATCH
 from customer import Customer
-from time import sleep
+import metrics
 
-PROPAGATION_DELAY = 0.1
+CONCURRENCY = 1 #number of customers run at once (override with --concurrency=N)
 
 
 def filter_output(responses: dict) -> dict:
@@ -35,55 +35,71 @@ def filter_output(responses: dict) -> dict:
     return responses
 
 
-def process_customers() -> list[dict]:
+def run_customer(item: dict, batch: int = EVENT_BATCH) -> dict:
+    """
+    Executes one customer's events and waits for its writes to propagate.
+
+    Args:
+        item (dict): The customer entry from the input file.
+        batch (int): Events sent per Execute_Batch call.
+
+    Returns:
+        dict: The customer's filtered response dictionary.
+    """
+    id = item.get("id")
+    events = item.get("events")
+    customer = Customer(id, events, batch)
+    customer.createStub()
+    responses = customer.executeEvents()
+    customer.awaitPropagation() #barrier on branch propagation
+    return filter_output(responses)    #filter out "fail"
+
+
+def process_customers():
     """
     Executes all customer event sequences from the input file.
 
-    Reads customer entries from the input JSON, runs each customer's
-    defined events sequentially, filters failed transactions, prints
-    results for debugging, and collects all responses for export.
+    Streams customer entries from the input file, runs up to the configured
+    number of customers at once, and filters failed transactions. Responses
+    are produced in input order as customers finish, so at most the configured
+    number of customers are held in memory.
 
     Returns:
-        list[dict]: A list of processed customer response dictionaries.
+        iterator[dict]: The processed customer response dictionaries.
     """
-    #load input data from JSON file
-    data = import_file()
-    #initialize list to store results
-    output = []
-
-    #process all customer entries
-    for item in data:
-        if item.get("type") == "customer":
-            id = item.get("id")
-            events = item.get("events")
-            customer = Customer(id, events)
-            customer.createStub()
-            responses = customer.executeEvents()
-            responses = filter_output(responses)    #filter out "fail"
-            sleep(PROPAGATION_DELAY)    #wait for branch propagation
-            output.append(responses)
-
-    return output
-
-
-def export(data: list[dict]):
+    branches = [item["id"] for item in load_items() if item.get("type") == "branch"]
+    wait_for_branches(branches, READY_TIMEOUT)  #wait until every branch is serving
+    customers = (item for item in load_items() if item.get("type") == "customer")
+    concurrency = int(get_option("concurrency", CONCURRENCY))
+    run = functools.partial(run_customer, batch=int(get_option("batch", EVENT_BATCH)))
+
+    #process all customer entries, keeping results in input order
+    return map_ordered(run, customers, concurrency)
+
+
+def export(data):
     """
-    Writes the processed customer responses to the output JSON file.
+    Writes the processed customer responses to the output file as they are produced.
 
     Args:
-        data (list[dict]): List of customer response dictionaries to save.
+        data (iterable[dict]): Customer response dictionaries to save.
     """
-
-    with open(OUTPUT_FILE, 'w') as file:
-        json.dump(data, file, indent=2)
+    export_items(data)
 
 
 #run when script called directly
 if __name__ == "__main__":  
+    metrics.setup(get_option("metrics", METRICS_FILE), client=True)
     try:
         output = process_customers()
         export(output)
+    except grpc.FutureTimeoutError:
+        print("ERROR: Branch servers did not become ready.")
+        print("Ensure all branch servers are running before starting the client.")
+        exit(1)
     except grpc.RpcError as e:
         print(f"ERROR: {e.details()}")
         print("Ensure all branch servers are running before starting the client.")
-        exit(1)
\ No newline at end of file
+        exit(1)
+    finally:
+        close_channels()
\ No newline at end of file
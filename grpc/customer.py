@@ -9,7 +9,7 @@ Customer client logic and event execution.
 
 import banks_pb2
 import banks_pb2_grpc
-from utilities import create_channel, QUERY, WITHDRAW, DEPOSIT
+from utilities import batched, create_channel, QUERY, WITHDRAW, DEPOSIT, DEFAULT_ACCOUNT, EVENT_BATCH
 
 
 class Customer:
@@ -18,11 +18,13 @@ class Customer:
     Handles stub creation and sequential event execution based on the input file.
     """
     
-    def __init__(self, id, events):
+    def __init__(self, id, events, batch=EVENT_BATCH):
         # unique ID of the Customer
         self.id = id
         # events from the input
         self.events = events
+        # events sent per Execute_Batch call (1 sends each event as its own RPC)
+        self.batch = batch
         # a list of received messages used for debugging purpose
         self.recvMsg = list()
         # pointer for the stub
@@ -37,6 +39,13 @@ class Customer:
         self.stub =  banks_pb2_grpc.RPCStub(channel)
 
 
+    def awaitPropagation(self):
+        """
+        Blocks until the branch has finished propagating this customer's writes.
+        """
+        self.stub.Sync(banks_pb2.SyncRequest())
+
+
     def executeEvents(self) -> dict:
         """
         Executes all customer events in order.
@@ -44,27 +53,30 @@ class Customer:
         Returns:
             dict: A dictionary containing the received responses for this customer id.
         """
+        if (self.batch > 1):
+            return self.executeBatches()
 
         #process all events
         for event in self.events:
             interface = event["interface"]
+            account_id = event.get("account", DEFAULT_ACCOUNT)  #accounts are optional in the input
             entry = {"interface" : interface}
 
             #handle deposits
             if interface == DEPOSIT:
-                request = banks_pb2.TransactionRequest(id=self.id, amount=event["money"])
+                request = banks_pb2.TransactionRequest(id=self.id, amount=event["money"], account_id=account_id)
                 response = self.stub.Deposit(request)
                 entry["result"] = response.result
 
             #handle withdrawals
             elif interface == WITHDRAW:
-                request = banks_pb2.TransactionRequest(id=self.id, amount=-event["money"])
+                request = banks_pb2.TransactionRequest(id=self.id, amount=-event["money"], account_id=account_id)
                 response = self.stub.Withdraw(request)
                 entry["result"] = response.result
 
             #handle balance queries
             elif interface == QUERY:
-                request = banks_pb2.BalanceRequest(id=self.id)
+                request = banks_pb2.BalanceRequest(id=self.id, account_id=account_id)
                 response = self.stub.Query(request)
                 entry["balance"] = response.balance
 
@@ -76,4 +88,40 @@ class Customer:
             self.recvMsg.append(entry)
         
         #return responses
+        return {"id": self.id, "recv": self.recvMsg}
+
+
+    def executeBatches(self) -> dict:
+        """
+        Executes all customer events in order, sending up to batch events per Execute_Batch call.
+        The branch runs the operations one by one exactly as the per-event RPCs.
+
+        Returns:
+            dict: A dictionary containing the received responses for this customer id.
+        """
+        supported = (event for event in self.events if event["interface"] in {DEPOSIT, WITHDRAW, QUERY})  #ignore unsupported types
+
+        for events in batched(supported, self.batch):
+            operations = []
+            for event in events:
+                interface = event["interface"]
+                account_id = event.get("account", DEFAULT_ACCOUNT)  #accounts are optional in the input
+                if interface == DEPOSIT:
+                    operations.append(banks_pb2.Operation(deposit=banks_pb2.TransactionRequest(id=self.id, amount=event["money"], account_id=account_id)))
+                elif interface == WITHDRAW:
+                    operations.append(banks_pb2.Operation(withdraw=banks_pb2.TransactionRequest(id=self.id, amount=-event["money"], account_id=account_id)))
+                else:
+                    operations.append(banks_pb2.Operation(query=banks_pb2.BalanceRequest(id=self.id, account_id=account_id)))
+
+            response = self.stub.Execute_Batch(banks_pb2.OperationBatch(operations=operations))
+
+            #add responses to recvMsg in event order
+            for event, result in zip(events, response.results):
+                entry = {"interface" : event["interface"]}
+                if event["interface"] == QUERY:
+                    entry["balance"] = result.query.balance
+                else:
+                    entry["result"] = result.transaction.result
+                self.recvMsg.append(entry)
+
         return {"id": self.id, "recv": self.recvMsg}
\ No newline at end of file
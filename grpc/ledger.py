@@ -0,0 +1,140 @@
+"""
+ledger.py
+CSE 531 - gRPC Project
+tfilewic
+2026-10-18
+
+Indexed account store holding the balances of one branch.
+"""
+
+import struct
+from array import array
+from utilities import DEFAULT_ACCOUNT
+
+
+COUNT = struct.Struct("<q")  #header of an encoded ledger: number of accounts
+
+
+class Ledger:
+    """
+    Account balances of a branch, kept in one array('q') column.
+
+    Account ids map to slots in the column through a dict, so lookups and
+    updates are O(1) and each account costs a dict entry plus 8 bytes. The
+    default account holds the branch's starting balance; other accounts are
+    opened with a zero balance on their first deposit.
+    """
+    __slots__ = ("slots", "balances")
+
+    def __init__(self, balance=0):
+        # slot in the balance column keyed by account id
+        self.slots = {}
+        # balance of each account, indexed by slot
+        self.balances = array("q")
+
+        self.open(DEFAULT_ACCOUNT, balance)
+
+
+    def __len__(self) -> int:
+        return len(self.balances)
+
+    def __contains__(self, account) -> bool:
+        return account in self.slots
+
+
+    def open(self, account, balance=0) -> int:
+        """
+        Adds an account to the ledger.
+
+        Args:
+            account (int): The account ID.
+            balance (int): Starting balance of the account.
+
+        Returns:
+            int: The account's slot in the balance column.
+        """
+        slot = len(self.balances)
+        self.slots[account] = slot
+        self.balances.append(balance)
+        return slot
+
+
+    def balance(self, account) -> int:
+        """
+        Returns the balance of an account, or 0 if it has never been opened.
+
+        Args:
+            account (int): The account ID.
+
+        Returns:
+            int: The account balance.
+        """
+        slot = self.slots.get(account)
+        return 0 if slot is None else self.balances[slot]
+
+
+    def apply(self, account, amount) -> bool:
+        """
+        Applies a deposit or withdrawal unless it would overdraw the account.
+
+        Args:
+            account (int): The account ID.
+            amount (int): Amount to add; negative for withdrawals.
+
+        Returns:
+            bool: True if the amount was applied, False on insufficient funds.
+        """
+        if (amount + self.balance(account) < 0):
+            return False
+
+        self.adjust(account, amount)
+        return True
+
+
+    def adjust(self, account, amount):
+        """
+        Adds an amount to an account unconditionally, opening the account if needed.
+
+        Args:
+            account (int): The account ID.
+            amount (int): Amount to add; negative for withdrawals.
+        """
+        slot = self.slots.get(account)
+        if slot is None:
+            slot = self.open(account)
+        self.balances[slot] += amount
+
+
+    def dump(self) -> bytes:
+        """
+        Encodes the ledger as the account count followed by the account id and balance columns.
+
+        Returns:
+            bytes: The encoded ledger.
+        """
+        return COUNT.pack(len(self.balances)) + array("q", self.slots).tobytes() + self.balances.tobytes()
+
+
+    @classmethod
+    def load(cls, data, offset=0):
+        """
+        Decodes a ledger written by dump().
+
+        Args:
+            data (bytes): Buffer holding the encoded ledger.
+            offset (int): Position of the ledger in the buffer.
+
+        Returns:
+            tuple[Ledger, int]: The ledger and the position just after it.
+        """
+        (count,) = COUNT.unpack_from(data, offset)
+        offset += COUNT.size
+        accounts = array("q")
+        accounts.frombytes(data[offset:offset + 8 * count])
+        offset += 8 * count
+
+        ledger = cls.__new__(cls)
+        ledger.balances = array("q")
+        ledger.balances.frombytes(data[offset:offset + 8 * count])
+        ledger.slots = {account: slot for slot, account in enumerate(accounts)}
+        return ledger, offset + 8 * count
@@ -7,30 +7,61 @@ tfilewic
 Starts Branch servers from input.json and registers services.
 """
 
+import asyncio
 import grpc
+import multiprocessing
+import os
+import signal
+import threading
 from concurrent import futures
-from utilities import get_port, import_file
+from multiprocessing import connection
+from utilities import close_channels, get_option, get_port, load_items, wait_for_branches, READY_TIMEOUT, SERVER_OPTIONS, METRICS_FILE, PROPAGATION_BATCHING, PROPAGATION_STREAMING
 from branch import Branch
+from aio_branch import AsyncBranch
+from wal import WriteAheadLog
+import metrics
 import banks_pb2_grpc
 
 servers = []    #list of running gRPC servers
+running = []    #branches served by the thread runtime
+MAX_WORKERS = 64    #server threads per branch; each customer call blocked on propagation holds one
+MAX_STREAMS = MAX_WORKERS // 4 #most peers a thread-runtime branch streams to; each inbound Replicate stream holds a server thread, so larger clusters batch instead
+PROCESSES = 0   #branch processes to launch (override with --processes=N; 0 serves every branch in this process)
+SHUTDOWN_GRACE = 1.0    #seconds in-flight calls may take to finish on shutdown
+RUNTIME = "thread"  #branch server runtime: "thread" or "aio" (override with --runtime=aio)
+DATA_DIR = None #directory for the branch WALs and snapshots of the thread runtime (override with --data-dir=PATH; None keeps state in memory)
 
 
-def start_branches(data : list) -> None:
+def start_branches(data : list, interceptors : list = (), ids : list = None, data_dir : str = None) -> None:
     """
     Starts all branch servers defined in the input data.
     Creates a Branch instance for each branch entry, registers it with a gRPC server,
     binds the server to its port, and starts it.
+
+    Args:
+        data (list): Parsed input containing branch definitions.
+        interceptors (list): Optional gRPC server interceptors installed on every branch server.
+        ids (list): IDs of the branches to start here, or None to start all of them.
+        data_dir (str): Directory for the branch WALs and snapshots, or None to keep state in memory.
     """
     branches = [item["id"] for item in data if item.get("type") == "branch"]    #collect all branch ids
+    if metrics.registry.enabled:
+        interceptors = [*interceptors, metrics.MetricsInterceptor()]
+    streamed = PROPAGATION_STREAMING and (len(branches) - 1 <= MAX_STREAMS)   #stream only while the inbound streams leave server threads free
+    batched = PROPAGATION_BATCHING or PROPAGATION_STREAMING    #coalesce over Propagate_Batch when streaming is off or too wide
 
     #process all branch entries
     for item in data:
-        if item.get("type") == "branch":
+        if item.get("type") == "branch" and (ids is None or item.get("id") in ids):
             id = item.get("id")
             balance = item.get("balance")
-            branch = Branch(id, balance, branches)  #create branch
-            server = grpc.server(futures.ThreadPoolExecutor())  #create server
+            wal = WriteAheadLog(os.path.join(data_dir, f"branch-{id}")) if data_dir else None
+            branch = Branch(id, balance, branches, batched=batched, streamed=streamed, wal=wal)  #create branch
+            if metrics.registry.enabled:
+                metrics.instrument(branch)
+            branch.restore()    #recover the state logged before a restart
+            running.append(branch)
+            server = grpc.server(futures.ThreadPoolExecutor(max_workers=MAX_WORKERS), interceptors=interceptors, options=SERVER_OPTIONS)  #create server
             banks_pb2_grpc.add_RPCServicer_to_server(branch, server)    #register branch service
             port = get_port(id) #generate port for this branch
             server.add_insecure_port(f"[::]:{port}") #bind to port
@@ -38,15 +69,202 @@ def start_branches(data : list) -> None:
             servers.append(server)  #add to servers list
 
 
+def stop_branches(grace: float = None) -> None:
+    """
+    Stops every branch server running in this process.
+
+    Args:
+        grace (float): Seconds in-flight calls may take to finish, or None to cancel them at once.
+    """
+    stopped = [server.stop(grace) for server in servers]
+    for event in stopped:
+        event.wait()
+    servers.clear()
+    for branch in running:  #end background work and close the WALs once no handler can append
+        branch.stop()
+    running.clear()
+    close_channels()    #release the peer connections
+
+
+async def start_aio_branches(data : list, interceptors : list = (), ids : list = None) -> None:
+    """
+    Starts the branch servers defined in the input data on the running event loop.
+    Creates an AsyncBranch for each branch entry and serves it with a grpc.aio server,
+    so handlers waiting on peers or dependencies do not hold a thread.
+
+    Args:
+        data (list): Parsed input containing branch definitions.
+        interceptors (list): Optional grpc.aio server interceptors installed on every branch server.
+        ids (list): IDs of the branches to start here, or None to start all of them.
+    """
+    branches = [item["id"] for item in data if item.get("type") == "branch"]    #collect all branch ids
+    if metrics.registry.enabled:
+        interceptors = [*interceptors, metrics.AsyncMetricsInterceptor()]
+
+    #process all branch entries
+    for item in data:
+        if item.get("type") == "branch" and (ids is None or item.get("id") in ids):
+            id = item.get("id")
+            balance = item.get("balance")
+            branch = AsyncBranch(id, balance, branches)  #create branch
+            if metrics.registry.enabled:
+                metrics.instrument(branch)
+            server = grpc.aio.server(interceptors=interceptors, options=SERVER_OPTIONS)  #create server
+            banks_pb2_grpc.add_RPCServicer_to_server(branch, server)    #register branch service
+            port = get_port(id) #generate port for this branch
+            server.add_insecure_port(f"[::]:{port}") #bind to port
+            await server.start()  #start server
+            servers.append(server)  #add to servers list
+
+
+async def serve_aio(data : list, ids : list = None, ready = None, stop = None) -> None:
+    """
+    Serves branches with grpc.aio until the servers terminate or stop is set, then stops them.
+
+    Args:
+        data (list): Parsed input containing branch definitions.
+        ids (list): IDs of the branches to serve, or None to serve all of them.
+        ready: Optional event set once the servers are accepting calls.
+        stop (threading.Event): Optional event that requests a graceful shutdown.
+    """
+    await start_aio_branches(data, ids=ids)
+    if ready is not None:
+        ready.set()
+
+    try:
+        if stop is not None:
+            await asyncio.get_running_loop().run_in_executor(None, stop.wait)
+        else:
+            await asyncio.gather(*(server.wait_for_termination() for server in servers))
+    finally:
+        await asyncio.gather(*(server.stop(SHUTDOWN_GRACE) for server in servers))
+        servers.clear()
+
+
+def serve_group(data : list, ids : list, ready, runtime : str = RUNTIME, data_dir : str = DATA_DIR, metrics_file : str = METRICS_FILE) -> None:
+    """
+    Entry point of a branch process: serves a group of branches until terminated or orphaned.
+
+    Args:
+        data (list): Parsed input containing branch definitions.
+        ids (list): IDs of the branches this process serves.
+        ready (multiprocessing.Event): Set once the group's servers are accepting calls.
+        runtime (str): "thread" or "aio" branch servers.
+        data_dir (str): Directory for the branch WALs and snapshots, or None to keep state in memory.
+        metrics_file (str): JSON file for metrics, suffixed with the first branch id of each process, or None to disable metrics.
+    """
+    if metrics_file is not None:    #one metrics file per process
+        root, extension = os.path.splitext(metrics_file)
+        metrics.setup(f"{root}-{ids[0]}{extension}")
+
+    stop = threading.Event()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)    #the launcher coordinates shutdown
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    launcher = multiprocessing.parent_process()
+    threading.Thread(target=lambda: launcher.join() or stop.set(), daemon=True).start()   #stop if the launcher dies
+
+    if (runtime == "aio"):
+        asyncio.run(serve_aio(data, ids, ready, stop))
+        return
+
+    start_branches(data, ids=ids, data_dir=data_dir)
+    ready.set() #signal readiness to the launcher
+    stop.wait()
+    stop_branches(SHUTDOWN_GRACE)
+
+
+def launch_branches(data : list, processes : int, runtime : str = RUNTIME, data_dir : str = DATA_DIR, metrics_file : str = METRICS_FILE) -> int:
+    """
+    Runs the branches in separate OS processes and supervises them until interrupted.
+
+    Branches are spread round-robin over the processes. The launcher waits for
+    every process to report ready and every branch port to accept connections,
+    then health-checks the processes and shuts all of them down gracefully on
+    interrupt or when any process exits.
+
+    Args:
+        data (list): Parsed input containing branch definitions.
+        processes (int): Number of branch processes to run.
+        runtime (str): "thread" or "aio" branch servers.
+        data_dir (str): Directory for the branch WALs and snapshots, or None to keep state in memory.
+        metrics_file (str): JSON file for metrics, suffixed with the first branch id of each process, or None to disable metrics.
+
+    Returns:
+        int: Exit status; 0 after an interrupt, 1 if a branch process failed.
+    """
+    branches = [item["id"] for item in data if item.get("type") == "branch"]    #collect all branch ids
+    groups = [branches[i::processes] for i in range(processes) if branches[i::processes]]
+
+    signal.signal(signal.SIGTERM, signal.default_int_handler)   #treat SIGTERM like Ctrl-C
+    context = multiprocessing.get_context("spawn")  #start clean interpreters without inherited gRPC state
+    workers = []
+    for group in groups:
+        ready = context.Event()
+        process = context.Process(target=serve_group, args=(data, group, ready, runtime, data_dir, metrics_file), name=f"branches-{group[0]}")
+        process.start()
+        workers.append((process, ready, group))
+
+    status = 0
+    try:
+        for process, ready, group in workers:   #wait for readiness
+            if not ready.wait(READY_TIMEOUT):
+                raise RuntimeError(f"branches {group} did not start")
+        wait_for_branches(branches, READY_TIMEOUT)  #confirm every port accepts connections
+        print("Servers started")
+
+        #health check: block until a branch process exits
+        connection.wait([process.sentinel for process, _, _ in workers])
+        for process, _, group in workers:
+            if not process.is_alive():
+                print(f"Error: process serving branches {group} exited with code {process.exitcode}.")
+        status = 1
+    except RuntimeError as e:
+        print(f"Error: {e}.")
+        status = 1
+    except grpc.FutureTimeoutError:
+        print("Error: branch ports did not become ready.")
+        status = 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process, _, _ in workers:   #request graceful shutdown
+            if process.is_alive():
+                process.terminate()
+        for process, _, _ in workers:
+            process.join(SHUTDOWN_GRACE + READY_TIMEOUT)
+            if process.is_alive():
+                process.kill()
+
+    return status
+
+
 #run when script called directly
 if __name__ == "__main__":
-    data = import_file()    #load input
-    start_branches(data)    #initialize and start all branch servers
+    data = [item for item in load_items() if item.get("type") == "branch"] #load branches; customer entries are skipped as they stream by
+    processes = int(get_option("processes", PROCESSES))
+    runtime = get_option("runtime", RUNTIME)
+    data_dir = get_option("data-dir", DATA_DIR)
+    metrics_file = get_option("metrics", METRICS_FILE)
+    if (runtime == "aio" and data_dir is not None):    #aio branches keep their state in memory only
+        print("Error: --data-dir is only supported by the thread runtime.")
+        exit(2)
+    if (processes > 0): #run branches in their own processes
+        exit(launch_branches(data, processes, runtime, data_dir, metrics_file))
+
+    metrics.setup(metrics_file)
+
+    if (runtime == "aio"):  #serve every branch on one event loop until interrupted
+        try:
+            asyncio.run(serve_aio(data))
+        except KeyboardInterrupt:
+            pass
+        exit()
+
+    start_branches(data, data_dir=data_dir)    #initialize and start all branch servers
     
     #keep servers running until interrupted
     try:
         for server in servers:
             server.wait_for_termination()
     except KeyboardInterrupt:
-        for server in servers:
-            server.stop(0)
+        stop_branches(0)
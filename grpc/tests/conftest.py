@@ -0,0 +1,13 @@
+"""
+conftest.py
+CSE 531 - gRPC Project
+tfilewic
+2026-10-18
+
+Makes the branch modules importable from the tests.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))    #modules live one level up, not in a package
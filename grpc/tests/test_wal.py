@@ -0,0 +1,105 @@
+"""
+test_wal.py
+CSE 531 - gRPC Project
+tfilewic
+2026-10-18
+
+Tests for the write-ahead log and snapshots.
+"""
+
+import os
+from wal import WriteAheadLog
+
+
+def write(directory, records) -> WriteAheadLog:
+    """
+    Opens a log in a directory, appends and syncs the records, and closes it.
+    """
+    log = WriteAheadLog(str(directory))
+    log.open()
+    for record in records:
+        log.sync(log.append(record))
+    log.close()
+    return log
+
+
+def recover(directory) -> tuple:
+    """
+    Recovers a log from a directory as a restarting branch does.
+
+    Returns:
+        tuple[bytes, list[bytes]]: The newest snapshot (or None) and the replayed records.
+    """
+    log = WriteAheadLog(str(directory))
+    snapshot = log.load_snapshot()
+    return snapshot, list(log.replay())
+
+
+def segments(directory) -> list:
+    return sorted(name for name in os.listdir(directory) if name.endswith(".log"))
+
+
+def test_replay_returns_records_in_order(tmp_path):
+    records = [b"first", b"", b"third" * 100]
+    write(tmp_path, records)
+    assert recover(tmp_path) == (None, records)
+
+
+def test_replay_stops_at_torn_tail(tmp_path):
+    write(tmp_path, [b"one", b"two", b"three"])
+    (segment,) = segments(tmp_path)
+    path = tmp_path / segment
+    size = path.stat().st_size
+
+    os.truncate(path, size - 2) #payload cut short
+    assert recover(tmp_path) == (None, [b"one", b"two"])
+
+    os.truncate(path, size - len(b"three") - 3) #frame header cut short
+    assert recover(tmp_path) == (None, [b"one", b"two"])
+
+
+def test_replay_stops_at_corrupt_record(tmp_path):
+    write(tmp_path, [b"one", b"two", b"three"])
+    (segment,) = segments(tmp_path)
+    path = tmp_path / segment
+    data = bytearray(path.read_bytes())
+    data[-len(b"two") - len(b"three") - 8] ^= 0xFF  #flip a byte of "two"
+    path.write_bytes(bytes(data))
+    assert recover(tmp_path) == (None, [b"one"])
+
+
+def test_snapshot_truncates_replay(tmp_path):
+    log = WriteAheadLog(str(tmp_path))
+    log.open()
+    for record in (b"a", b"b"):
+        log.sync(log.append(record))
+    segment = log.rotate()
+    assert log.rotate() is None #one snapshot at a time
+    log.write_snapshot(segment, b"state after b")
+    log.sync(log.append(b"c"))
+    log.close()
+
+    assert segments(tmp_path) == [f"wal-{segment}.log"]
+    assert recover(tmp_path) == (b"state after b", [b"c"])
+
+
+def test_reopen_appends_to_new_segment(tmp_path):
+    write(tmp_path, [b"a"])
+    log = WriteAheadLog(str(tmp_path))
+    log.load_snapshot()
+    assert list(log.replay()) == [b"a"]
+    log.open()
+    log.sync(log.append(b"b"))
+    log.close()
+
+    assert len(segments(tmp_path)) == 2
+    assert recover(tmp_path) == (None, [b"a", b"b"])
+
+
+def test_due_counts_replayed_records(tmp_path):
+    write(tmp_path, [b"a", b"b", b"c"])
+    log = WriteAheadLog(str(tmp_path), interval=3)
+    log.load_snapshot()
+    assert not log.due()
+    list(log.replay())
+    assert log.due()
@@ -0,0 +1,237 @@
+"""
+aio_branch.py
+CSE 531 - Logical Clock Project
+tfilewic
+2026-10-18
+
+Asynchronous (grpc.aio) branch server logic and RPC handlers.
+"""
+
+import asyncio
+import functools
+import grpc
+import banks_pb2
+import banks_pb2_grpc
+from branch import Branch
+from event_log import EventLog
+from ledger import Ledger
+from utilities import create_aio_channel, gather_acks, Tickets, PROPAGATION_ACKS, SYNC_TIMEOUT, LOG_PAGE
+
+
+class AsyncBranch(banks_pb2_grpc.RPCServicer):
+    """
+    Represents a branch server running on a grpc.aio event loop.
+    Handles local balance updates and propagates changes to peer branches.
+
+    Handlers waiting on peers suspend instead of holding a server thread. All
+    handlers run on one event loop, so clock ticks and log appends between
+    awaits are atomic without a lock. Propagations use the unary RPCs.
+    """
+    def __init__(self, id, balance, branches, acks=PROPAGATION_ACKS):
+        # unique ID of the Branch
+        self.id = id
+        # replica of the Branch's account balances
+        self.accounts = Ledger(balance)
+        # the list of process IDs of the branches
+        self.branches = branches
+        # the list of Client stubs to communicate with the branches
+        self.stubList = {}
+        # add all branch stubs to stub list
+        for branch in branches:
+            if branch != self.id:
+                channel = create_aio_channel(branch)
+                self.stubList[branch] = banks_pb2_grpc.RPCStub(channel)
+        # columnar log of received and sent events
+        self.log = EventLog()
+        # logical clock
+        self.clock = 0
+        # number of peer acks a propagated write waits for (None for all peers)
+        self.acks = acks
+        # tickets of the propagation calls in send order; its length is the number still waiting on a peer reply
+        self.calls = Tickets()
+        # set and replaced whenever the oldest in-flight propagation call completes, waking Sync waiters
+        self.propagated = asyncio.Event()
+
+
+    #log entries are built exactly as in the threaded branch
+    log_receipt = Branch.log_receipt
+    log_send = Branch.log_send
+    #Get_Log pages and filters the log exactly as in the threaded branch
+    events = Branch.events
+
+
+    def track(self, calls):
+        """
+        Issues each propagation call a ticket, held until its peer replies.
+
+        Args:
+            calls (list): Tasks wrapping the peer calls.
+        """
+        for call in calls:
+            call.add_done_callback(functools.partial(self.untrack, self.calls.issue()))
+
+    def untrack(self, ticket, call):
+        """
+        Done callback that marks a propagation call as complete and releases the Sync
+        waiters whose earlier calls have all completed.
+
+        Args:
+            ticket (int): The call's ticket.
+            call (asyncio.Task): The completed task.
+        """
+        if not call.cancelled():
+            call.exception()    #failures are reported through gather_acks
+        if self.calls.finish(ticket):
+            self.propagated.set()
+            self.propagated = asyncio.Event()
+
+    async def propagate(self, request):
+        """
+        Propagates a deposit or withdrawal request to all other branches.
+
+        Sends to every peer at once and waits for the configured number of acks.
+
+        Args:
+            request (banks_pb2.TransactionRequest): The transaction to propagate.
+        """
+        calls = []
+        for branch_id, branchStub in self.stubList.items():
+            interface = "propagate_deposit" if request.amount >= 0 else "propagate_withdraw"
+
+            self.clock = self.clock + 1 #Lamport send
+            out = banks_pb2.TransactionRequest( #build request
+                id=request.id,
+                amount=request.amount,
+                request_id=request.request_id,
+                clock=self.clock,
+                account_id=request.account_id
+            )
+            self.log_send(out, branch_id, interface)    #log send
+
+            if (interface == "propagate_deposit"):
+                calls.append(asyncio.ensure_future(branchStub.Propagate_Deposit(out)))
+            else:
+                calls.append(asyncio.ensure_future(branchStub.Propagate_Withdraw(out)))
+
+        self.track(calls)   #count calls for Sync barriers
+        await gather_acks(calls, self.acks) #wait for peer acks
+
+
+    """
+    Since the assignment spec requires a central handler, all RPC interface transaction methods delegate to MsgDelivery.
+    """
+    async def Deposit(self, request, context):
+        return await self.MsgDelivery(request, context)
+
+    async def Withdraw(self, request, context):
+        return await self.MsgDelivery(request, context)
+
+    async def Propagate_Deposit(self, request, context):
+        return await self.MsgDelivery(request, context)
+
+    async def Propagate_Withdraw(self, request, context):
+        return await self.MsgDelivery(request, context)
+
+    async def Replicate(self, request_iterator, context):
+        """
+        Applies a peer's replication stream in order, delegating each propagation to MsgDelivery
+        and acking cumulatively.
+        """
+        async for message in request_iterator:
+            await self.MsgDelivery(message.request, context)
+            yield banks_pb2.ReplicationAck(sequence=message.sequence)
+
+    async def Propagate_Batch(self, request, context):
+        """
+        Applies a batch of propagations in order, delegating each one to MsgDelivery.
+        """
+        response = banks_pb2.PropagationBatchResponse()
+        for entry in request.requests:
+            response.responses.append(await self.MsgDelivery(entry, context))
+        return response
+
+    async def Execute_Batch(self, request, context):
+        """
+        Executes a customer's operations in order, delegating each one to MsgDelivery,
+        so every operation is received, clocked and logged as its own request.
+        """
+        response = banks_pb2.OperationBatchResponse()
+        for operation in request.operations:
+            response.responses.append(await self.MsgDelivery(getattr(operation, operation.WhichOneof("operation")), context))
+        return response
+
+    async def settle(self, sent):
+        """
+        Suspends until every propagation call up to a ticket has completed.
+
+        Args:
+            sent (int): Number of calls issued when the barrier started.
+        """
+        while not self.calls.covers(sent):
+            await self.propagated.wait()
+
+    async def Sync(self, request, context):
+        """
+        Barrier that returns once every propagation this branch sent before the call has been
+        acknowledged. Propagations sent after it do not hold it up, so it cannot starve under load.
+        """
+        try:
+            await asyncio.wait_for(self.settle(self.calls.issued), SYNC_TIMEOUT)
+        except asyncio.TimeoutError:
+            await context.abort(grpc.StatusCode.DEADLINE_EXCEEDED, "timed out waiting for propagations")
+
+        return banks_pb2.SyncResponse()
+
+    async def Get_Log(self, request, context):
+        """
+        Streams this branch's logged events from the request's offset, filtered to its
+        logical clock range and capped at its limit.
+        """
+        for event in self.events(request):
+            yield event
+
+
+    def read_log(self, offset) -> list:
+        """
+        Copies one page of log events starting at an index.
+
+        Args:
+            offset (int): Index of the first event.
+
+        Returns:
+            list[tuple]: Up to LOG_PAGE (request id, clock, kind, peer) events.
+        """
+        return self.log.page(offset, LOG_PAGE)
+
+
+    async def MsgDelivery(self, request, context):
+        """
+        Central handler for all incoming transaction gRPC requests.
+
+        Determines request type and processes accordingly.
+
+        Args:
+            request: The gRPC TransactionRequest message.
+            context: The grpc.aio context object for the call.
+
+        Returns:
+            banks_pb2.TransactionResponse:
+            The response message.
+        """
+        response = banks_pb2.TransactionResponse()
+
+        if isinstance(request, banks_pb2.TransactionRequest):   #handle deposit or withdraw
+            self.clock = max(self.clock, request.clock) + 1 #Lamport recieve
+
+            self.log_receipt(request)   #log receipt
+
+            if (request.id == self.id): #customer request: apply unless funds are insufficient
+                sufficient = self.accounts.apply(request.account_id, request.amount)
+            else:   #propagation the origin already accepted: apply unconditionally so replicas converge
+                self.accounts.adjust(request.account_id, request.amount)
+                sufficient = True
+
+            if sufficient and (request.id == self.id): #propagate customer requests
+                await self.propagate(request)
+
+        return response
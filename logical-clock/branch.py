@@ -7,9 +7,21 @@ tfilewic
 Branch server logic and RPC handlers.
 """
 
+import functools
+import grpc
+import struct
+import threading
 import banks_pb2
 import banks_pb2_grpc
-from utilities import create_channel
+from event_log import EventLog, render, RECV_DEPOSIT, RECV_WITHDRAW, RECV_PROPAGATE_DEPOSIT, RECV_PROPAGATE_WITHDRAW, SENT_PROPAGATE_DEPOSIT, SENT_PROPAGATE_WITHDRAW
+from ledger import Ledger
+from outbox import PeerOutbox, ReplicationStream
+from utilities import create_channel, await_acks, Tickets, PROPAGATION_ACKS, PROPAGATION_BATCHING, PROPAGATION_STREAMING, SYNC_TIMEOUT, LOG_PAGE
+
+RECEIVED = b"R" #WAL record of a received transaction
+SENT = b"S" #WAL record of a propagation sent to a peer
+TARGET = struct.Struct("<i")    #peer branch id following the record type (0 for received transactions)
+CLOCK = struct.Struct("<q") #snapshot field between the ledger and the event log: logical clock
 
 
 class Branch(banks_pb2_grpc.RPCServicer):
@@ -17,11 +29,11 @@ class Branch(banks_pb2_grpc.RPCServicer):
     Represents a branch server.
     Handles local balance updates and propagates changes to peer branches.
     """
-    def __init__(self, id, balance, branches):
+    def __init__(self, id, balance, branches, acks=PROPAGATION_ACKS, batched=PROPAGATION_BATCHING, streamed=PROPAGATION_STREAMING, wal=None):
         # unique ID of the Branch
         self.id = id
-        # replica of the Branch's balance
-        self.balance = balance
+        # replica of the Branch's account balances
+        self.accounts = Ledger(balance)
         # the list of process IDs of the branches
         self.branches = branches
         # the list of Client stubs to communicate with the branches
@@ -31,10 +43,27 @@ class Branch(banks_pb2_grpc.RPCServicer):
             if branch != self.id:
                 channel =  create_channel(branch)
                 self.stubList[branch] = banks_pb2_grpc.RPCStub(channel)
-        # a list of received messages
-        self.log = []
+        # per-peer replication streams or batching queues keyed by branch id (empty for unary calls)
+        self.outboxes = {}
+        for branch, stub in self.stubList.items():
+            if streamed:
+                self.outboxes[branch] = ReplicationStream(stub)
+            elif batched:
+                self.outboxes[branch] = PeerOutbox(stub)
+        # columnar log of received and sent events
+        self.log = EventLog()
         # logical clock
         self.clock = 0
+        # number of peer acks a propagated write waits for (None for all peers)
+        self.acks = acks
+        # guards the balance, logical clock and log against concurrent handlers
+        self.lock = threading.Lock()
+        # tickets of the propagation calls in send order; its length is the number still waiting on a peer reply
+        self.calls = Tickets()
+        # notified when the oldest in-flight propagation call completes
+        self.propagated = threading.Condition()
+        # write-ahead log of received and sent transactions (None keeps the state in memory only)
+        self.wal = wal
 
 
     def log_receipt(self, request):
@@ -45,25 +74,11 @@ class Branch(banks_pb2_grpc.RPCServicer):
             request (banks_pb2.TransactionRequest): The incoming transaction to log.
         """
         if (request.id == self.id):
-            interface = ""
-            comment = f"event_recv from customer {request.id}"
-        else:
-            interface = "propagate_"
-            comment = f"event_recv from branch {request.id}"
-
-        if (request.amount < 0):
-            interface += "withdraw"
+            kind = RECV_WITHDRAW if request.amount < 0 else RECV_DEPOSIT
         else:
-            interface += "deposit"
-
-        event = {
-            "customer-request-id": request.request_id, 
-            "logical_clock": self.clock, 
-            "interface": interface, 
-            "comment": comment
-        }
+            kind = RECV_PROPAGATE_WITHDRAW if request.amount < 0 else RECV_PROPAGATE_DEPOSIT
 
-        self.log.append(event)
+        self.log.append(request.request_id, self.clock, kind, request.id)
 
 
     def log_send(self, request, target_id, interface):
@@ -75,38 +90,206 @@ class Branch(banks_pb2_grpc.RPCServicer):
             target_branch_id (int): The branch ID this event is being sent to.
             interface (str): The interface name ('propagate_deposit' or 'propagate_withdraw').
         """
-        event = {
-            "customer-request-id": request.request_id,
-            "logical_clock": self.clock,
-            "interface": interface,
-            "comment": f"event_sent to branch {target_id}"
-        }
-        self.log.append(event)
+        kind = SENT_PROPAGATE_WITHDRAW if interface == "propagate_withdraw" else SENT_PROPAGATE_DEPOSIT
+        self.log.append(request.request_id, self.clock, kind, target_id)
+
+
+    def receive(self, request) -> bool:
+        """
+        Ticks the clock for a received transaction, logs it and applies it to the balance.
+        Customer requests are checked for sufficient funds; propagations the origin already
+        accepted are applied unconditionally so replicas converge.
+        Must be called with the lock held; also replays received records from the WAL.
+
+        Args:
+            request (banks_pb2.TransactionRequest): The received transaction.
+
+        Returns:
+            bool: True if the transaction was applied, False on insufficient funds.
+        """
+        self.clock = max(self.clock, request.clock) + 1 #Lamport recieve
+
+        self.log_receipt(request)   #log receipt
+
+        if (request.id == self.id): #customer request
+            return self.accounts.apply(request.account_id, request.amount)
+
+        self.accounts.adjust(request.account_id, request.amount)    #propagation
+        return True
+
+
+    def stamp(self, request, target_id) -> banks_pb2.TransactionRequest:
+        """
+        Ticks the clock for a propagation to a peer and logs the send.
+        Must be called with the lock held; also replays sent records from the WAL.
+
+        Args:
+            request (banks_pb2.TransactionRequest): The transaction being propagated.
+            target_id (int): The branch ID the propagation is sent to.
+
+        Returns:
+            banks_pb2.TransactionRequest: The outgoing request carrying the send time.
+        """
+        interface = "propagate_deposit" if request.amount >= 0 else "propagate_withdraw"
+
+        self.clock = self.clock + 1 #Lamport send
+        out = banks_pb2.TransactionRequest( #build request
+            id=request.id, 
+            amount=request.amount, 
+            request_id=request.request_id, 
+            clock=self.clock,
+            account_id=request.account_id
+        )
+        self.log_send(out, target_id, interface)    #log send
+        return out
+
+
+    def restore(self):
+        """
+        Rebuilds the balances, clock and log from the latest snapshot and the WAL tail,
+        then opens the WAL for appends.
+        """
+        if self.wal is None:
+            return
+
+        snapshot = self.wal.load_snapshot()
+        if snapshot is not None:
+            self.load_state(snapshot)
+        for record in self.wal.replay():    #rerun the events logged after the snapshot
+            (target_id,) = TARGET.unpack_from(record, 1)
+            request = banks_pb2.TransactionRequest.FromString(record[1 + TARGET.size:])
+            if (record[:1] == RECEIVED):
+                self.receive(request)
+            else:
+                self.stamp(request, target_id)
+        self.wal.open()
+
+    def journal(self, kind, request, target_id=0) -> int:
+        """
+        Appends a received or sent transaction to the WAL. Must be called with the lock held.
+
+        Args:
+            kind (bytes): RECEIVED or SENT.
+            request (banks_pb2.TransactionRequest): The received or outgoing request.
+            target_id (int): The branch ID a sent request goes to.
+
+        Returns:
+            int: The record's WAL sequence number, or 0 without a WAL.
+        """
+        if self.wal is None:
+            return 0
+        return self.wal.append(kind + TARGET.pack(target_id) + request.SerializeToString())
+
+    def commit(self, sequence):
+        """
+        Waits until a journaled event is on disk, then takes a snapshot if one is due.
+
+        Args:
+            sequence (int): WAL sequence number returned by journal().
+        """
+        if not sequence:
+            return
+        self.wal.sync(sequence) #group commit with concurrent handlers
+        if self.wal.due():
+            self.checkpoint()
+
+    def checkpoint(self):
+        """
+        Snapshots the balances, clock and log and truncates the WAL behind them.
+        """
+        with self.lock: #capture the state and rotate the log at the same point
+            segment = self.wal.rotate()
+            if segment is None:
+                return
+            state = self.dump_state()
+        self.wal.write_snapshot(segment, state)
+
+
+    def stop(self):
+        """
+        Stops the per-peer outboxes and closes the WAL.
+        Called once the server has stopped and before the peer channels close.
+        """
+        for outbox in self.outboxes.values():
+            outbox.close()
+        if self.wal is not None:
+            self.wal.close()
+
+    def dump_state(self) -> bytes:
+        """
+        Encodes the ledger, clock and log for a snapshot. Must be called with the lock held.
+
+        Returns:
+            bytes: The encoded state.
+        """
+        return self.accounts.dump() + CLOCK.pack(self.clock) + self.log.dump()
+
+    def load_state(self, data):
+        """
+        Restores the ledger, clock and log from a snapshot written by dump_state().
+
+        Args:
+            data (bytes): The encoded state.
+        """
+        self.accounts, offset = Ledger.load(data)
+        (self.clock,) = CLOCK.unpack_from(data, offset)
+        self.log, _ = EventLog.load(data, offset + CLOCK.size)
+
+
+    def track(self, calls):
+        """
+        Issues each propagation call a ticket, held until its peer replies.
+
+        Args:
+            calls (list): Call futures returned by the peer stubs.
+        """
+        with self.propagated:
+            tickets = [self.calls.issue() for _ in calls]
+        for call, ticket in zip(calls, tickets):
+            call.add_done_callback(functools.partial(self.untrack, ticket))
 
+    def untrack(self, ticket, call):
+        """
+        Done callback that marks a propagation call as complete and releases the Sync
+        waiters whose earlier calls have all completed.
+
+        Args:
+            ticket (int): The call's ticket.
+            call: The completed call future.
+        """
+        with self.propagated:
+            if self.calls.finish(ticket):
+                self.propagated.notify_all()
 
     def propagate(self, request):
         """
         Propagates a deposit or withdrawal request to all other branches.
 
+        Sends to every peer at once and waits for the configured number of acks.
+
         Args:
             request (banks_pb2.TransactionRequest): The transaction to propagate.
         """
-        for branch_id, branchStub in self.stubList:
-            self.clock = self.clock + 1 #Lamport send
-            out = banks_pb2.TransactionRequest( #build request
-                id=request.id, 
-                amount=request.amount, 
-                request_id=request.request_id, 
-                clock=self.clock
-            )
-
-            interface = "propagate_deposit" if request.amount >= 0 else "propagate_withdraw"
-            self.log_send(out, branch_id, interface)    #log send
-
-            if (interface == "propagate_deposit"):
-                branchStub.Propagate_Deposit(out)
+        sends = []
+        sequence = 0
+        with self.lock: #tick, log and journal the sends atomically
+            for branch_id in self.stubList:
+                out = self.stamp(request, branch_id)
+                sequence = self.journal(SENT, out, branch_id)
+                sends.append((branch_id, out))
+        self.commit(sequence)   #sends are durable before they leave
+
+        calls = []
+        for branch_id, out in sends:
+            if self.outboxes:   #send through the peer's stream or batch queue
+                calls.append(self.outboxes[branch_id].send(out))
+            elif (out.amount >= 0):
+                calls.append(self.stubList[branch_id].Propagate_Deposit.future(out))
             else:
-                branchStub.Propagate_Withdraw(out)
+                calls.append(self.stubList[branch_id].Propagate_Withdraw.future(out))
+
+        self.track(calls)   #count calls for Sync barriers
+        await_acks(calls, self.acks)    #wait for peer acks
 
 
     """
@@ -123,21 +306,100 @@ class Branch(banks_pb2_grpc.RPCServicer):
 
     def Propagate_Withdraw(self, request, context):
         return self.MsgDelivery(request, context)
+
+    def Replicate(self, request_iterator, context):
+        """
+        Applies a peer's replication stream in order, delegating each propagation to MsgDelivery
+        and acking cumulatively.
+        """
+        for message in request_iterator:
+            self.MsgDelivery(message.request, context)
+            yield banks_pb2.ReplicationAck(sequence=message.sequence)
+
+    def Propagate_Batch(self, request, context):
+        """
+        Applies a batch of propagations in order, delegating each one to MsgDelivery.
+        """
+        response = banks_pb2.PropagationBatchResponse()
+        for entry in request.requests:
+            response.responses.append(self.MsgDelivery(entry, context))
+        return response
+
+    def Execute_Batch(self, request, context):
+        """
+        Executes a customer's operations in order, delegating each one to MsgDelivery,
+        so every operation is received, clocked and logged as its own request.
+        """
+        response = banks_pb2.OperationBatchResponse()
+        for operation in request.operations:
+            response.responses.append(self.MsgDelivery(getattr(operation, operation.WhichOneof("operation")), context))
+        return response
+
+    def Sync(self, request, context):
+        """
+        Barrier that returns once every propagation this branch sent before the call has been
+        acknowledged. Propagations sent after it do not hold it up, so it cannot starve under load.
+        """
+        with self.propagated:
+            sent = self.calls.issued
+            if not self.propagated.wait_for(lambda: self.calls.covers(sent), SYNC_TIMEOUT):
+                context.abort(grpc.StatusCode.DEADLINE_EXCEEDED, "timed out waiting for propagations")
+
+        return banks_pb2.SyncResponse()
     
     def Get_Log(self, request, context):
         """
-        Returns this branch's logged events.
+        Streams this branch's logged events from the request's offset, filtered to its
+        logical clock range and capped at its limit.
         """
-        response = banks_pb2.BranchLog()
+        return self.events(request)
 
-        for entry in self.log:
-            event = response.events.add()
-            event.customer_request_id = entry["customer-request-id"]
-            event.logical_clock = entry["logical_clock"]
-            event.interface = entry["interface"]
-            event.comment = entry["comment"]
 
-        return response
+    def read_log(self, offset) -> list:
+        """
+        Copies one page of log events starting at an index.
+
+        Args:
+            offset (int): Index of the first event.
+
+        Returns:
+            list[tuple]: Up to LOG_PAGE (request id, clock, kind, peer) events.
+        """
+        with self.lock:
+            return self.log.page(offset, LOG_PAGE)
+
+    def events(self, request):
+        """
+        Yields the log entries selected by a Get_Log request as BranchEvents, reading the
+        log a page at a time so the lock is never held while events are sent.
+
+        Args:
+            request (banks_pb2.BranchLogRequest): Offset, limit and logical clock range.
+
+        Yields:
+            banks_pb2.BranchEvent: Each selected event, tagged with its log index.
+        """
+        offset = request.offset
+        sent = 0
+        while True:
+            page = self.read_log(offset)
+            for index, (request_id, clock, kind, peer) in enumerate(page, offset):
+                if clock < request.min_clock or (request.max_clock and clock > request.max_clock):
+                    continue
+                if request.limit and sent == request.limit:
+                    return
+                sent += 1
+                interface, comment = render(kind, peer)    #comments are only built for exported events
+                yield banks_pb2.BranchEvent(
+                    customer_request_id=request_id,
+                    logical_clock=clock,
+                    interface=interface,
+                    comment=comment,
+                    index=index
+                )
+            if len(page) < LOG_PAGE:    #reached the end of the log
+                return
+            offset += len(page)
 
 
     def MsgDelivery(self, request, context):
@@ -157,16 +419,13 @@ class Branch(banks_pb2_grpc.RPCServicer):
         response = banks_pb2.TransactionResponse()
 
         if isinstance(request, banks_pb2.TransactionRequest):   #handle deposit or withdraw
-            self.clock = max(self.clock, request.clock) + 1 #Lamport recieve
-            
-            self.log_receipt(request)   #log receipt
-
-            if (request.amount + self.balance >= 0): #sufficient funds
-
-                self.balance += request.amount  #update local balance
+            with self.lock: #receive, log, apply and journal atomically
+                sufficient = self.receive(request)
+                sequence = self.journal(RECEIVED, request)
+            self.commit(sequence)   #make the receipt durable before acking or propagating it
 
-                if (request.id == self.id): #propagate customer requests
-                    self.propagate(request)
+            if sufficient and (request.id == self.id): #propagate customer requests outside the lock
+                self.propagate(request)
     
         return response
 
@@ -7,155 +7,251 @@ tfilewic
 Runs Customer events from input and writes output.
 """
 
-import json
+import functools
 import grpc
+import heapq
 import itertools
-from utilities import create_channel, import_file, OUTPUT_FILE
+from array import array
+from operator import itemgetter
+from utilities import close_channels, create_channel, export_items, get_option, load_items, map_ordered, wait_for_branches, READY_TIMEOUT, LOG_PAGE, METRICS_FILE, EVENT_BATCH
 from customer import Customer
-from time import sleep
+import metrics
 import banks_pb2
 import banks_pb2_grpc
 
-PROPAGATION_DELAY = 0.1
+CONCURRENCY = 1 #number of customers run at once (override with --concurrency=N)
 
 
 
-def process_customers(data) -> list[dict]:
+def run_customer(item: dict, batch: int = EVENT_BATCH) -> dict:
+    """
+    Executes one customer's requests and waits for its writes to propagate.
+
+    Args:
+        item (dict): The customer entry from the input file.
+        batch (int): Events sent per Execute_Batch call.
+
+    Returns:
+        dict: The customer's request log.
+    """
+    id = item.get("id")
+    events = item.get("customer-requests")
+    customer = Customer(id, events, batch)
+    customer.createStub()
+    customer_log = customer.executeEvents()
+    customer.awaitPropagation() #barrier on branch propagation
+    return customer_log
+
+
+def process_customers() -> list[dict]:
     """
     Executes all customer event sequences from the input file.
 
-    Reads customer entries from the input JSON, runs each customer's
-    defined events sequentially, filters failed transactions, prints
-    results for debugging, and collects all responses for export.
+    Streams customer entries from the input file, runs up to the configured
+    number of customers at once, and collects all request logs for export
+    in input order.
 
     Returns:
         list[dict]: A list of sent requests from each customer.
     """
-    #initialize list to store results
-    customer_events = []
+    customers = (item for item in load_items() if item.get("type") == "customer")
+    concurrency = int(get_option("concurrency", CONCURRENCY))
+    run = functools.partial(run_customer, batch=int(get_option("batch", EVENT_BATCH)))
+
+    #process all customer entries, keeping results in input order
+    return list(map_ordered(run, customers, concurrency))
+
+
+def fetch_log(stub, min_clock=0, max_clock=0, page=LOG_PAGE):
+    """
+    Streams a branch's log one page per Get_Log call, resuming each call after the last
+    event received, so no single call or message grows with the log.
+
+    Args:
+        stub (banks_pb2_grpc.RPCStub): Stub of the branch.
+        min_clock (int): Lowest logical clock to fetch.
+        max_clock (int): Highest logical clock to fetch (0 for no bound).
+        page (int): Most events requested per call.
+
+    Yields:
+        banks_pb2.BranchEvent: Each logged event in log order.
+    """
+    offset = 0
+    while True:
+        request = banks_pb2.BranchLogRequest(offset=offset, limit=page, min_clock=min_clock, max_clock=max_clock)
+        count = 0
+        for event in stub.Get_Log(request):
+            count += 1
+            offset = event.index + 1
+            yield event
+        if (count < page):  #no more matching events
+            return
+
+
+def branch_log(stub):
+    """
+    Converts a branch's paginated log stream to output events as it is fetched.
 
-    #process all customer entries
-    for item in data:
-        if item.get("type") == "customer":
-            id = item.get("id")
-            events = item.get("customer-requests")
-            customer = Customer(id, events)
-            customer.createStub()
-            customer_log = customer.executeEvents()
-            sleep(PROPAGATION_DELAY)    #wait for branch propagation
-            customer_events.append(customer_log)
+    Args:
+        stub (banks_pb2_grpc.RPCStub): Stub of the branch.
 
-    return customer_events
+    Yields:
+        dict: Each logged event in log order.
+    """
+    for event in fetch_log(stub):
+        yield {
+            "customer-request-id": event.customer_request_id,
+            "logical_clock": event.logical_clock,
+            "interface": event.interface,
+            "comment": event.comment
+        }
 
 
 def get_branch_events(data):
     """
-    Retrieves the logged events from each branch.
+    Lists the branch logs with their events fetched lazily, so each log is paged
+    from its branch only as it is written out.
 
     Args:
         data (list[dict]): The parsed input JSON containing customer and branch definitions.
 
-    Returns:
-        list[dict]: A list of dictionaries, one per branch, each containing
-                    the branch id, type, and its list of logged events.
+    Yields:
+        dict: The branch id, type and an iterator over its logged events, per branch.
     """
-    branch_events = []
     branches = [item["id"] for item in data if item.get("type") == "branch"]    #collect all branch ids
     for branch in branches:
-        channel =  create_channel(branch)
-        stub =  banks_pb2_grpc.RPCStub(channel)
-        log = stub.Get_Log(banks_pb2.Query())
-
-        #convert protobuf to dict
-        events = []
-        for event in log.events:
-            events.append({
-                "customer-request-id": event.customer_request_id,
-                "logical_clock": event.logical_clock,
-                "interface": event.interface,
-                "comment": event.comment
-            })
-
-        #add to list
-        branch_events.append({
+        stub = banks_pb2_grpc.RPCStub(create_channel(branch))
+        yield {
             "id" : branch,
             "type" : "branch",
-            "events" : events
-            })
-        
-    return branch_events
+            "events" : branch_log(stub)
+            }
 
 
-def calculate_event_chain(customer_events, branch_events):
+class EventChains:
     """
-    Builds the event chains for the output file.
+    Event chains, recorded as the customer and branch logs stream past.
 
-    Args:
-        customer_events (list): List of customer dictionaries.
-        branch_events (list): List of branch dictionaries.
+    Each chain is a flat array('q') of (logical clock, source index, label) triples
+    keyed by customer-request-id, with the interface and comment pair of every event
+    interned as a label, so the logs need not stay in memory until the chains are
+    written. Chains are created in the order the customers sent the requests. The
+    sources are recorded one after another and each ticks its clock as it logs, so a
+    chain is a run of clock-ordered triples per source; the runs are merged by clock
+    as the chain is written, and events with equal clocks keep source order.
+    """
+    def __init__(self, customer_events):
+        # (id, type) of each source log, indexed by source
+        self.sources = []
+        # (interface, comment) pairs indexed by label
+        self.labels = []
+        # label of each (interface, comment) pair
+        self.label_ids = {}
+        # flat (clock, source, label) triples per customer-request-id
+        self.chains = {}
 
-    Returns:
-        list: A list of event chains, where each chain is a list of events
-        grouped by customer-request-id and sorted by logical clock.
-    """
-    #flatten events so they contain top level fields
-    flattened_events = []
-    for source in customer_events + branch_events:
-        for event in source["events"]:
-            flattened_events.append({
-                "id" : source["id"],
-                "customer-request-id" : event["customer-request-id"],
-                "type" : source["type"],
-                "logical_clock" : event["logical_clock"],
-                "interface" : event["interface"],
-                "comment" : event["comment"]
-            })
-
-    #group events by request id 
-    chains = {}
-    for event in flattened_events:
-        request_id = event["customer-request-id"]
-        if request_id not in chains:
-            chains[request_id] = []
-        chains[request_id].append(event)
-
-    #sort chains by logical clock:
-    for request_id in chains:
-        chains[request_id].sort(key=lambda entry: entry["logical_clock"])
-
-    #convert dict to list
-    #return list(chains.values())
-    return list(itertools.chain.from_iterable(chains.values()))
-
-
-def export(customer_events, branch_events, event_chain):
-    """
-    Writes the processed customer responses to the output JSON file.
+        #create chains in the order the requests were sent
+        for source in customer_events:
+            for event in source["events"]:
+                self.chains.setdefault(event["customer-request-id"], array("q"))
+
+
+    def record(self, source):
+        """
+        Registers a source log and records each event into its chain as the events are consumed.
+
+        Args:
+            source (dict): A customer or branch log; its events may be a lazy iterator.
+
+        Returns:
+            dict: The source with its events passed through the recorder.
+        """
+        index = len(self.sources)
+        self.sources.append((source["id"], source["type"]))
+        return {**source, "events": self.recorded(index, source["events"])}
+
+    def recorded(self, index, events):
+        """
+        Passes a source's events through, appending each one to its request's chain.
+
+        Args:
+            index (int): Position of the source in the recorded sources.
+            events (iterable[dict]): The source's events.
+
+        Yields:
+            dict: Each event, unchanged.
+        """
+        for event in events:
+            pair = (event["interface"], event["comment"])
+            label = self.label_ids.get(pair)
+            if label is None:
+                label = self.label_ids[pair] = len(self.labels)
+                self.labels.append(pair)
+            chain = self.chains.setdefault(event["customer-request-id"], array("q"))
+            chain.extend((event["logical_clock"], index, label))
+            yield event
+
+
+    def __iter__(self):
+        """
+        Yields the chain events with their source fields at the top level, grouped by
+        customer-request-id and merged by logical clock within each chain.
+        """
+        for request_id, chain in self.chains.items():
+            triples = zip(chain[0::3], chain[1::3], chain[2::3])
+            runs = [list(run) for _, run in itertools.groupby(triples, key=itemgetter(1))]   #one clock-ordered run per source
+            for clock, index, label in heapq.merge(*runs, key=itemgetter(0)):   #ties keep source order
+                id, type = self.sources[index]
+                interface, comment = self.labels[label]
+                yield {
+                    "id" : id,
+                    "customer-request-id" : request_id,
+                    "type" : type,
+                    "logical_clock" : clock,
+                    "interface" : interface,
+                    "comment" : comment
+                }
+
+
+def export(customer_events, branch_events):
+    """
+    Writes the customer logs, branch logs and event chain to the output file. The
+    branch logs are streamed from the branches as they are written, and the chains
+    are recorded along the way and written out one event at a time.
 
     Args:
-        data (list[dict]): List of customer response dictionaries to save.
+        customer_events (list[dict]): Customer request logs.
+        branch_events (iterable[dict]): Branch event logs, with lazily fetched events.
     """
-    with open(OUTPUT_FILE, 'w') as file:
-        data = customer_events + branch_events + event_chain
-        json.dump(data, file, indent=2)
+    chains = EventChains(customer_events)
+    logs = (chains.record(source) for source in itertools.chain(customer_events, branch_events))
+    export_items(itertools.chain(logs, chains))
 
 
 def run():
     """
     Main client function.
     """
-    data = import_file()    #load input
-    customer_events = process_customers(data)   #run customers
-    branch_events = get_branch_events(data) #fetch branch logs
-    event_chain = calculate_event_chain(customer_events, branch_events) #build output
-    export(customer_events, branch_events, event_chain) #save output
+    data = [item for item in load_items() if item.get("type") == "branch"]  #load branches; customers are streamed when run
+    branches = [item["id"] for item in data]
+    wait_for_branches(branches, READY_TIMEOUT)  #wait until every branch is serving
+    customer_events = process_customers()   #run customers
+    branch_events = get_branch_events(data) #branch logs, fetched as they are written
+    export(customer_events, branch_events) #save output with the event chains
 
 
 #run when script called directly
 if __name__ == "__main__":  
+    metrics.setup(get_option("metrics", METRICS_FILE), client=True)
     try:
         run()
+    except grpc.FutureTimeoutError:
+        print("ERROR: Branch servers did not become ready.")
+        print("Ensure all branch servers are running before starting the client.")
+        exit(1)
     except grpc.RpcError as e:
         print(f"ERROR: {e.details()}")
         print("Ensure all branch servers are running before starting the client.")
-        exit(1)
\ No newline at end of file
+        exit(1)
+    finally:
+        close_channels()
\ No newline at end of file
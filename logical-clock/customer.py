@@ -9,7 +9,7 @@ Customer client logic and event execution.
 
 import banks_pb2
 import banks_pb2_grpc
-from utilities import create_channel, WITHDRAW, DEPOSIT
+from utilities import batched, create_channel, WITHDRAW, DEPOSIT, DEFAULT_ACCOUNT, EVENT_BATCH
 
 
 class Customer:
@@ -18,11 +18,13 @@ class Customer:
     Handles stub creation and sequential event execution based on the input file.
     """
     
-    def __init__(self, id, events):
+    def __init__(self, id, events, batch=EVENT_BATCH):
         # unique ID of the Customer
         self.id = id
         # events from the input
         self.events = events
+        # events sent per Execute_Batch call (1 sends each event as its own RPC)
+        self.batch = batch
         # pointer for the stub
         self.stub = None
         # a list of sent messages
@@ -39,6 +41,13 @@ class Customer:
         self.stub =  banks_pb2_grpc.RPCStub(channel)
 
 
+    def awaitPropagation(self):
+        """
+        Blocks until the branch has finished propagating this customer's writes.
+        """
+        self.stub.Sync(banks_pb2.SyncRequest())
+
+
     def executeEvents(self) -> dict:
         """
         Executes all customer events in order.
@@ -46,12 +55,15 @@ class Customer:
         Returns:
             dict: A dictionary containing the request log for this customer id.
         """
+        if (self.batch > 1):
+            return self.executeBatches()
 
         #process all events
         for event in self.events:
             self.clock += 1
             
             interface = event["interface"]
+            account_id = event.get("account", DEFAULT_ACCOUNT)  #accounts are optional in the input
             customer_request_id = event["customer-request-id"]
             entry = {
                 "customer-request-id" : customer_request_id,
@@ -63,12 +75,12 @@ class Customer:
 
             #handle deposits
             if interface == DEPOSIT:
-                request = banks_pb2.TransactionRequest(id=self.id, amount=event["money"], request_id=customer_request_id, clock=self.clock)
+                request = banks_pb2.TransactionRequest(id=self.id, amount=event["money"], request_id=customer_request_id, clock=self.clock, account_id=account_id)
                 self.stub.Deposit(request)
 
             #handle withdrawals
             elif interface == WITHDRAW:
-                request = banks_pb2.TransactionRequest(id=self.id, amount=-event["money"], request_id=customer_request_id, clock=self.clock)
+                request = banks_pb2.TransactionRequest(id=self.id, amount=-event["money"], request_id=customer_request_id, clock=self.clock, account_id=account_id)
                 self.stub.Withdraw(request)
 
             #ignore unsupported types
@@ -80,4 +92,45 @@ class Customer:
             "id": self.id, 
             "type": "customer",
             "events": self.log
+        }
+
+
+    def executeBatches(self) -> dict:
+        """
+        Executes all customer events in order, sending up to batch events per Execute_Batch call.
+        Every event still ticks the clock and carries its own timestamp, and the branch
+        receives the operations one by one exactly as the per-event RPCs.
+
+        Returns:
+            dict: A dictionary containing the request log for this customer id.
+        """
+        for events in batched(self.events, self.batch):
+            operations = []
+            for event in events:
+                self.clock += 1
+
+                interface = event["interface"]
+                account_id = event.get("account", DEFAULT_ACCOUNT)  #accounts are optional in the input
+                customer_request_id = event["customer-request-id"]
+                self.log.append({
+                    "customer-request-id" : customer_request_id,
+                    "logical_clock" : self.clock,
+                    "interface" : interface,
+                    "comment" : f"event_sent from customer {self.id}"
+                })
+
+                if interface == DEPOSIT:
+                    request = banks_pb2.TransactionRequest(id=self.id, amount=event["money"], request_id=customer_request_id, clock=self.clock, account_id=account_id)
+                    operations.append(banks_pb2.Operation(deposit=request))
+                elif interface == WITHDRAW:
+                    request = banks_pb2.TransactionRequest(id=self.id, amount=-event["money"], request_id=customer_request_id, clock=self.clock, account_id=account_id)
+                    operations.append(banks_pb2.Operation(withdraw=request))
+
+            if operations:
+                self.stub.Execute_Batch(banks_pb2.OperationBatch(operations=operations))
+
+        return {
+            "id": self.id,
+            "type": "customer",
+            "events": self.log
         }
\ No newline at end of file
@@ -0,0 +1,261 @@
+"""
+outbox.py
+CSE 531 - Logical Clock Project
+tfilewic
+2026-10-18
+
+Per-peer outbound channels that batch or stream propagation requests.
+"""
+
+import collections
+import grpc
+import queue
+import threading
+from concurrent import futures
+from time import monotonic
+import banks_pb2
+from utilities import BATCH_SIZE, BATCH_WINDOW
+
+
+class PeerOutbox:
+    """
+    Coalesces propagation requests bound for one peer into Propagate_Batch calls.
+
+    A background thread flushes the queue once it holds a full batch or the
+    flush window since the first queued request has elapsed. Only one batch
+    is in flight per peer, so requests reach the peer in the order they were sent.
+    """
+    def __init__(self, stub, size=BATCH_SIZE, window=BATCH_WINDOW):
+        # stub of the peer branch
+        self.stub = stub
+        # most requests sent in one batch
+        self.size = size
+        # seconds a partial batch waits for more requests
+        self.window = window
+        # queued (request, future) pairs awaiting a flush
+        self.pending = []
+        # notified when requests are queued
+        self.queued = threading.Condition()
+        # whether the outbox is closed and the flush loop should exit once drained
+        self.closed = False
+
+        # start the flush thread
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+
+    def depth(self) -> int:
+        """
+        Returns the number of requests waiting to be flushed.
+        """
+        return len(self.pending)
+
+
+    def send(self, request) -> futures.Future:
+        """
+        Queues a propagation request for the next batch.
+
+        Args:
+            request: The propagation request message.
+
+        Returns:
+            futures.Future: Resolves to the peer's response for this request.
+        """
+        future = futures.Future()
+        with self.queued:
+            self.pending.append((request, future))
+            if (len(self.pending) == 1 or len(self.pending) >= self.size):  #start the window or flush early
+                self.queued.notify()
+        return future
+
+
+    def close(self):
+        """
+        Stops the flush loop once the queued requests are sent. Called before the peer channel closes.
+        """
+        with self.queued:
+            self.closed = True
+            self.queued.notify()
+        self.thread.join()
+
+
+    def run(self):
+        """
+        Flush loop: waits for queued requests, lets the batch fill for up to the window, then sends it.
+        """
+        while True:
+            with self.queued:
+                while not self.pending:
+                    if self.closed:
+                        return
+                    self.queued.wait()
+
+                deadline = monotonic() + self.window
+                while len(self.pending) < self.size and not self.closed:
+                    remaining = deadline - monotonic()
+                    if (remaining <= 0):
+                        break
+                    self.queued.wait(remaining)
+
+                batch = self.pending[:self.size]
+                del self.pending[:self.size]
+
+            self.flush(batch)
+
+
+    def flush(self, batch):
+        """
+        Sends one batch and resolves the futures of its requests.
+
+        Args:
+            batch (list): The (request, future) pairs to send.
+        """
+        message = banks_pb2.PropagationBatch(requests=[request for request, _ in batch])
+        try:
+            reply = self.stub.Propagate_Batch(message)
+        except grpc.RpcError as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        for (_, future), response in zip(batch, reply.responses):
+            future.set_result(response)
+
+
+class ReplicationStream:
+    """
+    Pipelines propagation requests to one peer over a long-lived Replicate stream.
+
+    Requests are numbered per stream and many can be in flight at once. The
+    peer applies them in order and replies with cumulative acks, each of which
+    resolves every pending request up to its sequence number. If the stream
+    breaks, pending requests fail and later ones use the unary propagation RPCs.
+
+    The stream is created with the branch but only dialed on the first send,
+    so peers that are still starting up are not connected to early.
+    """
+    def __init__(self, stub):
+        # stub of the peer branch
+        self.stub = stub
+        # sequence number of the last request sent on the stream
+        self.sequence = 0
+        # sent but unacknowledged (request, future) pairs keyed by sequence number
+        self.unacked = collections.OrderedDict()
+        # messages waiting to be written to the stream (None ends it)
+        self.outgoing = queue.SimpleQueue()
+        # whether the stream has failed and sends fall back to unary calls
+        self.broken = False
+        # guards sequence numbering and the unacked map
+        self.lock = threading.Lock()
+        # ack iterator of the open stream (None until the first send)
+        self.acks = None
+
+
+    def depth(self) -> int:
+        """
+        Returns the number of requests sent but not yet acknowledged.
+        """
+        return len(self.unacked)
+
+
+    def open(self):
+        """
+        Opens the Replicate call and starts the ack loop. Must be called with the lock held.
+        """
+        self.acks = self.stub.Replicate(self.messages(), wait_for_ready=True)
+        threading.Thread(target=self.receive, daemon=True).start()
+
+
+    def send(self, request) -> futures.Future:
+        """
+        Sends a propagation request on the stream.
+
+        Args:
+            request: The propagation request message.
+
+        Returns:
+            futures.Future: Resolves once the peer has acknowledged the request.
+        """
+        with self.lock:
+            if self.broken:
+                return self.fallback(request)
+            if self.acks is None:
+                self.open()
+
+            future = futures.Future()
+            self.sequence += 1
+            self.unacked[self.sequence] = (request, future)
+            self.outgoing.put(banks_pb2.ReplicationMessage(sequence=self.sequence, request=request))
+        return future
+
+
+    def close(self):
+        """
+        Ends the stream, failing requests that are still unacknowledged. Called before the peer channel closes.
+        """
+        with self.lock:
+            self.broken = True
+            acks = self.acks
+        if acks is not None:
+            acks.cancel()   #the ack loop fails the pending requests and ends the request iterator
+
+
+    def messages(self):
+        """
+        Request iterator for the stream; yields queued messages until the stream is closed.
+        """
+        while True:
+            message = self.outgoing.get()
+            if message is None:
+                return
+            yield message
+
+
+    def receive(self):
+        """
+        Ack loop: resolves pending requests as cumulative acks arrive and fails them if the stream breaks.
+        """
+        error = None
+        try:
+            for ack in self.acks:
+                with self.lock:
+                    acked = []
+                    while self.unacked and next(iter(self.unacked)) <= ack.sequence:
+                        acked.append(self.unacked.popitem(last=False)[1])
+
+                for _, future in acked:
+                    future.set_result(ack)
+        except grpc.RpcError as e:
+            error = e
+
+        with self.lock:
+            self.broken = True
+            pending = list(self.unacked.values())
+            self.unacked.clear()
+        self.outgoing.put(None) #end the request iterator
+
+        for _, future in pending:
+            future.set_exception(error or ConnectionError("replication stream closed"))
+
+
+    def fallback(self, request) -> futures.Future:
+        """
+        Sends a request with the unary Propagate_Deposit/Propagate_Withdraw RPCs.
+
+        Args:
+            request: The propagation request message.
+
+        Returns:
+            futures.Future: Resolves to the peer's response.
+        """
+        future = futures.Future()
+        method = self.stub.Propagate_Deposit if (request.amount > 0) else self.stub.Propagate_Withdraw
+
+        def resolve(call):
+            if call.exception() is not None:
+                future.set_exception(call.exception())
+            else:
+                future.set_result(call.result())
+
+        method.future(request).add_done_callback(resolve)
+        return future
@@ -0,0 +1,47 @@
+"""
+test_event_log.py
+CSE 531 - Logical Clock Project
+tfilewic
+2026-10-18
+
+Tests for the columnar event log.
+"""
+
+from event_log import EventLog, render, RECV_DEPOSIT, RECV_PROPAGATE_WITHDRAW, SENT_PROPAGATE_DEPOSIT
+
+
+def sample() -> EventLog:
+    log = EventLog()
+    log.append(1, 1, RECV_DEPOSIT, 4)
+    log.append(1, 2, SENT_PROPAGATE_DEPOSIT, 2)
+    log.append(7, 9, RECV_PROPAGATE_WITHDRAW, 3)
+    return log
+
+
+def test_page():
+    log = sample()
+    assert len(log) == 3
+    assert log.page(1, 10) == [(1, 2, SENT_PROPAGATE_DEPOSIT, 2), (7, 9, RECV_PROPAGATE_WITHDRAW, 3)]
+    assert log.page(3, 10) == []
+
+
+def test_render():
+    assert render(RECV_DEPOSIT, 4) == ("deposit", "event_recv from customer 4")
+    assert render(SENT_PROPAGATE_DEPOSIT, 2) == ("propagate_deposit", "event_sent to branch 2")
+
+
+def test_dump_load_round_trip():
+    log = sample()
+    prefix = b"clock"
+    data = prefix + log.dump() + b"rest"
+    loaded, offset = EventLog.load(data, len(prefix))
+    assert data[offset:] == b"rest"
+    assert loaded.page(0, len(log)) == log.page(0, len(log))
+
+    loaded.append(8, 10, RECV_DEPOSIT, 5)   #the loaded log keeps appending
+    assert len(loaded) == 4 and len(log) == 3
+
+
+def test_empty_dump_load_round_trip():
+    loaded, offset = EventLog.load(EventLog().dump())
+    assert len(loaded) == 0 and offset == len(EventLog().dump())